@@ -1,12 +1,15 @@
 import json
 import logging
 import numpy as np
+import re
 import warnings
 
 from copy import deepcopy
 from datetime import datetime
-from sklearn.feature_extraction.text import CountVectorizer
 
+from bloc.markov_scorer import BLOCMarkovScorer
+from bloc.tokenizer import get_bloc_token_spec
+from bloc.tokenizer import replace_symbols
 from bloc.util import genericErrorInfo
 from bloc.util import get_color_txt
 from bloc.util import getDictFromJsonGZ
@@ -37,6 +40,7 @@ class BLOCMarkovChain:
         self.init_prob_dist = init_prob_dist
         self.training_model = training_model
         self.model_label = model_label
+        self.scorer = None
 
         BLOCMarkovChain.validate_prob_params(self.states, self.transition_matrix, self.init_prob_dist)
     
@@ -77,24 +81,158 @@ class BLOCMarkovChain:
         return valid_flag
 
     @staticmethod
-    def train_markov_model(sequence_lst, model_output_filename=None, model_label=''):
-        
-        ngram_freq = BLOCMarkovChain.get_ngram_freq(sequence_lst)
-        mk_freq_mat = BLOCMarkovChain.get_markov_freq_matrix(ngram_freq)
+    def train_markov_model(sequence_lst, model_output_filename=None, model_label='', training_model=None):
+
+        '''
+            Returns the training model (vocab, start_dist, markov_freq_matrix) of sequence_lst, same as get_markov_freq_matrix( get_ngram_freq(sequence_lst) ).
+            training_model: counts of sequence_lst are added to this model (see partial_fit())
+        '''
+        mk_freq_mat = BLOCMarkovChain.count_transitions(sequence_lst, training_model=training_model)
 
         if( model_output_filename is not None ):
-            if( 'markov_freq_matrix' in mk_freq_mat ):
+            mk_freq_mat['model_label'] = model_label
+            BLOCMarkovChain.save_training_model(model_output_filename, mk_freq_mat)
 
-                mk_freq_mat['markov_freq_matrix'] = list( mk_freq_mat['markov_freq_matrix'] )
+        return mk_freq_mat
 
-                for i in range( len(mk_freq_mat['markov_freq_matrix']) ):
-                    mk_freq_mat['markov_freq_matrix'][i] = [ float(a) for a in mk_freq_mat['markov_freq_matrix'][i] ]
+    @staticmethod
+    def save_models(filename, models, labels=None):
 
-                mk_freq_mat['model_label'] = model_label
-                mk_freq_mat['model_created_at_utc'] = datetime.utcnow().isoformat().split('.')[0] + 'Z'
-                gzipTextFile(model_output_filename, json.dumps(mk_freq_mat, ensure_ascii=False))
+        '''
+            Save models (list of BLOCMarkovChain or training models, or {label: model}) to a binary (.npz) bundle, see BLOCMarkovModelBundle
+        '''
+        #imported here since bloc.markov_bundle imports BLOCMarkovChain
+        from bloc.markov_bundle import BLOCMarkovModelBundle
+        BLOCMarkovModelBundle.from_models(models, labels=labels).save(filename)
 
-        return mk_freq_mat
+    @staticmethod
+    def save_training_model(filename, training_model):
+
+        '''
+            Save the (un-smoothed) training model to a binary bundle (.npz) or gzip JSON (other filenames)
+        '''
+        if( filename.endswith('.npz') ):
+            BLOCMarkovChain.save_models( filename, [training_model] )
+            return
+
+        payload = BLOCMarkovChain.count_transitions( [], training_model=training_model )
+        del payload['un_smoothed_markov_freq_matrix']
+        payload['markov_freq_matrix'] = [ [ float(a) for a in row ] for row in payload['markov_freq_matrix'] ]
+        payload['model_label'] = training_model.get('model_label', '')
+        payload['model_created_at_utc'] = datetime.utcnow().isoformat().split('.')[0] + 'Z'
+        gzipTextFile( filename, json.dumps(payload, ensure_ascii=False) )
+
+    def save(self, filename):
+        BLOCMarkovChain.save_training_model( filename, {**self.training_model, 'model_label': self.model_label} )
+
+    @staticmethod
+    def load(filename, mmap=True):
+
+        '''
+            Load model saved by save()/train_markov_model(), .npz bundles return their first model (see BLOCMarkovModelBundle.load() for bundles of many models)
+        '''
+        if( filename.endswith('.npz') ):
+            from bloc.markov_bundle import BLOCMarkovModelBundle
+            bundle = BLOCMarkovModelBundle.load(filename, mmap=mmap)
+            return None if bundle is None or len(bundle) == 0 else bundle.get_model(0)
+
+        training_model = getDictFromJsonGZ(filename)
+        if( len(training_model) == 0 ):
+            return None
+
+        return BLOCMarkovChain( model=training_model, model_label=training_model.get('model_label', '') )
+
+    @staticmethod
+    def get_sequence_tokens(sequence_lst, token_pattern=r'[^ |()*]', lowercase=False):
+
+        '''
+            Returns (sorted states, state ids of the tokens of all sequences, token count per sequence), tokens are the same as CountVectorizer(token_pattern=token_pattern, lowercase=lowercase)'s unigrams
+        '''
+        if( lowercase is True ):
+            sequence_lst = [ s.lower() for s in sequence_lst ]
+
+        spec = get_bloc_token_spec(token_pattern)
+        if( spec is not None and spec[0] == 'char' ):
+            texts = [ replace_symbols(s, spec[1]) for s in sequence_lst ]
+            lengths = np.fromiter( map(len, texts), dtype=np.int64, count=len(texts) )
+            codes = np.frombuffer( ''.join(texts).encode('utf-32-le'), dtype='<u4' )
+            states, ids = np.unique(codes, return_inverse=True)
+            return [ chr(c) for c in states ], ids.ravel().astype(np.int64), lengths
+
+        token_pattern = re.compile(token_pattern)
+        tokens = [ token_pattern.findall(s) for s in sequence_lst ]
+        lengths = np.fromiter( map(len, tokens), dtype=np.int64, count=len(tokens) )
+        states = sorted( set(t for doc in tokens for t in doc) )
+        state_index = { s: i for i, s in enumerate(states) }
+        ids = np.fromiter( (state_index[t] for doc in tokens for t in doc), dtype=np.int64, count=int(lengths.sum()) )
+
+        return states, ids, lengths
+
+    @staticmethod
+    def count_transitions(sequence_lst, token_pattern=r'[^ |()*]', lowercase=False, training_model=None):
+
+        '''
+            Single-pass replacement of get_markov_freq_matrix( get_ngram_freq(sequence_lst) ): transitions (bigrams of consecutive tokens of a sequence) are counted into an integer matrix with np.add.at().
+            training_model: add the counts of sequence_lst to the (un-smoothed) counts of this model, the result is the same as training on all sequences at once
+        '''
+        states, ids, lengths = BLOCMarkovChain.get_sequence_tokens(sequence_lst, token_pattern=token_pattern, lowercase=lowercase)
+
+        start_dist = {}
+        old_states = []
+        if( training_model is not None ):
+            start_dist = { s: c for s, c in training_model.get('start_dist', {}).items() if c != 0 }
+
+        if( training_model is not None and len(training_model.get('vocab', [])) != 0 ):
+            #mle_get_markov_params() smooths markov_freq_matrix and appends unseen states (with no counts) to vocab
+            old_freq_mat = np.asarray( training_model.get('un_smoothed_markov_freq_matrix', training_model['markov_freq_matrix']) )
+            old_states = training_model['vocab'][:old_freq_mat.shape[0]]
+
+        for seq in sequence_lst:
+            if( seq != '' ):
+                start_dist[ seq[0] ] = start_dist.get( seq[0], 0 ) + 1
+
+        if( len(old_states) != 0 ):
+            all_states = sorted( set(old_states).union(states) )
+            state_index = { s: i for i, s in enumerate(all_states) }
+            ids = np.array( [ state_index[s] for s in states ], dtype=np.int64 )[ids]
+        else:
+            all_states = states
+
+        n = len(all_states)
+        markov_freq_matrix = np.zeros( (n, n), dtype=np.int64 )
+
+        if( len(old_states) != 0 ):
+            old_ids = np.array( [ state_index[s] for s in old_states ], dtype=np.int64 )
+            markov_freq_matrix[np.ix_(old_ids, old_ids)] = np.rint(old_freq_mat).astype(np.int64)
+
+        #a token and the next token of the same sequence form a transition
+        is_last = np.zeros( len(ids), dtype=bool )
+        is_last[ np.cumsum(lengths)[lengths != 0] - 1 ] = True
+        pairs = np.nonzero( ~is_last )[0]
+        np.add.at( markov_freq_matrix, (ids[pairs], ids[pairs + 1]), 1 )
+
+        for s in all_states:
+            start_dist.setdefault(s, 0)
+
+        return {
+            'vocab': all_states,
+            'start_dist': start_dist,
+            'un_smoothed_markov_freq_matrix': markov_freq_matrix.copy(),
+            'markov_freq_matrix': markov_freq_matrix
+        }
+
+    def partial_fit(self, sequence_lst):
+
+        '''
+            Add the transitions of sequence_lst to the training model, prob_of_sequence()/compile() use the updated model
+        '''
+        self.training_model = BLOCMarkovChain.count_transitions(sequence_lst, training_model=self.training_model)
+        self.states = None
+        self.init_prob_dist = None
+        self.transition_matrix = None
+        self.scorer = None
+
+        return self
 
     @staticmethod
     def mle_get_markov_params( markov_freq_mat, unknown_seq ):
@@ -289,6 +427,7 @@ class BLOCMarkovChain:
 
 
         try:
+            from sklearn.feature_extraction.text import CountVectorizer
             count_vectorizer = CountVectorizer(
                 stop_words=None, 
                 token_pattern=token_pattern, 
@@ -297,7 +436,7 @@ class BLOCMarkovChain:
             )
 
             payload['tf_matrix'] = count_vectorizer.fit_transform(sequence_lst).toarray()
-            payload['vocab'] = count_vectorizer.get_feature_names()
+            payload['vocab'] = count_vectorizer.get_feature_names_out().tolist()
 
             #convert types for JSON serialization - start
             for opt in ['tf_matrix']:
@@ -342,7 +481,8 @@ class BLOCMarkovChain:
         else:
             #Attempt to instantiate states or init_prob_dist or transition_matrix from training_model
             markov_params = BLOCMarkovChain.mle_get_markov_params(self.training_model, sequence)
-            
+            self.scorer = None
+
             self.states = markov_params.get('vocab', None)
             self.init_prob_dist = markov_params.get('start_prob_dist', None)
             self.transition_matrix = markov_params.get('markov_trans_prob_matrix', None)
@@ -373,102 +513,34 @@ class BLOCMarkovChain:
             
 
 
-        if( isinstance(sequence, str) ):
-            sequence = list(sequence)
+        state_index = { s: i for i, s in enumerate(self.states) }
+        indices = np.array( [ state_index[s] for s in sequence ], dtype=np.int64 )
+        prob = np.log( np.asarray(self.init_prob_dist)[indices[0]] ) + np.log( np.asarray(self.transition_matrix)[indices[:-1], indices[1:]] ).sum()
 
-        start = sequence[0]
-        prob = self.states.index( start )
-        prob = self.init_prob_dist[ prob ]
+        return prob if log_prob is True else np.exp(prob)
 
-        if( log_prob is True ):
-            prob = np.log(prob)
-        
-        #logger.info( '\nprob_of_sequence():' )
-        #logger.info( '\tstates: {}'.format(self.states) )
-        #logger.info( '\tP({}):'.format(sequence) )
-        #logger.info( '\n\tP({}) = {:4f}'.format(start, prob) )
-        for i in range( 1, len(sequence) ):
-            
-            cur_indx = self.states.index( sequence[i-1] )
-            next_indx = self.states.index( sequence[i] )
-            trans_prob = self.transition_matrix[cur_indx, next_indx]
-            na = 1 if self.training_model['un_smoothed_markov_freq_matrix'][cur_indx, next_indx] == 0 else 0
-            
-            if( log_prob is True ):
-                trans_prob = np.log( trans_prob )
-                prob += trans_prob
-            else:
-                prob *= trans_prob
-            
-            #logger.info( '\tP({}|{}) = {:.4f} (NA: {})'.format(sequence[i], sequence[i-1], trans_prob, na) )
+    def compile(self):
 
-        return prob
+        '''
+            Returns the BLOCMarkovScorer of the training model (see s_prob_of_sequence()), built once and reused until the training model is re-smoothed by prob_of_sequence()
+        '''
+        if( self.training_model is None ):
+            return None
+
+        if( self.scorer is None ):
+            self.scorer = BLOCMarkovScorer(self.training_model)
+
+        return self.scorer
 
     @staticmethod
     def s_prob_of_sequence(training_model, sequence, log_prob=True):
-                
-        #Attempt to instantiate states or init_prob_dist or transition_matrix from training_model
-        markov_params = BLOCMarkovChain.mle_get_markov_params(deepcopy(training_model), sequence)
-        
-        states = markov_params.get('vocab', None)
-        init_prob_dist = markov_params.get('start_prob_dist', None)
-        transition_matrix = markov_params.get('markov_trans_prob_matrix', None)
-        un_smoothed_markov_freq_matrix = markov_params.get('un_smoothed_markov_freq_matrix', None)
-
-        #print('\t\tv:', states)
-        #print('\t\ts:', markov_params.get('start_dist', None))
-        #if( BLOCMarkovChain.validate_prob_params(states, transition_matrix, init_prob_dist) is False ):
-        #    return None
-        #print('vocab/states:', states)
-        #print('markov_freq_matrix:\n', markov_params['markov_freq_matrix'])
-        #print('transition_matrix:\n', transition_matrix)
-
-
-        if( isinstance(sequence, str) ):
-            sequence = list(sequence)
-
-        start = sequence[0]
-        prob = states.index( start )
-        prob = init_prob_dist[ prob ]
-        #prob = [1/len(states)]*len(states)
-
-        if( log_prob is True ):
-            prob = np.log(prob)
-        
-        
-        #logger.info( '\nprob_of_sequence():' )
-        #logger.info( '\tstates: {}'.format(states) )
-        #logger.info( '\tP({}):'.format(sequence) )
-        #logger.info( '\n\tP({}) = {:4f}'.format(start, prob) )
-        
-        #print( '\nprob_of_sequence():' )
-        #print( '\tstates: {}'.format(states) )
-        #print( '\tP({}):'.format(sequence) )
-        #print( '\n\tP({}) = {:4f}'.format(start, prob) )
-        #print('un_smoothed_markov_freq_matrix:\n', un_smoothed_markov_freq_matrix)
-        #print('\ntransition_matrix:')
-        #print(transition_matrix)
-
-        for i in range( 1, len(sequence) ):
-            
-            cur_indx = states.index( sequence[i-1] )
-            next_indx = states.index( sequence[i] )
-            trans_prob = transition_matrix[cur_indx, next_indx]
-
-            #print('\tcur_indx:', cur_indx)
-            #print('\tnext_indx:', next_indx)
-            #print()
-            #na = 1 if un_smoothed_markov_freq_matrix[cur_indx, next_indx] == 0 else 0
-
-            if( log_prob is True ):
-                trans_prob = np.log( trans_prob )
-                prob += trans_prob
-            else:
-                prob *= trans_prob
-            
-            #logger.info( '\tP({}|{}) = {:.4f} (NA: {})'.format(sequence[i], sequence[i-1], trans_prob, na) )
 
-        return prob
+        '''
+            Probability of sequence given training_model (a training model dict or its BLOCMarkovScorer, e.g., from compile()), without updating training_model with the unseen states of sequence.
+            To score many sequences, pass the BLOCMarkovScorer, so the smoothed log-probabilities are computed once.
+        '''
+        scorer = training_model if isinstance(training_model, BLOCMarkovScorer) else BLOCMarkovScorer(training_model)
+        return scorer.prob_of_sequence(sequence, log_prob=log_prob)
 
     @staticmethod
     def matrix_to_str( matrix, col_mat, vocab, model_label, mat_name ):
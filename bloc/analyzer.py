@@ -13,8 +13,8 @@ from bloc.util import get_tf_matrix
 from bloc.util import update_bloc_model
 
 from bloc.MarkovChain import BLOCMarkovChain
+from bloc.markov_scorer import BLOCMarkovBatchScorer
 
-from sklearn.metrics import pairwise_distances
 
 logger = logging.getLogger('bloc.bloc')
 
@@ -377,9 +377,9 @@ def get_markov_chains_for_bloc_dims(segment_seqs):
     mkv_inputs = {}
     for segment in segment_seqs:
         for dim, bloc_seq in segment.items():
+            bloc_seq = re.sub(r'[ |()*]', '', bloc_seq)
             if( bloc_seq != '' ):
 
-                bloc_seq = re.sub(r'[ |()*]', '', bloc_seq)
                 mkv_inputs.setdefault(dim, [])
                 mkv_inputs[dim].append(bloc_seq)
 
@@ -400,20 +400,19 @@ def get_src_tgt_mkv_dist(mc_src, mc_tgt):
         if( dim in mc_tgt ):
 
             good_prob_flag = True
-            prob_src_tgt = BLOCMarkovChain.prob_of_sequence( mc_src[dim]['model'].training_model, mc_tgt[dim]['training_seq'], log_prob=True )
+            prob_src_tgt = BLOCMarkovChain.s_prob_of_sequence( mc_src[dim]['model'].compile(), mc_tgt[dim]['training_seq'], log_prob=True )
             prob_src_tgt = prob_src_tgt/len(mc_tgt[dim]['training_seq'])
 
-            prob_tgt_src = BLOCMarkovChain.prob_of_sequence(mc_tgt[dim]['model'].training_model, mc_src[dim]['training_seq'], log_prob=True)
+            prob_tgt_src = BLOCMarkovChain.s_prob_of_sequence(mc_tgt[dim]['model'].compile(), mc_src[dim]['training_seq'], log_prob=True)
             prob_tgt_src = prob_tgt_src/len(mc_src[dim]['training_seq'])
 
             total_src_tgt_prob_all_models += (prob_src_tgt+prob_tgt_src)/2
             
     return total_src_tgt_prob_all_models, good_prob_flag
 
-def pairwise_pred_prob_multi_markvov( tf_matrix ):
+def pairwise_pred_prob_multi_markvov( tf_matrix, block_size=256 ):
     
     X = len(tf_matrix)
-    pred_prob_matrix = []
 
     '''
         ' * ':  separates bloc dimenensions
@@ -426,24 +425,32 @@ def pairwise_pred_prob_multi_markvov( tf_matrix ):
             segment 2: T⚁T⚁T⚁T⚁T⚁T⚁T⚁T⚁T⚁T⚁T⚁T⚁T⚁T⚁T⚁T⚁T⚁T⚁T⚁T * tt(Ht)tttt(Ht)t(Ht)(Ht)ttttttttt
     '''
     
+    #train the chains of each user once, then score all (model, sequence) pairs of a BLOC dimension in one batch
+    mkv_chains = []
     for i in range(X):
+        logger.info( '\tpairwise_pred_prob_multi_markvov(), training user: {} of {}'.format(i, X) )
+        mkv_chains.append( get_markov_chains_for_bloc_dims( tf_matrix[i]['text_structured'] ) )
 
-        print( '\tpairwise_pred_prob(), user: {} of {}'.format(i, X) )
-        
-        pred_prob_matrix.append([])
-        mc_src = get_markov_chains_for_bloc_dims( tf_matrix[i]['text_structured'] )
+    pred_prob_matrix = np.zeros( (X, X) )
+    good_prob_flag = np.zeros( (X, X), dtype=bool )
+    dims = list( dict.fromkeys(dim for mc in mkv_chains for dim in mc) )
 
-        for j in range(X):
+    for dim in dims:
 
-            mc_tgt = get_markov_chains_for_bloc_dims( tf_matrix[j]['text_structured'] )
-            total_src_tgt_prob_all_models, good_prob_flag = get_src_tgt_mkv_dist( mc_src, mc_tgt )
+        users = [ i for i in range(X) if dim in mkv_chains[i] ]
+        seqs = [ mkv_chains[i][dim]['training_seq'] for i in users ]
+        logger.info( '\tpairwise_pred_prob_multi_markvov(), scoring dim: {}, {} users'.format(dim, len(users)) )
 
-            if( good_prob_flag ):
-                pred_prob_matrix[-1].append( total_src_tgt_prob_all_models )
-            else:
-                pred_prob_matrix[-1].append( -1000 )
+        #scores[k, q]: log prob of user q's sequence given user k's model, per symbol
+        scores = BLOCMarkovBatchScorer( [ mkv_chains[i][dim]['model'] for i in users ], block_size=block_size ).score(seqs)
+        scores = scores/np.array( [ len(s) for s in seqs ] )[None, :]
 
-    return pred_prob_matrix
+        pair_indx = np.ix_(users, users)
+        pred_prob_matrix[pair_indx] += (scores + scores.T)/2
+        good_prob_flag[pair_indx] = True
+
+    pred_prob_matrix[~good_prob_flag] = -1000
+    return pred_prob_matrix.tolist()
 
 def pairwise_pred_prob( tf_matrix ):
     
@@ -523,6 +530,7 @@ def analyze_ngram_vectors( tf_matrix, matrix_key='tf_matrix_normalized', analyze
 
     X = np.array([ user['tf_vector'] for user in tf_matrix[matrix_key] ])
 
+    from sklearn.metrics import pairwise_distances
     distance_matrix = pairwise_distances( X, metric='euclidean' )#site 1
     prob_seq_matrix = pairwise_pred_prob( tf_matrix[matrix_key] )
 
@@ -5,6 +5,7 @@ import sys
 from copy import deepcopy
 from numpy import linalg as LA
 from scipy.spatial import distance
+from scipy.sparse import csr_matrix
 from sklearn.metrics import confusion_matrix
 from sklearn.metrics import accuracy_score, recall_score, f1_score
 from sklearn.metrics import classification_report
@@ -292,32 +293,37 @@ def predict_user_class_tfidf(training_doc_lst, test_doc_lst, model, **kwargs):
         return {}
 
     
-    train_test_tf_mat = get_bloc_variant_tf_matrix(
-        training_doc_lst + test_doc_lst,
-        model['ngram'],
-        token_pattern=model['token_pattern'],
-        bloc_variant=model['bloc_variant'],
-        min_df=min_df,
-        add_all_docs=False
-    )
+    #vectorizer_model (BLOCVectorizerModel): fitted (if not already) on training_doc_lst only instead of refitting on training_doc_lst + test_doc_lst
+    vectorizer_model = kwargs.get('vectorizer_model', None)
+    if( vectorizer_model is None ):
+        train_test_tf_mat = get_bloc_variant_tf_matrix(
+            training_doc_lst + test_doc_lst,
+            model['ngram'],
+            token_pattern=model['token_pattern'],
+            bloc_variant=model['bloc_variant'],
+            min_df=min_df,
+            add_all_docs=False,
+            compact_tf_matrix=True
+        )
+    else:
+        if( vectorizer_model.is_fitted() is False ):
+            vectorizer_model.fit(training_doc_lst)
+        train_test_tf_mat = vectorizer_model.transform(training_doc_lst + test_doc_lst)
     
-    if( is_invalidate_matrix( matrix_key, train_test_tf_mat ) ):
-        logger.warning(' is_invalidate_matrix( matrix_key, train_test_tf_mat ), returning')
+    if( isinstance(train_test_tf_mat, dict) or matrix_key not in train_test_tf_mat ):
+        logger.warning(f' {matrix_key} not in train_test_tf_mat, returning')
         return {}
 
-    if( len(train_test_tf_mat[matrix_key]) == 0 ):
+    if( len(train_test_tf_mat) == 0 ):
         logger.warning(' train_test_tf_mat is empty, returning')
         return {}
 
-    details['vocab'] = train_test_tf_mat['vocab']
+    details['vocab'] = train_test_tf_mat.vocab
+    tf_mat = train_test_tf_mat.get_matrix(matrix_key)
+    user_ids = train_test_tf_mat.get_meta('user_id')
     #get centroids for training models - start
     for src in train_per_src_doc:
-        cent = np.zeros( len(details['vocab']) )
-        for indx in train_per_src_doc[src]['user_indices']:
-            cent += train_test_tf_mat[matrix_key][indx]['tf_vector']
-        
-        cent = cent / len(train_per_src_doc[src]['user_indices'])
-        train_per_src_doc[src]['centroid'] = cent
+        train_per_src_doc[src]['centroid'] = np.asarray( tf_mat[ train_per_src_doc[src]['user_indices'] ].mean(axis=0) )[0]
     #get centroids for training models - end
 
     all_train_classes = list(all_train_classes)
@@ -334,11 +340,11 @@ def predict_user_class_tfidf(training_doc_lst, test_doc_lst, model, **kwargs):
         classname = u['class']
         test_tf_mat_indx = len(training_doc_lst) + i#because training_doc_lst + test_doc_lst
 
-        if( u['user_id'] != train_test_tf_mat[matrix_key][test_tf_mat_indx]['user_id'] ):
+        if( u['user_id'] != user_ids[test_tf_mat_indx] ):
             logger.warning('\npredict_user_class_tfidf(): UNEXPECTED STATE, USER MISMATCH\n')
             continue
 
-        pred = predict_user_type_centroid_helper( train_test_tf_mat[matrix_key][test_tf_mat_indx]['tf_vector'], train_per_src_doc, dist_metric=kwargs.get('dist_metric', 'cosine') )
+        pred = predict_user_type_centroid_helper( tf_mat[test_tf_mat_indx], train_per_src_doc, dist_metric=kwargs.get('dist_metric', 'cosine') )
         
         pred_i = all_train_classes.index(pred)
         actu_i = all_train_classes.index(u['class'])
@@ -1,25 +1,29 @@
 import json
 import logging
+import numpy as np
 import os, sys
-import osometweet
 import re
 import time
 
+from concurrent.futures import ThreadPoolExecutor
 from copy import deepcopy
-from datetime import datetime, timedelta
-from requests_oauthlib import OAuth1Session
-from textblob import TextBlob
-
+from datetime import datetime, timedelta, timezone
+
+from bloc.rate_limiter import TokenBucket
+from bloc.relationship_cache import RelationshipCache
+from bloc.tweet_store import TweetStore
+from bloc.tweet_store import get_request_window
+from bloc.tweet_store import get_tweet_id_epoch_range
+from bloc.sentiment import get_default_sentiment_backend
 from bloc.util import color_bloc_action_str
 from bloc.util import datetimeFromUtcToLocal
 #from bloc.util import dumpJsonToFile
 from bloc.util import find_tweet_timestamp_post_snowflake
 from bloc.util import genericErrorInfo
 from bloc.util import getDictFromFile
-from bloc.util import getDictFromJsonGZ
 from bloc.util import get_screen_name_frm_status_uri
 from bloc.util import gen_post_snowflake_twitter_id
-from bloc.util import gzipTextFile
+from bloc.util import is_timezone_good
 from bloc.util import twitter_v2_user_lookup_ids
 from bloc.v2_support import conv_v2_tweets_to_v1
 
@@ -82,30 +86,82 @@ logger = logging.getLogger('bloc.bloc')
     ⚇ - Content-Semantic-Entities     (Person (e.g., Barack Obama, Daniel, or George W. Bush))
 '''
 
-def friendship_lookup(oauth, source_screen_name, target_screen_name, msg=''):
+def friendship_lookup(oauth, source_screen_name, target_screen_name, msg='', rate_limiter=None, api_base='https://api.twitter.com/1.1'):
 
     #1 request per 5 seconds: https://developer.twitter.com/en/docs/twitter-api/v1/accounts-and-users/follow-search-get-users/api-reference/get-friendships-show
-    logger.info('friendship_lookup(): sleeping for 5 seconds' + msg)
-    time.sleep(5)
+    if( rate_limiter is None ):
+        logger.info('friendship_lookup(): sleeping for 5 seconds' + msg)
+        time.sleep(5)
+    else:
+        logger.info('friendship_lookup()' + msg)
+        rate_limiter.acquire()
 
     params = {
         'source_screen_name': source_screen_name,
         'target_screen_name': target_screen_name
     }
     try:
-        response = oauth.get('https://api.twitter.com/1.1/friendships/show.json', params=params)
+        response = oauth.get(f'{api_base}/friendships/show.json', params=params)
         friendship = json.loads(response.text)['relationship']
 
+        if( rate_limiter is not None ):
+            rate_limiter.sync_window( response.headers.get('x-rate-limit-remaining', None), response.headers.get('x-rate-limit-reset', None) )
+
         return friendship
     except:
         genericErrorInfo()
 
     return {}
 
-def fmt_twt_time_to_loc(created_at):
+def get_friendship_target(screen_name, twt):
+
+    tweet_type = get_tweet_type(twt)
+    if( tweet_type == 'reply' ):
+        tgt = twt['in_reply_to_screen_name']
+    elif( tweet_type == 'retweet' ):
+        tgt = twt['retweeted_status']['user']['screen_name']
+    else:
+        return ''
+
+    #skip self
+    return '' if tgt is None or screen_name == tgt else tgt
+
+def add_timeline_relationships(oauth, screen_name, timeline, relationship_cache, rate_limiter, workers=4, api_base='https://api.twitter.com/1.1'):
+
+    '''
+        Set src_follows_tgt and tgt_follows_src of replies and retweets in timeline (one page) from relationship_cache.
+        Targets missing from the cache are deduplicated and looked up concurrently (workers threads) under rate_limiter.
+    '''
+    targets = [ get_friendship_target(screen_name, twt) for twt in timeline ]
+    uncached = [ tgt for tgt in dict.fromkeys(targets) if tgt != '' and relationship_cache.get(screen_name, tgt) is None ]
+
+    def lookup(j):
+
+        tgt = uncached[j]
+        relationship = friendship_lookup(oauth, screen_name, tgt, msg=f', for @{tgt}, {j+1} of {len(uncached)}', rate_limiter=rate_limiter, api_base=api_base)
+        if( len(relationship) != 0 ):
+            relationship_cache.set( screen_name, tgt, relationship['source']['following'], relationship['source']['followed_by'] )
+
+    if( len(uncached) != 0 ):
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            list( executor.map(lookup, range(len(uncached))) )
+
+    for twt, tgt in zip(timeline, targets):
+
+        if( tgt == '' ):
+            continue
+
+        relationship = relationship_cache.get(screen_name, tgt)
+        if( relationship is not None ):
+            twt['bloc']['src_follows_tgt'] = relationship['src_follows_tgt']
+            twt['bloc']['tgt_follows_src'] = relationship['tgt_follows_src']
+
+    return len(uncached)
+
+def fmt_twt_time_to_loc(created_at, tz_name=''):
     created_at = datetime.strptime(created_at, '%a %b %d %H:%M:%S %z %Y')
 
-    local_time = datetimeFromUtcToLocal( created_at )
+    local_time = datetimeFromUtcToLocal( created_at, tz_name )
     local_time = datetime.strftime( local_time, '%Y-%m-%d %H:%M:%S' )   
 
     return local_time
@@ -122,11 +178,22 @@ def get_tweet_type(twt):
     else:
         return 'tweet'
 
-def get_timeline_tweets(oauth, screen_name, user_id='', max_pages=1, following_lookup=True, timeline_startdate='', timeline_scroll_by_hours=None, no_sleep=False):
+def get_timeline_tweets(oauth, screen_name, user_id='', max_pages=1, following_lookup=True, timeline_startdate='', timeline_scroll_by_hours=None, no_sleep=False, rate_limiter=None, api_base='https://api.twitter.com/1.1', relationship_cache=None, friendship_rate_limiter=None, friendship_workers=4, since_id=None, max_id=None):
 
+    '''
+        rate_limiter: bloc.rate_limiter.TokenBucket shared with other workers, if set, it paces requests instead of the fixed 1 second sleeps
+        relationship_cache: bloc.relationship_cache.RelationshipCache for following_lookup, default: in-memory cache for this call
+        friendship_rate_limiter: bloc.rate_limiter.TokenBucket for friendship lookups, default: 1 request per 5 seconds
+    '''
     if( max_pages < 0 ):
         return []
 
+    if( following_lookup is True ):
+        relationship_cache = RelationshipCache() if relationship_cache is None else relationship_cache
+        friendship_rate_limiter = TokenBucket(window_requests=1, window_seconds=5) if friendship_rate_limiter is None else friendship_rate_limiter
+
+    no_sleep = True if rate_limiter is not None else no_sleep
+
 
     params = {'tweet_mode': 'extended', 'count': 20}
     screen_name = screen_name.strip()
@@ -140,6 +207,12 @@ def get_timeline_tweets(oauth, screen_name, user_id='', max_pages=1, following_l
     elif( user_id != '' ):
         params['user_id'] = user_id
 
+    #since_id/max_id: fetch only tweets newer/older than those in bloc.tweet_store.TweetStore
+    if( since_id is not None ):
+        params['since_id'] = since_id
+    if( max_id is not None ):
+        params['max_id'] = max_id
+
 
     tweets = []
     dedup_set = set()
@@ -177,8 +250,14 @@ def get_timeline_tweets(oauth, screen_name, user_id='', max_pages=1, following_l
 
 
         try:
-            response = oauth.get("https://api.twitter.com/1.1/statuses/user_timeline.json", params=params)
+            if( rate_limiter is not None ):
+                rate_limiter.acquire()
+
+            response = oauth.get(f'{api_base}/statuses/user_timeline.json', params=params)
             timeline = json.loads(response.text)
+
+            if( rate_limiter is not None ):
+                rate_limiter.sync_window( response.headers.get('x-rate-limit-remaining', None), response.headers.get('x-rate-limit-reset', None) )
         except:
             genericErrorInfo()
             
@@ -235,37 +314,9 @@ def get_timeline_tweets(oauth, screen_name, user_id='', max_pages=1, following_l
 
         sleep_flag = True
         if( following_lookup is True ):
-            #no need to sleep for 1 second since friendship look up sleeps for 5 seconds.
-            
-            timeline_len = len(timeline)
-            for j in range( timeline_len ):
-                
-                twt = timeline[j]
-                if( 'in_reply_to_status_id' not in twt ):
-                    continue
-
-                tweet_type = get_tweet_type(twt)
-                if( tweet_type not in ['reply', 'retweet'] ):
-                    continue
-
-                if( tweet_type == 'reply' ):
-                    tgt = twt['in_reply_to_screen_name']
-                elif( tweet_type == 'retweet' ):
-                    tgt = twt['retweeted_status']['user']['screen_name']
-                else:
-                    continue
-
-                #skip self
-                if( screen_name == tgt ):
-                    continue
-                
-                msg = ', for ' + tweet_type + ', ' + str(j+1) + ' of ' + str(timeline_len)
-                relationship = friendship_lookup(oauth, screen_name, tgt, msg=msg)
+            #no need to sleep for 1 second if friendship look ups were made since they are rate limited to 1 per 5 seconds.
+            if( add_timeline_relationships(oauth, screen_name, timeline, relationship_cache, friendship_rate_limiter, workers=friendship_workers, api_base=api_base) != 0 ):
                 sleep_flag = False
-
-                if( len(relationship) != 0 ):
-                    twt['bloc']['src_follows_tgt'] = relationship['source']['following']
-                    twt['bloc']['tgt_follows_src'] = relationship['source']['followed_by']
                     
         if( sleep_flag and no_sleep is False ):
             #to conform with 1 request per second rate limit for user auth: https://developer.twitter.com/en/docs/twitter-api/v1/tweets/timelines/api-reference/get-statuses-user_timeline
@@ -274,11 +325,16 @@ def get_timeline_tweets(oauth, screen_name, user_id='', max_pages=1, following_l
 
     return tweets
 
-def v2_get_timeline_tweets(ostwt, user_id, max_pages=1, max_results=100, timeline_startdate='', timeline_scroll_by_hours=None, no_sleep=False, twitter_api_tweet_fields=None, twitter_api_expansion_fields=None):
+def v2_get_timeline_tweets(ostwt, user_id, max_pages=1, max_results=100, timeline_startdate='', timeline_scroll_by_hours=None, no_sleep=False, twitter_api_tweet_fields=None, twitter_api_expansion_fields=None, rate_limiter=None, since_id=None, max_id=None):
 
+    '''
+        rate_limiter: bloc.rate_limiter.TokenBucket shared with other workers, if set, it paces requests instead of the fixed 1 second sleeps
+    '''
     if( max_pages < 0 ):
         return []
 
+    no_sleep = True if rate_limiter is not None else no_sleep
+
     user_id = user_id.strip()
     if( user_id == '' ):
         return []
@@ -292,6 +348,13 @@ def v2_get_timeline_tweets(ostwt, user_id, max_pages=1, max_results=100, timelin
     timeline_scroll_by_hours = 0 if timeline_scroll_by_hours is None else timeline_scroll_by_hours    
     timeline_startdate = '' if timeline_startdate == '' else datetime.strptime( timeline_startdate, '%Y-%m-%d %H:%M:%S' )
 
+    #since_id (exclusive in v1.1 and v2) and max_id (inclusive as in v1.1, until_id is exclusive): fetch only tweets newer/older than those in bloc.tweet_store.TweetStore
+    id_bounds = {}
+    if( since_id is not None ):
+        id_bounds['since_id'] = str(since_id)
+    if( max_id is not None ):
+        id_bounds['until_id'] = str(max_id + 1)
+
     logger.info('\nv2_get_timeline_tweets():')
     for i in range(max_pages):
 
@@ -302,7 +365,10 @@ def v2_get_timeline_tweets(ostwt, user_id, max_pages=1, max_results=100, timelin
         response = {}
         try:
             end_time = None if timeline_startdate == '' else timeline_startdate.strftime('%Y-%m-%dT%H:%M:%S') + 'Z' 
-            response = ostwt.get_tweet_timeline(user_id, max_results=max_results, everything=include_everything, pagination_token=next_token, end_time=end_time, fields=twitter_api_tweet_fields, expansions=twitter_api_expansion_fields)
+            if( rate_limiter is not None ):
+                rate_limiter.acquire()
+
+            response = ostwt.get_tweet_timeline(user_id, max_results=max_results, everything=include_everything, pagination_token=next_token, end_time=end_time, fields=twitter_api_tweet_fields, expansions=twitter_api_expansion_fields, **id_bounds)
         except:
             genericErrorInfo()
 
@@ -417,6 +483,78 @@ def get_delta_glyph(symbols, delta_seconds, blank_mark=60, minute_mark=5):
 
     return glyph
 
+def get_delta_glyphs(symbols, delta_seconds, blank_mark=60, minute_mark=5):
+
+    '''
+        Vectorized get_delta_glyph(): maps an array of delta_seconds to time glyphs with a single np.searchsorted() over the get_delta_glyph() thresholds.
+        np.maximum.accumulate() keeps the if-chain semantics of get_delta_glyph() when blank_mark exceeds minute_mark*60.
+    '''
+
+    glyphs = np.array([
+        symbols['blank_mark']['symbol'],
+        symbols['under_minute_mark']['symbol'],
+        symbols['under_hour_mark']['symbol'],
+        symbols['under_day_mark']['symbol'],
+        symbols['under_week_mark']['symbol'],
+        symbols['under_month_mark']['symbol'],
+        symbols['under_year_mark']['symbol'],
+        symbols['over_year_mark']['symbol']
+    ])
+    thresholds = np.maximum.accumulate( np.array([blank_mark, minute_mark*60, 3600, 86400, 604800, 2628000, 31540000], dtype=np.int64) )
+
+    return glyphs[ np.searchsorted(thresholds, np.asarray(delta_seconds, dtype=np.int64), side='right') ]
+
+def get_src_ref_epoch(twt):
+
+    #epoch (seconds) of the tweet that was replied to or retweeted, see get_pause().use_src_ref_time
+    if( twt['in_reply_to_status_id'] is not None ):#reply
+        return int( find_tweet_timestamp_post_snowflake( twt['in_reply_to_status_id'] ).replace(tzinfo=timezone.utc).timestamp() )
+
+    if( 'retweeted_status' in twt ):#retweet
+        return int( datetime.strptime(twt['retweeted_status']['created_at'], '%a %b %d %H:%M:%S %z %Y').timestamp() )
+
+    return None
+
+def get_pauses(symbols, tweets, created_at_epochs, blank_mark, minute_mark, use_src_ref_time=False, prev_epoch=None):
+
+    '''
+        Batch version of get_pause() for a whole timeline of chronologically ordered tweets.
+        created_at_epochs: int64 array of each tweet's created_at in epoch seconds (same order as tweets)
+        prev_epoch: created_at (epoch seconds) of the tweet before tweets[0] if tweets continue a timeline (see add_bloc_sequences().bloc_state)
+        Returns delta_seconds (int64 array, -1 where get_pause() returns -1) and dur_glyphs (array of glyphs, '' where get_pause() returns '')
+    '''
+    twt_len = len(tweets)
+    created_at_epochs = np.asarray(created_at_epochs, dtype=np.int64)
+
+    ref_epochs = np.zeros(twt_len, dtype=np.int64)
+    has_ref = np.zeros(twt_len, dtype=bool)
+    if( twt_len > 1 ):
+        ref_epochs[1:] = created_at_epochs[:-1]
+        has_ref[1:] = True
+
+    if( twt_len != 0 and prev_epoch is not None ):
+        ref_epochs[0] = prev_epoch
+        has_ref[0] = True
+
+    valid = np.array([ 'in_reply_to_status_id' in twt for twt in tweets ], dtype=bool)
+
+    if( use_src_ref_time is True ):
+        for i in range(twt_len):
+
+            if( not valid[i] ):
+                continue
+
+            src_ref_epoch = get_src_ref_epoch( tweets[i] )
+            if( src_ref_epoch is not None ):
+                ref_epochs[i] = src_ref_epoch
+                has_ref[i] = True
+
+    has_ref &= valid
+    delta_seconds = np.where( has_ref, created_at_epochs - ref_epochs, -1 )
+    dur_glyphs = np.where( has_ref, get_delta_glyphs(symbols, delta_seconds, blank_mark=blank_mark, minute_mark=minute_mark), '' )
+
+    return delta_seconds, dur_glyphs
+
 def get_duration_prefix(symbols, cur_time, prev_time, blank_mark, minute_mark):
 
     seq_diff_time = datetime.strptime( cur_time, '%Y-%m-%d %H:%M:%S' ) - datetime.strptime( prev_time, '%Y-%m-%d %H:%M:%S' )
@@ -427,7 +565,7 @@ def get_duration_prefix(symbols, cur_time, prev_time, blank_mark, minute_mark):
     
     return delta_seconds, dur_glyph
 
-def get_pause(symbols, twt, prev_twt, blank_mark, minute_mark, use_src_ref_time=False):
+def get_pause(symbols, twt, prev_twt, blank_mark, minute_mark, use_src_ref_time=False, tz_name=''):
 
     if( 'in_reply_to_status_id' not in twt ):
         return -1, ''
@@ -439,13 +577,13 @@ def get_pause(symbols, twt, prev_twt, blank_mark, minute_mark, use_src_ref_time=
     if( use_src_ref_time is True ):
         if( twt['in_reply_to_status_id'] is not None ):#reply
             source_ref_time = find_tweet_timestamp_post_snowflake( twt['in_reply_to_status_id'] )
-            source_ref_time = datetimeFromUtcToLocal( source_ref_time )
+            source_ref_time = datetimeFromUtcToLocal( source_ref_time, tz_name )
             source_ref_time = datetime.strftime( source_ref_time, '%Y-%m-%d %H:%M:%S' )
             
         elif( 'retweeted_status' in twt ):#retweet
             source_ref_time = twt['retweeted_status']['created_at']
             source_ref_time = datetime.strptime(source_ref_time, '%a %b %d %H:%M:%S %z %Y')
-            source_ref_time = datetimeFromUtcToLocal( source_ref_time )
+            source_ref_time = datetimeFromUtcToLocal( source_ref_time, tz_name )
             source_ref_time = datetime.strftime( source_ref_time, '%Y-%m-%d %H:%M:%S' )
         
         elif( prev_twt != '' ):#tweet
@@ -537,13 +675,21 @@ def get_bloc_action_seq(symbols, twt, delta_seconds, dur_glyph, content_syntacti
     action_seq['seq'] = dur_glyph + action_seq['seq'] + content_syntactic_seq
     return action_seq
 
-def get_bloc_content_sem_sent_seq(symbols, twt, txt_key, delta_seconds, dur_glyph, content_syntactic_seq=''):
+def get_sent_exclusive_text(twt, txt_key):
+
+    if( txt_key in twt ):
+        return get_twt_text_exclusively( twt[txt_key], twt['entities'] )
+
+    return ''
+
+def get_bloc_content_sem_sent_seq(symbols, twt, txt_key, delta_seconds, dur_glyph, content_syntactic_seq='', sent=None):
     
     '''
         The SENTIMENT alphabets are
             ⋃ - Positive
             - - Neutral
             ⋂ - Negative
+        sent: precomputed polarity (e.g., from bloc.sentiment backend), if None polarity is computed with TextBlob
     '''
 
 
@@ -555,18 +701,18 @@ def get_bloc_content_sem_sent_seq(symbols, twt, txt_key, delta_seconds, dur_glyp
         'seq_dets': {}
     }
 
-    if( txt_key in twt ):
-        exclusive_text = get_twt_text_exclusively( twt[txt_key], twt['entities'] )
-    
-    if( exclusive_text == '' ):
-        return sent_seq
+    if( sent is None ):
+        exclusive_text = get_sent_exclusive_text(twt, txt_key)
     
+        if( exclusive_text == '' ):
+            return sent_seq
 
-    try:
-        sent = TextBlob(exclusive_text).sentiment.polarity
-    except:
-        genericErrorInfo()
-        return sent_seq
+        try:
+            from textblob import TextBlob
+            sent = TextBlob(exclusive_text).sentiment.polarity
+        except:
+            genericErrorInfo()
+            return sent_seq
     
     '''
         if( sent >= 0.3333 ):    #[ 0.3333,  1.0000)
@@ -594,6 +740,36 @@ def get_bloc_content_sem_sent_seq(symbols, twt, txt_key, delta_seconds, dur_glyp
     sent_seq['seq_dets'] = { 'sent': sent }
     return sent_seq
 
+def get_timeline_sentiments(tweets, sentiment_backend=None):
+
+    '''
+        Returns the polarity for each tweet (None for tweets without text or failed scores).
+        sentiment_backend: bloc.sentiment.SentimentBackend instance, default: bloc.sentiment.get_default_sentiment_backend()
+    '''
+    if( sentiment_backend is None ):
+        sentiment_backend = get_default_sentiment_backend()
+
+    texts = []
+    text_pos = []
+    for i in range( len(tweets) ):
+
+        txt_key = 'full_text' if 'full_text' in tweets[i] else 'text'
+        exclusive_text = get_sent_exclusive_text(tweets[i], txt_key)
+        if( exclusive_text == '' ):
+            continue
+
+        texts.append( exclusive_text )
+        text_pos.append( i )
+
+    all_sents = [None] * len(tweets)
+    if( len(texts) == 0 ):
+        return all_sents
+
+    for i, sent in zip( text_pos, sentiment_backend.polarity(texts) ):
+        all_sents[i] = sent
+
+    return all_sents
+
 def get_bloc_change_seq(symbols, twt, prev_twt, delta_seconds, dur_glyph, fold_start_count=0, include_time=False):
 
     def add_delete_tweet_change(symbol, symbol_note, prev_u, cur_u, fold_start_count):
@@ -1071,8 +1247,45 @@ def bloc_segmenter(bloc_info, created_at, segmentation_type='week_number', days_
         
     bloc_info['segmentation_type'] = segmentation_type
 
+def get_empty_bloc_state(params):
+
+    '''
+        Resumable encoder state of add_bloc_sequences() (JSON serializable).
+        closed_bloc holds the aggregate BLOC strings of segments that cannot receive new tweets, and open_segment holds the (unformatted) strings of the last segment
+    '''
+    return {
+        'params': params,
+        'prev_twt': None,
+        'prev_epoch': None,
+        'last_tweet_key': None,
+        'pause_segment_number': 0,
+        'last_segment': None,
+        'open_segment': None,
+        'closed_bloc': {},
+        'closed_segment_count': 0,
+        'total_tweets': 0,
+        'first_tweet_created_at_local_time': '',
+        'last_tweet_created_at_local_time': '',
+        'user_id': '',
+        'screen_name': ''
+    }
+
+def get_bloc_state_prev_twt(twt):
+
+    #only keep the fields get_bloc_change_seq() compares with the next tweet
+    prev_twt = { ky: twt[ky] for ky in ['id', 'created_at', 'user', 'place', 'source', 'lang'] if ky in twt }
+    prev_twt['bloc'] = {'local_time': twt['bloc']['local_time']}
+
+    return prev_twt
+
 def add_bloc_sequences(tweets, blank_mark=60, minute_mark=5, gen_rt_content=True, add_txt_glyph=True, segmentation_type='week_number', **kwargs):
 
+    '''
+        Incremental encoding: set keep_bloc_state=True to include the encoder state (result['bloc_state']), 
+        and pass it as bloc_state to a later call with new tweets of the same user. Tweets already encoded are skipped, only the last (open) segment is re-emitted,
+        and result['bloc'] covers the full timeline. In this mode result['bloc_segments']['segments'] covers only the segments updated by the call.
+    '''
+
     def tranfer_dets_for_stream_statuses(twt):
         
         #transfer details for tweets gotten from streams
@@ -1173,6 +1386,7 @@ def add_bloc_sequences(tweets, blank_mark=60, minute_mark=5, gen_rt_content=True
     kwargs.setdefault('sort_action_words', False)
     kwargs.setdefault('tweet_order', 'sorted')#reverse or sorted
     kwargs.setdefault('segment_on_pauses', -1)#reverse or sorted
+    kwargs.setdefault('timezone', '')#see bloc.util.datetimeFromUtcToLocal().tz_name, '' uses the machine's UTC offset at the start of the run
     
     all_bloc_symbols = kwargs.get('all_bloc_symbols', {})
 
@@ -1180,6 +1394,10 @@ def add_bloc_sequences(tweets, blank_mark=60, minute_mark=5, gen_rt_content=True
         logger.error(f'\nadd_bloc_sequences(): all_bloc_symbols is corrupt, so returning')
         return {}
 
+    if( is_timezone_good(kwargs['timezone']) is False ):
+        logger.error(f'\nadd_bloc_sequences(): unknown timezone: {kwargs["timezone"]}, so returning')
+        return {}
+
     
     days_segment_count = kwargs.get('days_segment_count', -1)
     bloc_alphabets = kwargs.get('bloc_alphabets', ['action', 'content_syntactic', 'content_semantic_entity'])#additional valid bloc_alphabets: change, content_syntactic_with_pauses, action_content_syntactic
@@ -1193,6 +1411,31 @@ def add_bloc_sequences(tweets, blank_mark=60, minute_mark=5, gen_rt_content=True
         bloc_segments['segmentation_type'] = 'day_of_year_bin'
         bloc_segments['days_segment_count'] = days_segment_count
 
+    #incremental encoding - start
+    kwargs.setdefault('keep_bloc_state', False)
+    kwargs.setdefault('aggregate_closed_segments', True)#False: bloc_state does not accumulate closed segments (see gen_bloc_sequences())
+    bloc_state_params = {
+        'blank_mark': blank_mark, 'minute_mark': minute_mark, 'gen_rt_content': gen_rt_content, 'add_txt_glyph': add_txt_glyph,
+        'segmentation_type': segmentation_type, 'days_segment_count': days_segment_count, 'segment_on_pauses': kwargs['segment_on_pauses'],
+        'bloc_alphabets': list(bloc_alphabets), 'time_reference': kwargs['time_reference'], 'timezone': kwargs['timezone'],
+        'fold_start_count': kwargs['fold_start_count'], 'change_add_pause': kwargs['change_add_pause'], 'sort_action_words': kwargs['sort_action_words']
+    }
+    bloc_state = kwargs.get('bloc_state', None)
+
+    if( bloc_state is None ):
+        bloc_state = get_empty_bloc_state(bloc_state_params)
+    elif( bloc_state['params'] != bloc_state_params ):
+        logger.error(f'\nadd_bloc_sequences(): bloc_state was generated with different parameters ({bloc_state["params"]}), so returning')
+        return {}
+    else:
+        bloc_state = deepcopy(bloc_state)
+
+    if( bloc_state['open_segment'] is not None ):
+        open_segment_id = bloc_state['open_segment']['id']
+        bloc_segments['last_segment'] = bloc_state['last_segment']
+        bloc_segments['segments'][open_segment_id] = dict( bloc_state['open_segment']['segments'] )
+        bloc_segments['segments_details'][open_segment_id] = deepcopy( bloc_state['open_segment']['segments_details'] )
+    #incremental encoding - end
     
     twt_len = len(tweets)
     for i in range( twt_len ):
@@ -1200,8 +1443,11 @@ def add_bloc_sequences(tweets, blank_mark=60, minute_mark=5, gen_rt_content=True
         twt = tranfer_dets_for_stream_statuses(twt)
         #Wed Oct 10 20:19:24 +0000 2018
         created_at = datetime.strptime(twt['created_at'], '%a %b %d %H:%M:%S %z %Y')
-        local_time = datetimeFromUtcToLocal(created_at)
-        twt.setdefault('bloc', {'src_follows_tgt': None, 'tgt_follows_src': None, 'local_time': datetime.strftime(local_time, '%Y-%m-%d %H:%M:%S'), 'created_at_obj': created_at})
+        local_time = datetimeFromUtcToLocal(created_at, kwargs['timezone'])
+        #tweets from get_timeline_tweets()/v2_get_timeline_tweets() already have a bloc key (with friendship details), so set time details separately
+        twt.setdefault('bloc', {'src_follows_tgt': None, 'tgt_follows_src': None})
+        twt['bloc']['local_time'] = datetime.strftime(local_time, '%Y-%m-%d %H:%M:%S')
+        twt['bloc']['created_at_obj'] = created_at
 
     
     #BLOC runs with tweets in chronological order. Since timeline tweets are by default in reverse chronological order, fix by reversing.
@@ -1217,14 +1463,31 @@ def add_bloc_sequences(tweets, blank_mark=60, minute_mark=5, gen_rt_content=True
 
             To accommodate sorting tweets created pre and post snowflake sort with time and tweet ID
         '''
-        tweets = sorted( tweets, key=lambda x: x['bloc']['local_time'] + ' ' + str(x['id']) )
+        tweets = sorted( tweets, key=lambda x: (x['bloc']['created_at_obj'], str(x['id'])) )
     
 
+    if( bloc_state['last_tweet_key'] is not None ):
+        #skip tweets encoded by previous calls
+        last_tweet_key = tuple(bloc_state['last_tweet_key'])
+        tweets = [ twt for twt in tweets if (int(twt['bloc']['created_at_obj'].timestamp()), str(twt['id'])) > last_tweet_key ]
+        twt_len = len(tweets)
     
-    prev_twt = ''
-    user_id = ''
-    screen_name = ''
-    pause_segment_number = 0
+    prev_twt = '' if bloc_state['prev_twt'] is None else bloc_state['prev_twt']
+    user_id = bloc_state['user_id']
+    screen_name = bloc_state['screen_name']
+    pause_segment_number = bloc_state['pause_segment_number']
+
+    #compute pauses for all tweets at once instead of round-tripping local_time strings per tweet with get_pause()
+    created_at_epochs = [ int(twt['bloc']['created_at_obj'].timestamp()) for twt in tweets ]
+    all_delta_seconds, all_dur_glyphs = get_pauses( all_bloc_symbols['bloc_alphabets']['time'], tweets, created_at_epochs, blank_mark=blank_mark, minute_mark=minute_mark, use_src_ref_time=use_src_ref_time, prev_epoch=bloc_state['prev_epoch'] )
+    all_delta_seconds = all_delta_seconds.tolist()
+    all_dur_glyphs = all_dur_glyphs.tolist()
+
+    #score sentiment for the whole timeline in one batch instead of once per tweet
+    all_sents = [None] * twt_len
+    if( 'content_semantic_sentiment' in bloc_alphabets ):
+        all_sents = get_timeline_sentiments( tweets, kwargs.get('sentiment_backend', None) )
+
     for i in range( twt_len ):
         
         twt = tweets[i]
@@ -1233,8 +1496,8 @@ def add_bloc_sequences(tweets, blank_mark=60, minute_mark=5, gen_rt_content=True
         user_id = twt['user']['id']
         screen_name = twt['user']['screen_name']
 
-        ex_txt = get_twt_text_exclusively( twt[twt_text_ky], twt['entities'] )
-        delta_seconds, dur_glyph = get_pause(symbols=all_bloc_symbols['bloc_alphabets']['time'], twt=twt, prev_twt=prev_twt, blank_mark=blank_mark, minute_mark=minute_mark, use_src_ref_time=use_src_ref_time)
+        delta_seconds = all_delta_seconds[i]
+        dur_glyph = all_dur_glyphs[i]
         
         pause_segment_number = pause_segment_number + 1 if delta_seconds >= kwargs['segment_on_pauses'] else pause_segment_number
         bloc_segmenter( twt['bloc'], twt['bloc']['created_at_obj'], segmentation_type=segmentation_type, days_segment_count=days_segment_count, pause_segment_number=pause_segment_number )
@@ -1256,7 +1519,7 @@ def add_bloc_sequences(tweets, blank_mark=60, minute_mark=5, gen_rt_content=True
             twt['bloc']['bloc_sequences']['content_semantic_entity'] = get_bloc_content_sem_ent_seq( all_bloc_symbols['bloc_alphabets']['content_semantic_entities'], twt, content_semantic_add_pause=False, gen_rt_content=gen_rt_content, delta_seconds=delta_seconds, dur_glyph=dur_glyph)
         
         if( 'content_semantic_sentiment' in bloc_alphabets ):
-            twt['bloc']['bloc_sequences']['content_semantic_sentiment'] = get_bloc_content_sem_sent_seq( all_bloc_symbols['bloc_alphabets']['content_semantic_sentiment'], twt, txt_key=twt_text_ky, delta_seconds=delta_seconds, dur_glyph=dur_glyph, content_syntactic_seq='')
+            twt['bloc']['bloc_sequences']['content_semantic_sentiment'] = get_bloc_content_sem_sent_seq( all_bloc_symbols['bloc_alphabets']['content_semantic_sentiment'], twt, txt_key=twt_text_ky, delta_seconds=delta_seconds, dur_glyph=dur_glyph, content_syntactic_seq='', sent=all_sents[i])
 
         if( 'change' in bloc_alphabets ):
             twt['bloc']['bloc_sequences']['change'] = get_bloc_change_seq( all_bloc_symbols['bloc_alphabets']['change'], twt, prev_twt, delta_seconds=delta_seconds, dur_glyph=dur_glyph, fold_start_count=kwargs['fold_start_count'], include_time=kwargs['change_add_pause'])
@@ -1268,6 +1531,15 @@ def add_bloc_sequences(tweets, blank_mark=60, minute_mark=5, gen_rt_content=True
         add_bloc_segments(twt, segment_id, bloc_segments)
         prev_twt = twt
     
+    #keep the last segment unformatted since later calls may append to it
+    all_segment_ids = sorted( bloc_segments['segments'].keys() )
+    if( len(all_segment_ids) != 0 ):
+        bloc_state['open_segment'] = {
+            'id': all_segment_ids[-1],
+            'segments': dict( bloc_segments['segments'][all_segment_ids[-1]] ),
+            'segments_details': deepcopy( bloc_segments['segments_details'][all_segment_ids[-1]] )
+        }
+
     if( 'action_content_syntactic' in bloc_alphabets ):
         fmt_action_content_syntactic_bloc(all_bloc_symbols['bloc_alphabets']['time'], bloc_segments['segments'], 'action_content_syntactic')
     if( 'content_syntactic_with_pauses' in bloc_alphabets ):
@@ -1287,12 +1559,18 @@ def add_bloc_sequences(tweets, blank_mark=60, minute_mark=5, gen_rt_content=True
     
 
     #combine bloc across multiple segments into single bloc sequence delimited by | 
-    bloc_segments['segment_count'] = len(bloc_segments['segments'])
-    all_segment_ids = list(bloc_segments['segments'].keys())
-    all_segment_ids.sort()
+    bloc_segments['segment_count'] = bloc_state['closed_segment_count'] + len(all_segment_ids)
+    for dim, bloc_seq in bloc_state['closed_bloc'].items():
+        aggregate_bloc[dim] = bloc_seq
 
     for segment_id in all_segment_ids:
         
+        if( segment_id == all_segment_ids[-1] ):
+            #segments before the last are complete, so later calls start from their aggregate
+            if( kwargs['aggregate_closed_segments'] is True ):
+                bloc_state['closed_bloc'] = dict(aggregate_bloc)
+            bloc_state['closed_segment_count'] += len(all_segment_ids) - 1
+
         dimensions = bloc_segments['segments'][segment_id]
         for dim in dimensions:
 
@@ -1313,10 +1591,23 @@ def add_bloc_sequences(tweets, blank_mark=60, minute_mark=5, gen_rt_content=True
         bloc_segments['segments'] = {}
         bloc_segments['segments_details'] = {}
 
+    if( twt_len != 0 ):
+        bloc_state['prev_twt'] = get_bloc_state_prev_twt( tweets[-1] )
+        bloc_state['prev_epoch'] = created_at_epochs[-1]
+        bloc_state['last_tweet_key'] = [ created_at_epochs[-1], str(tweets[-1]['id']) ]
+        bloc_state['last_segment'] = bloc_segments['last_segment']
+        bloc_state['pause_segment_number'] = pause_segment_number
+        bloc_state['user_id'] = user_id
+        bloc_state['screen_name'] = screen_name
+        bloc_state['total_tweets'] += twt_len
+        bloc_state['last_tweet_created_at_local_time'] = tweets[-1]['bloc']['local_time']
+        if( bloc_state['first_tweet_created_at_local_time'] == '' ):
+            bloc_state['first_tweet_created_at_local_time'] = tweets[0]['bloc']['local_time']
+
     more_details = {
-        'total_tweets': twt_len,
-        'first_tweet_created_at_local_time': '' if twt_len == 0 else tweets[0]['bloc']['local_time'],
-        'last_tweet_created_at_local_time': '' if twt_len == 0 else tweets[-1]['bloc']['local_time']
+        'total_tweets': bloc_state['total_tweets'],
+        'first_tweet_created_at_local_time': bloc_state['first_tweet_created_at_local_time'],
+        'last_tweet_created_at_local_time': bloc_state['last_tweet_created_at_local_time']
     }
     result = {
         'bloc': aggregate_bloc,
@@ -1328,9 +1619,85 @@ def add_bloc_sequences(tweets, blank_mark=60, minute_mark=5, gen_rt_content=True
         'bloc_symbols_version': all_bloc_symbols.get('version', ''),
         'more_details': more_details
     }
+
+    if( kwargs['keep_bloc_state'] is True or kwargs.get('bloc_state', None) is not None ):
+        result['bloc_state'] = bloc_state
     
     return result
 
+def gen_bloc_sequences(tweets, chunk_size=1000, bloc_state=None, **kwargs):
+
+    '''
+        Streaming version of add_bloc_sequences() for tweets (any iterable, e.g., lines of a file) already in chronological order.
+        Tweets are encoded chunk_size at a time, so memory is bounded by chunk_size tweets and the open segment, irrespective of the timeline's length.
+        kwargs are passed to add_bloc_sequences(). Yields dicts:
+            {'type': 'tweet', 'id', 'local_time', 'segment_id', 'bloc_sequences': {alphabet: BLOC of the tweet}}
+            {'type': 'segment', 'segment_id', 'bloc': {alphabet: BLOC of the segment}, 'segments_details'} for each completed segment, in order
+            {'type': 'end', 'user_id', 'screen_name', 'more_details', 'bloc_state'} after the last tweet, pass bloc_state to a later call to resume the stream
+    '''
+    kwargs['tweet_order'] = 'NoOp'
+    kwargs['keep_tweets'] = True
+    kwargs['keep_bloc_segments'] = True
+    kwargs['keep_bloc_state'] = True
+    kwargs['aggregate_closed_segments'] = False
+
+    def proc_chunk(chunk, bloc_state):
+
+        payload = add_bloc_sequences(chunk, bloc_state=bloc_state, **kwargs)
+        if( len(payload) == 0 ):
+            return {}, []
+
+        segmentation_type = payload['bloc_state']['params']['segmentation_type']
+        events = []
+        for twt in payload['tweets']:
+            events.append({
+                'type': 'tweet',
+                'id': twt['id'],
+                'local_time': twt['bloc']['local_time'],
+                'segment_id': twt['bloc'][segmentation_type],
+                'bloc_sequences': twt['bloc']['bloc_sequences_short']
+            })
+
+        open_segment = payload['bloc_state']['open_segment']
+        for segment_id in sorted( payload['bloc_segments']['segments'].keys() ):
+            if( open_segment is not None and segment_id == open_segment['id'] ):
+                continue
+            events.append({ 'type': 'segment', 'segment_id': segment_id, 'bloc': payload['bloc_segments']['segments'][segment_id], 'segments_details': payload['bloc_segments']['segments_details'][segment_id] })
+
+        return payload, events
+
+    payload = {}
+    chunk = []
+    for twt in tweets:
+
+        chunk.append(twt)
+        if( len(chunk) < chunk_size ):
+            continue
+
+        payload, events = proc_chunk(chunk, bloc_state)
+        if( len(payload) == 0 ):
+            return
+
+        bloc_state = payload['bloc_state']
+        chunk = []
+        for e in events:
+            yield e
+
+    if( len(chunk) != 0 or len(payload) == 0 ):
+        payload, events = proc_chunk(chunk, bloc_state)
+        if( len(payload) == 0 ):
+            return
+
+        for e in events:
+            yield e
+
+    #the open segment is complete at the end of the stream
+    open_segment = payload['bloc_state']['open_segment']
+    if( open_segment is not None and open_segment['id'] in payload['bloc_segments']['segments'] ):
+        yield { 'type': 'segment', 'segment_id': open_segment['id'], 'bloc': payload['bloc_segments']['segments'][open_segment['id']], 'segments_details': payload['bloc_segments']['segments_details'][open_segment['id']] }
+
+    yield { 'type': 'end', 'user_id': payload['user_id'], 'screen_name': payload['screen_name'], 'more_details': payload['more_details'], 'bloc_state': payload['bloc_state'] }
+
 def post_proc_bloc_sequences(report, seconds_mark, minute_mark, ansi_code, segmentation_type):
 
     if( 'tweets' not in report or 'bloc' not in report ):
@@ -1381,27 +1748,82 @@ def get_timeline_key_dets(seconds_mark, minute_mark, segmentation_type):
 
     return ky_dets
 
-def get_timeline_tweets_cache_filename(cache_path, screen_name, max_pages, following_lookup, timeline_startdate, timeline_scroll_by_hours):
-
-    cache_path = cache_path.strip()
-    if( cache_path.endswith('/') is False ):
-        cache_path = cache_path + '/'
+def get_store_timeline_tweets(store, user_key, fetch_tweets, max_pages, page_size, following_lookup, timeline_window, cache_read=True, cache_write=True, cache_max_age=None):
 
-    filename = ''
-    try:
-    
-        os.makedirs( cache_path, exist_ok=True )
-        
-        following_lookup = '1' if following_lookup is True else '0'
-        timeline_startdate = timeline_startdate.replace(' ', '_').replace(':', '-')
-        timeline_scroll_by_hours = str(timeline_scroll_by_hours)
-
-        filename = cache_path + screen_name + '_' + str(max_pages) + '_' + following_lookup + '_' + timeline_startdate + '_' + timeline_scroll_by_hours + '.json.gz'
-    
-    except:
-        genericErrorInfo()
-
-    return filename
+    '''
+        Returns (tweets, cache_hit), reusing tweets in store (bloc.tweet_store.TweetStore) and fetching only the missing ranges:
+        * time window requests (timeline_window = (min_epoch, max_epoch)) are read from store if a span covers the window
+        * other requests read the newest span of the timeline, fetch tweets newer than the span if it is older than cache_max_age seconds (None: never refresh),
+            and fetch older tweets if the span has fewer than max_pages * page_size tweets
+        fetch_tweets(max_pages, since_id=None, max_id=None) returns timeline tweets (most recent first)
+    '''
+    limit = max_pages * page_size
+
+    if( len(timeline_window) != 0 ):
+
+        if( cache_read is True and store.is_window_covered(user_key, following_lookup, timeline_window[0], timeline_window[1]) ):
+            return store.get_tweets(user_key, min_epoch=timeline_window[0], max_epoch=timeline_window[1], limit=limit), True
+
+        tweets = fetch_tweets(max_pages)
+        if( cache_write is True and len(tweets) != 0 ):
+            store.put_tweets(user_key, tweets, following_lookup)
+            if( len(tweets) < limit ):
+                #not truncated by max_pages, so the window is complete
+                store.add_window_span(user_key, following_lookup, timeline_window[0], timeline_window[1])
+
+        return tweets, False
+
+    span = store.get_head_span(user_key, following_lookup) if cache_read is True else {}
+    if( len(span) == 0 ):
+
+        tweets = fetch_tweets(max_pages)
+        if( cache_write is True and len(tweets) != 0 ):
+            min_id, max_id, min_epoch, max_epoch = get_tweet_id_epoch_range(tweets)
+            store.put_tweets(user_key, tweets, following_lookup)
+            store.set_head_span(user_key, following_lookup, min_id, max_id, min_epoch, complete=len(tweets) < limit)
+
+        return tweets, False
+
+    new_tweets = []
+    older_tweets = []
+    refresh = True if cache_max_age is not None and time.time() - span['fetched_at'] > cache_max_age else False
+    if( refresh is True ):
+        logger.info( f'\tcache span older than {cache_max_age} seconds, fetching tweets since id: {span["max_id"]}' )
+        new_tweets = fetch_tweets(max_pages, since_id=span['max_id'])
+
+    if( len(new_tweets) >= limit ):
+        #gap between new_tweets and span, so start a new span
+        tweets = new_tweets
+        if( cache_write is True ):
+            min_id, max_id, min_epoch, max_epoch = get_tweet_id_epoch_range(new_tweets)
+            store.put_tweets(user_key, new_tweets, following_lookup)
+            store.set_head_span(user_key, following_lookup, min_id, max_id, min_epoch, complete=False)
+
+        return tweets, False
+
+    tweets = new_tweets + store.get_tweets(user_key, min_id=span['min_id'], max_id=span['max_id'], limit=limit - len(new_tweets))
+    older_pages = -(-(limit - len(tweets))//page_size)
+    backfill = True if older_pages > 0 and span['complete'] == 0 else False
+    if( backfill is True ):
+        logger.info( f'\tcache span has {len(tweets)} of {limit} tweets, fetching {older_pages} page(s) before id: {span["min_id"]}' )
+        older_tweets = fetch_tweets(older_pages, max_id=span['min_id'] - 1)
+        tweets = (tweets + older_tweets)[:limit]
+
+    if( refresh is False and backfill is False ):
+        return tweets, True
+
+    if( cache_write is True ):
+        min_id, max_id, min_epoch = span['min_id'], span['max_id'], span['min_epoch']
+        fetched = new_tweets + older_tweets
+        if( len(fetched) != 0 ):
+            fetched_min_id, fetched_max_id, fetched_min_epoch, fetched_max_epoch = get_tweet_id_epoch_range(fetched)
+            min_id, max_id, min_epoch = min(min_id, fetched_min_id), max(max_id, fetched_max_id), min(min_epoch, fetched_min_epoch)
+            store.put_tweets(user_key, fetched, following_lookup)
+
+        complete = True if backfill is True and len(older_tweets) < older_pages * page_size else span['complete'] == 1
+        store.set_head_span(user_key, following_lookup, min_id, max_id, min_epoch, complete=complete, replace_rowid=span['rowid'], fetched_at=None if refresh is True else span['fetched_at'])
+
+    return tweets, False
 
 def get_user_bloc(oauth_or_ostwt, screen_name, user_id='', max_pages=1, following_lookup=False, timeline_startdate='', timeline_scroll_by_hours=None, **kwargs):
 
@@ -1417,6 +1839,7 @@ def get_user_bloc(oauth_or_ostwt, screen_name, user_id='', max_pages=1, followin
 
     kwargs.setdefault('ansi_code', '91m')
     
+    import osometweet
     tweet_fields = osometweet.TweetFields()
     user_fields = osometweet.UserFields()
     expansions = osometweet.TweetExpansions()
@@ -1428,36 +1851,34 @@ def get_user_bloc(oauth_or_ostwt, screen_name, user_id='', max_pages=1, followin
     kwargs.setdefault('twitter_api_tweet_fields', tweet_fields + user_fields)
     kwargs.setdefault('twitter_api_expansion_fields', expansions)
     
-    tweets = []
-    write_cache = True
-    if( screen_name == '' ):
-        cache_filename = get_timeline_tweets_cache_filename(kwargs['cache_path'], user_id, max_pages=max_pages, following_lookup=following_lookup, timeline_startdate=timeline_startdate, timeline_scroll_by_hours=timeline_scroll_by_hours)
-    else:
-        cache_filename = get_timeline_tweets_cache_filename(kwargs['cache_path'], screen_name, max_pages=max_pages, following_lookup=following_lookup, timeline_startdate=timeline_startdate, timeline_scroll_by_hours=timeline_scroll_by_hours)
-    
+    is_v2 = isinstance(oauth_or_ostwt, osometweet.OsomeTweet)
+    def fetch_tweets(pages, since_id=None, max_id=None):
 
-    if( kwargs['cache_path'] != '' and kwargs['cache_read'] is True ):
+        if( is_v2 ):
+            return v2_get_timeline_tweets(oauth_or_ostwt, user_id=user_id, max_pages=pages, max_results=kwargs.get('max_results', 100), timeline_startdate=timeline_startdate, timeline_scroll_by_hours=timeline_scroll_by_hours, no_sleep=kwargs['no_sleep'], twitter_api_tweet_fields=kwargs['twitter_api_tweet_fields'], twitter_api_expansion_fields=kwargs['twitter_api_expansion_fields'], rate_limiter=kwargs.get('rate_limiter', None), since_id=since_id, max_id=max_id)
         
-        logger.info('\nget_user_bloc() attempting to read timeline tweets from: ' + cache_filename)
-        tweets = getDictFromJsonGZ( cache_filename )
-        
-        if( len(tweets) == 0 ):
-            write_cache = True
-            logger.info('\tcache MISS')
-        else:
-            write_cache = False
-            logger.info('\tcache HIT')
+        return get_timeline_tweets(oauth_or_ostwt, screen_name, user_id=user_id, max_pages=pages, following_lookup=following_lookup, timeline_startdate=timeline_startdate, timeline_scroll_by_hours=timeline_scroll_by_hours, no_sleep=kwargs['no_sleep'], rate_limiter=kwargs.get('rate_limiter', None), api_base=kwargs.get('twitter_v1_api_base', 'https://api.twitter.com/1.1'), relationship_cache=kwargs.get('relationship_cache', None), friendship_rate_limiter=kwargs.get('friendship_rate_limiter', None), friendship_workers=kwargs.get('friendship_workers', 4), since_id=since_id, max_id=max_id)
 
     prev_now = datetime.now()
-    if( len(tweets) == 0 ):
-
-        if( isinstance(oauth_or_ostwt, osometweet.OsomeTweet) ):
-            tweets = v2_get_timeline_tweets(oauth_or_ostwt, user_id=user_id, max_pages=max_pages, max_results=kwargs.get('max_results', 100), timeline_startdate=timeline_startdate, timeline_scroll_by_hours=timeline_scroll_by_hours, no_sleep=kwargs['no_sleep'], twitter_api_tweet_fields=kwargs['twitter_api_tweet_fields'], twitter_api_expansion_fields=kwargs['twitter_api_expansion_fields'])
+    if( kwargs['cache_path'] != '' and (kwargs['cache_read'] is True or kwargs['cache_write'] is True) ):
+
+        store = kwargs.get('tweet_store', None)
+        store = TweetStore( os.path.join(kwargs['cache_path'], 'timeline_tweets.sqlite') ) if store is None else store
+        user_key = user_id if screen_name == '' else screen_name.lower()
+        #v1.1 user_timeline returns 20 tweets/page, v1.1 ignores --timeline-startdate without --timeline-scroll-by-hours
+        timeline_window = get_request_window(timeline_startdate, timeline_scroll_by_hours, max_pages)
+        if( is_v2 and timeline_startdate != '' and len(timeline_window) == 0 ):
+            #v2 end_time without scrolling: no fixed window, so fetch
+            store = None
+
+        if( store is not None ):
+            logger.info(f'\nget_user_bloc() attempting to read timeline tweets of {user_key} from: {store.db_filename}')
+            tweets, cache_hit = get_store_timeline_tweets(store, user_key, fetch_tweets, max_pages=max_pages, page_size=kwargs.get('max_results', 100) if is_v2 else 20, following_lookup=following_lookup, timeline_window=timeline_window, cache_read=kwargs['cache_read'], cache_write=kwargs['cache_write'], cache_max_age=kwargs.get('cache_max_age', None))
+            logger.info('\tcache HIT' if cache_hit else '\tcache MISS')
         else:
-            tweets = get_timeline_tweets(oauth_or_ostwt, screen_name, user_id=user_id, max_pages=max_pages, following_lookup=following_lookup, timeline_startdate=timeline_startdate, timeline_scroll_by_hours=timeline_scroll_by_hours, no_sleep=kwargs['no_sleep'])
-
-    if( cache_filename != '' and kwargs['cache_write'] is True and write_cache ):
-        gzipTextFile(cache_filename, json.dumps(tweets, ensure_ascii=False))
+            tweets = fetch_tweets(max_pages)
+    else:
+        tweets = fetch_tweets(max_pages)
     
     gen_tweets_total_seconds = (datetime.now() - prev_now).total_seconds()
     prev_now = datetime.now()
@@ -1502,6 +1923,9 @@ def f1_time_function(symbols):
 
 def gen_bloc_for_users(screen_names_or_ids, bearer_token, consumer_key, consumer_secret, access_token, access_token_secret, max_pages=1, following_lookup=False, timeline_startdate=datetime.now().strftime('%Y-%m-%d %H:%M:%S'), timeline_scroll_by_hours=None, ngram=1, **kwargs):
     
+    import osometweet
+    from requests_oauthlib import OAuth1Session
+
     kwargs.setdefault('no_screen_name', False)
     bloc_symbols_file = kwargs.get('bloc_symbols_file', None)
     
@@ -1512,6 +1936,10 @@ def gen_bloc_for_users(screen_names_or_ids, bearer_token, consumer_key, consumer
         logger.warning(f'\ngen_bloc_for_users(): all_bloc_symbols is corrupt (bloc_symbols_file: {bloc_symbols_file}), so returning')
         return {}
 
+    if( is_timezone_good(kwargs.get('timezone', '')) is False ):
+        logger.error(f'\ngen_bloc_for_users(): unknown timezone: {kwargs["timezone"]} (e.g., America/New_York), so returning before fetching timelines')
+        return {}
+
     if( kwargs.get('time_function', 'f1') == 'f1' ):
         f1_time_function(all_bloc_symbols['bloc_alphabets']['time'])
 
@@ -1528,14 +1956,7 @@ def gen_bloc_for_users(screen_names_or_ids, bearer_token, consumer_key, consumer
             screen_names_or_ids = [ u['id'] for u in screen_names_or_ids ]
             kwargs['no_screen_name'] = True
 
-    i = 1
-    all_users_bloc = []
-    src_len = len(screen_names_or_ids)
-    runtime_details = {'gen_tweets_total_seconds': 0, 'gen_bloc_total_seconds': 0}
-
-    for scn_name_or_id in screen_names_or_ids:
-        
-        #logger.info(str(i) + ' of ' + str(src_len))
+    def get_user_bloc_for(scn_name_or_id):
 
         user_id = ''; scn_name = ''
         if( kwargs['no_screen_name'] is True ):
@@ -1543,7 +1964,7 @@ def gen_bloc_for_users(screen_names_or_ids, bearer_token, consumer_key, consumer
         else:
             scn_name = scn_name_or_id
 
-        user_bloc = get_user_bloc(
+        return get_user_bloc(
             oauth_or_ostwt=oauth_or_ostwt,
             screen_name=scn_name,
             user_id=user_id,
@@ -1554,11 +1975,31 @@ def gen_bloc_for_users(screen_names_or_ids, bearer_token, consumer_key, consumer
             **kwargs
         )
 
+    kwargs.setdefault('fetch_workers', 1)
+    if( kwargs['fetch_workers'] > 1 and kwargs.get('rate_limiter', None) is None ):
+        #one bucket shared by all workers so that concurrent fetches stay within the API's per-window quota
+        kwargs['rate_limiter'] = TokenBucket( window_requests=kwargs.get('rate_limit_window_requests', 900), window_seconds=kwargs.get('rate_limit_window_seconds', 900), burst=kwargs.get('rate_limit_burst', 1) )
+
+    if( following_lookup is True ):
+        #shared by all users (and fetch workers) so repeated (source, target) pairs are looked up once within friendship API limits
+        kwargs.setdefault( 'relationship_cache', RelationshipCache(ttl=kwargs.get('friendship_cache_ttl', 604800), cache_file=kwargs.get('friendship_cache_file', '')) )
+        kwargs.setdefault( 'friendship_rate_limiter', TokenBucket(window_requests=180, window_seconds=900) )
+
+    if( kwargs.get('cache_path', '') != '' and (kwargs.get('cache_read', False) is True or kwargs.get('cache_write', False) is True) ):
+        kwargs.setdefault( 'tweet_store', TweetStore(os.path.join(kwargs['cache_path'], 'timeline_tweets.sqlite')) )
+
+    all_users_bloc = []
+    runtime_details = {'gen_tweets_total_seconds': 0, 'gen_bloc_total_seconds': 0}
+
+    if( kwargs['fetch_workers'] > 1 ):
+        with ThreadPoolExecutor(max_workers=kwargs['fetch_workers']) as executor:
+            all_users_bloc = list( executor.map(get_user_bloc_for, screen_names_or_ids) )
+    else:
+        all_users_bloc = [ get_user_bloc_for(scn_name_or_id) for scn_name_or_id in screen_names_or_ids ]
+
+    for user_bloc in all_users_bloc:
         runtime_details['gen_tweets_total_seconds'] += user_bloc['elapsed_time']['gen_tweets_total_seconds']
         runtime_details['gen_bloc_total_seconds'] += user_bloc['elapsed_time']['gen_bloc_total_seconds']
-        all_users_bloc.append( user_bloc )
-
-        i += 1
 
     return {
         'all_users_bloc': all_users_bloc,
@@ -0,0 +1,239 @@
+import json
+import logging
+import numpy as np
+import os
+
+from itertools import islice
+
+from bloc.tf_matrix import TFMatrix
+from bloc.tf_matrix import get_columnar_doc_meta
+from bloc.tokenizer import bloc_count_vectorize
+from bloc.util import fold_word
+from bloc.util import genericErrorInfo
+from bloc.util import get_doc_lst_pos_maps
+
+logger = logging.getLogger('bloc.bloc')
+
+class BLOCHashingVectorizer(object):
+
+    '''
+        Out-of-core BLOC TF/TF-IDF vectorizer for corpora larger than RAM: terms (folded words if bloc_variant is set) are hashed (murmurhash3, as in HashingVectorizer) to n_features columns, so no vocab has to be fit.
+        fit_shards() consumes documents from an iterator (e.g., user_tweets_generator_0()) chunk by chunk, writes the term counts of each chunk to a CSR shard (.npz) in shard_dir,
+        and accumulates document frequencies, so IDF (same formula as TfidfTransformer) is computed from the whole corpus. get_shard()/iter_shards() return TFMatrix shards with TF-IDF matrices.
+        Apart from hash collisions (rare for n_features much larger than the vocab), shards have the same values as get_tf_matrix()/get_bloc_variant_tf_matrix() with min_df=1 and lowercase=False.
+    '''
+
+    version = 1
+    manifest_file = 'bloc_hashing_vectorizer.npz'
+
+    def __init__(self, n_features=2**20, ngram=1, token_pattern='[^□⚀⚁⚂⚃⚄⚅. |()*]+|[□⚀⚁⚂⚃⚄⚅.]', bloc_variant=None, tf_matrix_norm='', tf_idf_norm='l2', lowercase=False):
+
+        self.n_features = n_features
+        self.ngram = ngram
+        self.token_pattern = token_pattern
+        self.bloc_variant = bloc_variant
+        self.tf_matrix_norm = tf_matrix_norm
+        self.tf_idf_norm = tf_idf_norm
+        self.lowercase = lowercase
+
+        self.shard_dir = ''
+        self.shards = []
+        self.doc_count = 0
+        self.doc_freqs = np.zeros( n_features, dtype=np.int64 )
+        #column -> first term hashed to it (names columns in TFMatrix.vocab)
+        self.column_terms = {}
+        self.vocab = None
+
+    def get_columns(self, terms, add_terms=True):
+
+        #murmurhash3 instead of crc32 (used for BLOCSimIndex's term seeds): the low bits of crc32 collide more often for similar BLOC words
+        from sklearn.utils import murmurhash3_32
+
+        if( self.bloc_variant is not None ):
+            terms = [ fold_word( t, self.bloc_variant.get('fold_start_count', 4), count_applies_to_all_char=self.bloc_variant.get('count_applies_to_all_char', False), fold_exclude_chars=self.bloc_variant.get('fold_exclude_chars', '') ) for t in terms ]
+
+        cols = np.array( [ murmurhash3_32(t, positive=True) % self.n_features for t in terms ], dtype=np.int64 )
+        if( add_terms is False ):
+            return cols
+
+        for c, t in zip(cols.tolist(), terms):
+            if( c not in self.column_terms ):
+                self.column_terms[c] = t
+                self.vocab = None
+
+        return cols
+
+    def count(self, docs, add_terms=True):
+
+        '''
+            Returns the (hashed) term-count CSR matrix of docs (list of BLOC strings), add_terms: name columns (see get_vocab()) after new terms
+        '''
+        import scipy.sparse as sp
+
+        try:
+            counts = bloc_count_vectorize( docs, self.ngram, self.token_pattern, lowercase=self.lowercase )
+            if( counts is None ):
+                from sklearn.feature_extraction.text import CountVectorizer
+                count_vectorizer = CountVectorizer( token_pattern=self.token_pattern, ngram_range=(self.ngram, self.ngram), lowercase=self.lowercase )
+                counts = ( count_vectorizer.fit_transform(docs), count_vectorizer.get_feature_names_out() )
+        except ValueError:
+            #no tokens in docs
+            return sp.csr_matrix( (len(docs), self.n_features), dtype=np.int64 )
+
+        raw_counts, raw_vocab = counts
+        cols = self.get_columns(raw_vocab, add_terms=add_terms)
+        hash_mat = sp.csr_matrix( (np.ones(len(cols), dtype=raw_counts.dtype), (np.arange(len(cols)), cols)), shape=(len(cols), self.n_features) )
+
+        return raw_counts.dot(hash_mat).tocsr()
+
+    def get_vocab(self):
+
+        if( self.vocab is None ):
+            self.vocab = np.full( self.n_features, '', dtype=object )
+            for c, t in self.column_terms.items():
+                self.vocab[c] = t
+
+        return self.vocab
+
+    def get_idf(self):
+        return np.log( (1 + self.doc_count) / (1 + self.doc_freqs) ) + 1
+
+    def get_tf_matrix(self, counts, ids, meta):
+
+        from sklearn.preprocessing import normalize
+
+        matrices = {'tf_matrix': counts}
+        if( self.tf_matrix_norm != '' ):
+            matrices['tf_matrix_normalized'] = normalize(counts, norm=self.tf_matrix_norm, axis=1)
+
+        if( self.tf_idf_norm != '' ):
+            matrices['tf_idf_matrix'] = normalize( counts.multiply(self.get_idf()).tocsr(), norm=self.tf_idf_norm, axis=1 )
+
+        tf_matrix = TFMatrix( matrices, self.get_vocab(), token_pattern=self.token_pattern )
+        tf_matrix.set_docs(ids, meta)
+
+        return tf_matrix
+
+    def add_shard(self, doc_lst, pos_id_mapping=None, start=0):
+
+        '''
+            Count doc_lst (BLOC strings or {'text', 'id', ...properties} dicts) and write the counts to the next shard.
+            pos_id_mapping: {position: {'id', ...properties}} of BLOC strings (e.g., filled by user_tweets_generator_0()), start: position of doc_lst[0]; entries of doc_lst are removed from pos_id_mapping
+        '''
+        if( len(doc_lst) != 0 and isinstance(doc_lst[0], dict) ):
+            for i, d in enumerate(doc_lst):
+                d.setdefault('id', start + i)
+            doc_lst, shard_mapping = get_doc_lst_pos_maps(doc_lst)
+        elif( isinstance(pos_id_mapping, dict) ):
+            shard_mapping = { pos - start: pos_id_mapping.pop(pos) for pos in range(start, start + len(doc_lst)) if pos in pos_id_mapping }
+        else:
+            shard_mapping = { i: {'id': start + i} for i in range(len(doc_lst)) }
+
+        counts = self.count(doc_lst)
+        self.doc_freqs += np.bincount( counts.indices, minlength=self.n_features )
+        self.doc_count += counts.shape[0]
+
+        filename = os.path.join( self.shard_dir, 'tf_shard_{:06d}.npz'.format(len(self.shards)) )
+        tf_matrix = TFMatrix( {'tf_matrix': counts}, [], token_pattern=self.token_pattern )
+        tf_matrix.set_docs( *get_columnar_doc_meta(shard_mapping, counts.shape[0]) )
+        tf_matrix.save(filename)
+        self.shards.append({ 'file': os.path.basename(filename), 'rows': counts.shape[0] })
+
+    def fit_shards(self, docs, shard_dir, chunk_size=10000, pos_id_mapping=None):
+
+        '''
+            Vectorize docs (iterator of BLOC strings, e.g., user_tweets_generator_0(filenames, pos_id_mapping, ...), or of {'text', 'id', ...properties} dicts) in chunks of chunk_size documents,
+            writing one shard per chunk to shard_dir, then save the manifest (parameters and document frequencies) to shard_dir (see load())
+        '''
+        os.makedirs(shard_dir, exist_ok=True)
+        self.shard_dir = shard_dir
+        docs = iter(docs)
+
+        while( True ):
+            start = self.doc_count
+            chunk = list( islice(docs, chunk_size) )
+            if( len(chunk) == 0 ):
+                break
+
+            self.add_shard( chunk, pos_id_mapping=pos_id_mapping, start=start )
+            logger.debug( f'\tfit_shards(): {self.doc_count} documents, {len(self.shards)} shards' )
+
+        self.save()
+        return self
+
+    def get_shard(self, i):
+
+        '''
+            Returns TFMatrix of shard i with TF, (if tf_matrix_norm) normalized TF, and (if tf_idf_norm) TF-IDF matrices
+        '''
+        shard = TFMatrix.load( os.path.join(self.shard_dir, self.shards[i]['file']) )
+        return self.get_tf_matrix( shard.get_matrix('tf_matrix'), shard.ids, shard.meta )
+
+    def iter_shards(self):
+        for i in range( len(self.shards) ):
+            yield self.get_shard(i)
+
+    def transform(self, doc_lst):
+
+        '''
+            Returns TFMatrix of new documents weighted with the IDF of the fitted corpus
+        '''
+        if( len(doc_lst) != 0 and isinstance(doc_lst[0], dict) ):
+            doc_lst, pos_id_mapping = get_doc_lst_pos_maps(doc_lst)
+        else:
+            pos_id_mapping = None
+
+        return self.get_tf_matrix( self.count(doc_lst, add_terms=False), *get_columnar_doc_meta(pos_id_mapping, len(doc_lst)) )
+
+    def save(self):
+
+        params = {
+            'model_type': 'BLOCHashingVectorizer',
+            'version': BLOCHashingVectorizer.version,
+            'n_features': self.n_features,
+            'ngram': self.ngram,
+            'token_pattern': self.token_pattern,
+            'bloc_variant': self.bloc_variant,
+            'tf_matrix_norm': self.tf_matrix_norm,
+            'tf_idf_norm': self.tf_idf_norm,
+            'lowercase': self.lowercase,
+            'doc_count': self.doc_count,
+            'shards': self.shards
+        }
+
+        filename = os.path.join(self.shard_dir, BLOCHashingVectorizer.manifest_file)
+        try:
+            columns = np.array( list(self.column_terms.keys()), dtype=np.int64 )
+            with open(filename, 'wb') as outfile:
+                np.savez_compressed(
+                    outfile,
+                    params=np.array( json.dumps(params, ensure_ascii=False) ),
+                    doc_freqs=self.doc_freqs,
+                    columns=columns,
+                    column_terms=np.array( json.dumps(list(self.column_terms.values()), ensure_ascii=False) )
+                )
+        except:
+            genericErrorInfo( f'\n\terror: filename: {filename}' )
+
+    @staticmethod
+    def load(shard_dir):
+
+        '''
+            Load the vectorizer (parameters, document frequencies, and shard list) saved by fit_shards() to shard_dir
+        '''
+        filename = os.path.join(shard_dir, BLOCHashingVectorizer.manifest_file)
+        with np.load(filename, allow_pickle=False) as payload:
+            params = json.loads( str(payload['params']) )
+            if( params.get('model_type', '') != 'BLOCHashingVectorizer' or params.get('version', 0) > BLOCHashingVectorizer.version ):
+                logger.warning( f'\tBLOCHashingVectorizer.load(): unsupported manifest: {filename}' )
+                return None
+
+            vectorizer = BLOCHashingVectorizer( **{ ky: params[ky] for ky in ['n_features', 'ngram', 'token_pattern', 'bloc_variant', 'tf_matrix_norm', 'tf_idf_norm', 'lowercase'] } )
+            vectorizer.doc_freqs = payload['doc_freqs']
+            vectorizer.column_terms = dict( zip(payload['columns'].tolist(), json.loads(str(payload['column_terms']))) )
+
+        vectorizer.shard_dir = shard_dir
+        vectorizer.doc_count = params['doc_count']
+        vectorizer.shards = params['shards']
+
+        return vectorizer
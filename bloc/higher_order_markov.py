@@ -0,0 +1,181 @@
+import logging
+import numpy as np
+
+from bloc.MarkovChain import BLOCMarkovChain
+from bloc.markov_scorer import StateLookup
+
+logger = logging.getLogger('bloc.bloc')
+
+def get_context_keys(ids, pos_in_seq, length, base):
+
+    '''
+        Returns the keys (state ids in base base) of the contexts (previous length states) of all positions, and the positions with at least length previous states in their sequence
+    '''
+    keys = np.zeros( len(ids), dtype=np.int64 )
+    for r in range(length, 0, -1):
+        prev = np.zeros( len(ids), dtype=np.int64 )
+        prev[r:] = ids[:len(ids) - r]
+        keys = keys * base + prev
+
+    return keys, pos_in_seq >= length
+
+def lookup_keys(keys, query):
+
+    '''
+        Returns (position of query in keys (sorted, ends with a sentinel key larger than all queries), found)
+    '''
+    pos = np.searchsorted(keys, query)
+    return pos, keys[pos] == query
+
+class BLOCHigherOrderMarkovChain(object):
+
+    '''
+        k-th order (order=k) or variable-order (variable_order=True) Markov chain over BLOC symbols. Counts are kept in sparse context tables:
+        for each context length 1..k, the sorted keys of the observed (context, next state) pairs and of the observed contexts, so memory grows with the observed contexts instead of |V|^k.
+        * fixed order: P(t|c) with c the (up to) k previous states, smoothed like BLOCMarkovChain: a context with unobserved next states (including the m unseen states of the sequence) is add-one smoothed,
+          (C(c t) + 1)/(C(c) + n + m), and unobserved contexts get 1/(n + m). With order=1, prob_of_sequence() is the same as BLOCMarkovChain.s_prob_of_sequence().
+        * variable order (PPM-style back-off, interpolated with escape counts as in PPM method C / Witten-Bell): P(t|c) = (C(c t) + d(c) P(t|c'))/(C(c) + d(c)),
+          d(c): distinct states observed after c, c': c without its oldest state, backing off to the add-one smoothed state frequencies, unobserved contexts use P(t|c').
+        The first state of a sequence is scored with the start distribution (as BLOCMarkovChain).
+    '''
+
+    def __init__(self, training_sequence_lst=None, order=2, variable_order=False, token_pattern=r'[^ |()*]', model_label=''):
+
+        self.order = order
+        self.variable_order = variable_order
+        self.token_pattern = token_pattern
+        self.model_label = model_label
+
+        self.states = []
+        self.state_lookup = StateLookup([])
+        self.start_dist = {}
+        self.state_counts = np.zeros( 0, dtype=np.int64 )
+        self.tables = []
+
+        if( training_sequence_lst is not None ):
+            self.fit(training_sequence_lst)
+
+    def __len__(self):
+        return len(self.states)
+
+    def get_base(self):
+        #unseen states share id len(self.states), their contexts and pairs are never in the tables
+        return len(self.states) + 1
+
+    def fit(self, sequence_lst):
+
+        if( self.order < 1 ):
+            raise ValueError('order must be >= 1')
+
+        self.states, ids, lengths = BLOCMarkovChain.get_sequence_tokens(sequence_lst, token_pattern=self.token_pattern)
+        self.state_lookup = StateLookup(self.states)
+
+        base = self.get_base()
+        if( base ** (self.order + 1) >= 2 ** 62 ):
+            raise ValueError( f'order {self.order} is too high for {len(self.states)} states' )
+
+        self.start_dist = {}
+        for seq in sequence_lst:
+            if( seq != '' ):
+                self.start_dist[ seq[0] ] = self.start_dist.get( seq[0], 0 ) + 1
+
+        self.state_counts = np.bincount( ids, minlength=len(self.states) )
+        pos_in_seq = np.arange( len(ids) ) - np.repeat( np.cumsum(lengths) - lengths, lengths )
+
+        self.tables = []
+        for length in range(1, self.order + 1):
+
+            ctx_keys, valid = get_context_keys(ids, pos_in_seq, length, base)
+            pair_keys, pair_counts = np.unique( ctx_keys[valid] * base + ids[valid], return_counts=True )
+            ctx_keys, ctx_starts, ctx_distinct = np.unique( pair_keys // base, return_index=True, return_counts=True )
+            ctx_totals = np.add.reduceat( pair_counts, ctx_starts ) if len(ctx_starts) != 0 else np.zeros( 0, dtype=np.int64 )
+
+            #sentinel keys (with zero counts) so lookups never run past the tables
+            sentinel = np.array( [np.iinfo(np.int64).max] )
+            self.tables.append({
+                'pair_keys': np.concatenate( (pair_keys, sentinel) ),
+                'pair_counts': np.append( pair_counts, 0 ),
+                'ctx_keys': np.concatenate( (ctx_keys, sentinel) ),
+                'ctx_totals': np.append( ctx_totals, 0 ),
+                'ctx_distinct': np.append( ctx_distinct, 0 )
+            })
+
+        logger.debug( '\tBLOCHigherOrderMarkovChain.fit(): {} states, contexts per length: {}'.format(len(self.states), [ len(t['ctx_keys']) for t in self.tables ]) )
+        return self
+
+    def prob_of_sequences(self, sequence_lst, log_prob=True):
+
+        '''
+            Returns the (log) probabilities of all sequences (NaN for empty sequences), all positions of all sequences are scored at once
+        '''
+        n = len(self.states)
+        base = self.get_base()
+        probs = np.full( len(sequence_lst), np.nan )
+        if( n == 0 or len(sequence_lst) == 0 ):
+            return probs
+
+        indices = [ self.state_lookup.get_indices(seq) for seq in sequence_lst ]
+        lengths = np.array( [ len(ix) for ix, m in indices ], dtype=np.int64 )
+        unseen = np.array( [ m for ix, m in indices ], dtype=np.int64 )
+        ids = np.minimum( np.concatenate([np.zeros(0, dtype=np.int64)] + [ ix for ix, m in indices ]), n )
+
+        seq_offsets = np.cumsum(lengths) - lengths
+        seq_of_pos = np.repeat( np.arange(len(sequence_lst)), lengths )
+        pos_in_seq = np.arange( len(ids) ) - seq_offsets[seq_of_pos]
+        #states of the sequence's model: training states and its unseen states
+        total_states = n + unseen[seq_of_pos]
+
+        pos_probs = np.ones( len(ids) )
+
+        #start states (see BLOCMarkovScorer)
+        start_counts = np.array( [ self.start_dist.get(s, 0) for s in self.states ] + [0], dtype=np.float64 )
+        start_total = start_counts[:n].sum()
+        starts = pos_in_seq == 0
+        smooth_start = (unseen[seq_of_pos[starts]] != 0) | np.any(start_counts[:n] == 0)
+        pos_probs[starts] = np.where(
+            smooth_start,
+            (start_counts[ids[starts]] + 1)/(start_total + total_states[starts]),
+            start_counts[ids[starts]]/max(start_total, 1)
+        )
+
+        if( self.variable_order is True ):
+            #order 0: add-one smoothed state frequencies
+            state_counts = np.append( self.state_counts, 0 ).astype(np.float64)
+            level_probs = (state_counts[ids] + 1)/(self.state_counts.sum() + total_states)
+
+        for length, table in enumerate(self.tables, 1):
+
+            ctx_keys, valid = get_context_keys(ids, pos_in_seq, length, base)
+            if( self.variable_order is False ):
+                #fixed order: the longest context (up to order) of each position
+                valid &= (pos_in_seq == length) | (length == self.order)
+            valid = np.nonzero(valid)[0]
+
+            ctx_pos, ctx_found = lookup_keys( table['ctx_keys'], ctx_keys[valid] )
+            pair_pos, pair_found = lookup_keys( table['pair_keys'], ctx_keys[valid] * base + ids[valid] )
+
+            pair_counts = np.where( pair_found, table['pair_counts'][pair_pos], 0 )
+            ctx_totals = np.where( ctx_found, table['ctx_totals'][ctx_pos], 0 )
+            ctx_distinct = np.where( ctx_found, table['ctx_distinct'][ctx_pos], 0 )
+
+            if( self.variable_order is True ):
+                lower = level_probs[valid]
+                level_probs[valid] = np.where( ctx_found, (pair_counts + ctx_distinct * lower)/np.maximum(ctx_totals + ctx_distinct, 1), lower )
+            else:
+                add_one = (ctx_distinct < total_states[valid]).astype(np.float64)
+                pos_probs[valid] = (pair_counts + add_one)/(ctx_totals + add_one * total_states[valid])
+
+        if( self.variable_order is True ):
+            pos_probs[~starts] = level_probs[~starts]
+
+        log_probs = np.bincount( seq_of_pos, weights=np.log(pos_probs), minlength=len(sequence_lst) )
+        probs[lengths != 0] = log_probs[lengths != 0]
+
+        return probs if log_prob is True else np.exp(probs)
+
+    def prob_of_sequence(self, sequence, log_prob=True):
+
+        if( len(sequence) == 0 or len(self.states) == 0 ):
+            return None
+
+        return float( self.prob_of_sequences([sequence], log_prob=log_prob)[0] )
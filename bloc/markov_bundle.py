@@ -0,0 +1,185 @@
+import json
+import logging
+import numpy as np
+import os
+import struct
+import zipfile
+
+from datetime import datetime
+
+from bloc.MarkovChain import BLOCMarkovChain
+from bloc.markov_scorer import BLOCMarkovBatchScorer
+from bloc.markov_scorer import BLOCMarkovScorer
+from bloc.util import genericErrorInfo
+
+logger = logging.getLogger('bloc.bloc')
+
+def get_npz_memmaps(filename):
+
+    '''
+        Load the arrays of a .npz file written by np.savez() (uncompressed): numeric arrays are memory-mapped (read-only, pages shared by processes that map the same file), other (e.g., compressed) members are read
+    '''
+    arrays = {}
+    with zipfile.ZipFile(filename) as zf, open(filename, 'rb') as infile:
+        for info in zf.infolist():
+
+            name = info.filename[:-4] if info.filename.endswith('.npy') else info.filename
+            if( info.compress_type != zipfile.ZIP_STORED ):
+                with zf.open(info) as member:
+                    arrays[name] = np.lib.format.read_array(member, allow_pickle=False)
+                continue
+
+            #member data starts after its local file header (30 bytes + file name + extra field)
+            infile.seek(info.header_offset)
+            name_len, extra_len = struct.unpack( '<HH', infile.read(30)[26:30] )
+            infile.seek( info.header_offset + 30 + name_len + extra_len )
+
+            version = np.lib.format.read_magic(infile)
+            read_header = np.lib.format.read_array_header_1_0 if version == (1, 0) else np.lib.format.read_array_header_2_0
+            shape, fortran_order, dtype = read_header(infile)
+
+            if( dtype.kind not in 'biuf' or int(np.prod(shape)) == 0 ):
+                infile.seek( info.header_offset + 30 + name_len + extra_len )
+                arrays[name] = np.lib.format.read_array(infile, allow_pickle=False)
+                continue
+
+            arrays[name] = np.memmap( filename, dtype=dtype, mode='r', offset=infile.tell(), shape=shape, order='F' if fortran_order else 'C' )
+
+    return arrays
+
+class BLOCMarkovModelBundle(object):
+
+    '''
+        Binary (versioned .npz) file of many BLOCMarkovChain training models (e.g., one per account), loaded without parsing JSON.
+        The un-smoothed counts of all models are stored in a few flat arrays (vocab of each model as ids of the bundle's states, start counts, transition counts) sliced by offsets,
+        and the file is not compressed, so load() memory-maps the arrays: processes scoring with the same bundle share its pages, and only the models used are read.
+    '''
+
+    version = 1
+
+    def __init__(self, states, labels, arrays, extra_start_dist=None):
+
+        self.states = states
+        self.labels = labels
+        self.arrays = arrays
+        #start_dist entries of symbols outside a model's vocab (sequences starting with a delimiter), {model index: start_dist}
+        self.extra_start_dist = {} if extra_start_dist is None else extra_start_dist
+        self.label_index = { l: i for i, l in enumerate(labels) }
+
+    def __len__(self):
+        return len(self.labels)
+
+    @staticmethod
+    def from_models(models, labels=None):
+
+        '''
+            models: list of BLOCMarkovChain or training models (e.g., BLOCMarkovChain.train_markov_model()), or {label: model}
+        '''
+        if( isinstance(models, dict) ):
+            labels = list(models.keys())
+            models = list(models.values())
+
+        if( labels is None ):
+            labels = [ m.model_label if isinstance(m, BLOCMarkovChain) else m.get('model_label', '') for m in models ]
+
+        #un-smoothed counts (prob_of_sequence() smooths the training model in place)
+        models = [ BLOCMarkovChain.count_transitions( [], training_model=(m.training_model if isinstance(m, BLOCMarkovChain) else m) ) for m in models ]
+        states = sorted( set(s for m in models for s in m['vocab']) )
+        state_index = { s: i for i, s in enumerate(states) }
+
+        vocab_sizes = np.array( [ len(m['vocab']) for m in models ], dtype=np.int64 )
+        extra_start_dist = {}
+        for i, m in enumerate(models):
+            vocab = set(m['vocab'])
+            extra = { s: c for s, c in m['start_dist'].items() if s not in vocab }
+            if( len(extra) != 0 ):
+                extra_start_dist[i] = extra
+
+        arrays = {
+            'vocab_offsets': np.concatenate( ([0], np.cumsum(vocab_sizes)) ),
+            'state_ids': np.array( [ state_index[s] for m in models for s in m['vocab'] ], dtype=np.int32 ),
+            'start_counts': np.array( [ m['start_dist'][s] for m in models for s in m['vocab'] ], dtype=np.int64 ),
+            'freq_offsets': np.concatenate( ([0], np.cumsum(vocab_sizes ** 2)) ),
+            'freq_counts': np.concatenate( [np.zeros(0, dtype=np.int64)] + [ m['markov_freq_matrix'].ravel() for m in models ] )
+        }
+
+        return BLOCMarkovModelBundle( states, list(labels), arrays, extra_start_dist=extra_start_dist )
+
+    def get_index(self, label):
+        return self.label_index.get(label, -1)
+
+    def get_training_model(self, i):
+
+        '''
+            Returns training model i (same as BLOCMarkovChain.train_markov_model()), its arrays are copies (mle_get_markov_params() updates them)
+        '''
+        start, end = self.arrays['vocab_offsets'][i:i+2]
+        vocab = [ self.states[s] for s in self.arrays['state_ids'][start:end].tolist() ]
+        n = len(vocab)
+
+        freq_start = self.arrays['freq_offsets'][i]
+        markov_freq_matrix = np.array( self.arrays['freq_counts'][freq_start:freq_start + n * n] ).reshape(n, n)
+
+        start_dist = dict( self.extra_start_dist.get(i, {}) )
+        start_dist.update( zip(vocab, self.arrays['start_counts'][start:end].tolist()) )
+
+        return {
+            'vocab': vocab,
+            'start_dist': start_dist,
+            'un_smoothed_markov_freq_matrix': markov_freq_matrix.copy(),
+            'markov_freq_matrix': markov_freq_matrix,
+            'model_label': self.labels[i]
+        }
+
+    def get_model(self, i):
+        return BLOCMarkovChain( model=self.get_training_model(i), model_label=self.labels[i] )
+
+    def get_scorer(self, i):
+        return BLOCMarkovScorer( self.get_training_model(i) )
+
+    def get_batch_scorer(self, indices=None, block_size=256):
+
+        '''
+            BLOCMarkovBatchScorer of models indices (default: all), e.g., score(sequence_lst)[k, q]: (log) probability of sequence q given model indices[k]
+        '''
+        indices = range(len(self)) if indices is None else indices
+        return BLOCMarkovBatchScorer( [ self.get_scorer(i) for i in indices ], block_size=block_size )
+
+    def save(self, filename):
+
+        params = {
+            'model_type': 'BLOCMarkovModelBundle',
+            'version': BLOCMarkovModelBundle.version,
+            'states': self.states,
+            'labels': self.labels,
+            'extra_start_dist': { str(i): d for i, d in self.extra_start_dist.items() },
+            'created_at_utc': datetime.utcnow().isoformat().split('.')[0] + 'Z'
+        }
+
+        try:
+            os.makedirs( os.path.dirname(os.path.abspath(filename)), exist_ok=True )
+            with open(filename, 'wb') as outfile:
+                #not compressed, so load() can memory-map the arrays
+                np.savez( outfile, params=np.array(json.dumps(params, ensure_ascii=False)), **{ ky: np.asarray(v) for ky, v in self.arrays.items() } )
+        except:
+            genericErrorInfo( f'\n\terror: filename: {filename}' )
+
+    @staticmethod
+    def load(filename, mmap=True):
+
+        '''
+            Load bundle written by save(), mmap: memory-map the arrays (see get_npz_memmaps()) instead of reading them
+        '''
+        if( mmap is True ):
+            arrays = get_npz_memmaps(filename)
+        else:
+            with np.load(filename, allow_pickle=False) as payload:
+                arrays = { ky: payload[ky] for ky in payload.files }
+
+        params = json.loads( str(arrays.pop('params')) )
+        if( params.get('model_type', '') != 'BLOCMarkovModelBundle' or params.get('version', 0) > BLOCMarkovModelBundle.version ):
+            logger.warning( f'\tBLOCMarkovModelBundle.load(): unsupported model file: {filename}' )
+            return None
+
+        extra_start_dist = { int(i): d for i, d in params.get('extra_start_dist', {}).items() }
+        return BLOCMarkovModelBundle( params['states'], params['labels'], arrays, extra_start_dist=extra_start_dist )
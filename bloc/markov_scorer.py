@@ -0,0 +1,260 @@
+import logging
+import numpy as np
+
+logger = logging.getLogger('bloc.bloc')
+
+class StateLookup(object):
+
+    '''
+        Maps the states (symbols) of sequences to indices of states, single-character states are looked up by code point (np.searchsorted) instead of per-character dict lookups
+    '''
+
+    def __init__(self, states):
+
+        self.states = list(states)
+        self.state_index = { s: i for i, s in enumerate(self.states) }
+        self.char_states = len(self.states) != 0 and all( isinstance(s, str) and len(s) == 1 for s in self.states )
+
+        if( self.char_states is True ):
+            codes = np.array( [ord(s) for s in self.states], dtype=np.int64 )
+            self.code_order = np.argsort(codes)
+            self.sorted_codes = codes[self.code_order]
+
+    def get_indices(self, sequence):
+
+        '''
+            Returns (state indices of sequence, count of unseen states), unseen states get indices n, n+1, ...
+        '''
+        n = len(self.states)
+        if( isinstance(sequence, str) and self.char_states is True ):
+            codes = np.frombuffer( sequence.encode('utf-32-le'), dtype='<u4' ).astype(np.int64)
+            pos = np.minimum( np.searchsorted(self.sorted_codes, codes), n - 1 )
+            indices = self.code_order[pos]
+            unseen = self.sorted_codes[pos] != codes
+        else:
+            indices = np.array( [ self.state_index.get(s, -1) for s in sequence ], dtype=np.int64 )
+            unseen = indices == -1
+            codes = None
+
+        if( not np.any(unseen) ):
+            return indices, 0
+
+        unseen_states = codes[unseen] if codes is not None else np.array( [ s for s, u in zip(sequence, unseen) if u ], dtype=object )
+        new_states, new_indices = np.unique( unseen_states, return_inverse=True )
+        indices[unseen] = n + new_indices.ravel()
+
+        return indices, len(new_states)
+
+class BLOCMarkovScorer(object):
+
+    '''
+        Compiled (read-only) form of a BLOCMarkovChain training model for scoring many sequences: a state->index dict,
+        and the smoothed start and transition log-probabilities precomputed once, so a sequence is scored by a gather-and-sum over its state indices.
+        prob_of_sequence() returns the same values as BLOCMarkovChain.s_prob_of_sequence(training_model, sequence), including for sequences with unseen states:
+        mle_get_markov_params() adds m unseen states with zero counts, so every start count and every row (new rows have n+m zeros) is add-one smoothed,
+        i.e., P(s) = (C(s) + 1)/(C + n + m) and P(t|s) = (C(s t) + 1)/(C(s *) + n + m), with C(.) = 0 for unseen states, computed without growing the matrices.
+    '''
+
+    def __init__(self, training_model):
+
+        self.states = list( training_model.get('vocab', []) )
+        n = len(self.states)
+
+        start_counts = np.array( [ training_model['start_dist'].get(s, 0) for s in self.states ], dtype=np.float64 )
+        freq_mat = np.array( training_model.get('markov_freq_matrix', []), dtype=np.float64 ).reshape(n, n)
+
+        #counts + 1 and totals (without + n + m) used when the sequence has unseen states
+        self.start_counts = start_counts + 1
+        self.start_total = start_counts.sum()
+        self.freq_mat = freq_mat + 1
+        self.row_sums = freq_mat.sum(axis=1)
+
+        #log-probabilities when the sequence has no unseen states (only zero counts are smoothed)
+        if( np.any(start_counts == 0) ):
+            self.log_start = np.log( self.start_counts/(self.start_total + n) )
+        else:
+            self.log_start = np.log( start_counts/self.start_total )
+
+        smooth_rows = np.any(freq_mat == 0, axis=1)
+        freq_mat[smooth_rows] += 1
+        self.log_trans = np.log( freq_mat/freq_mat.sum(axis=1)[:, None] )
+
+        self.state_lookup = StateLookup(self.states)
+
+    def __len__(self):
+        return len(self.states)
+
+    def get_indices(self, sequence):
+        return self.state_lookup.get_indices(sequence)
+
+    def prob_of_sequence(self, sequence, log_prob=True):
+
+        if( len(sequence) == 0 or len(self.states) == 0 ):
+            return None
+
+        indices, new_states_count = self.get_indices(sequence)
+        src = indices[:-1]
+        dst = indices[1:]
+
+        if( new_states_count == 0 ):
+            prob = self.log_start[indices[0]] + self.log_trans[src, dst].sum()
+        else:
+            n = len(self.states)
+            total = n + new_states_count
+            start = indices[0]
+
+            prob = np.log( (self.start_counts[start] if start < n else 1)/(self.start_total + total) )
+
+            seen_src = src < n
+            seen_pair = seen_src & (dst < n)
+            counts = np.ones( len(src) )
+            counts[seen_pair] = self.freq_mat[src[seen_pair], dst[seen_pair]]
+            row_totals = np.full( len(src), float(total) )
+            row_totals[seen_src] += self.row_sums[src[seen_src]]
+            prob += np.log( counts/row_totals ).sum()
+
+        return float(prob) if log_prob is True else float(np.exp(prob))
+
+    def prob_of_sequences(self, sequence_lst, log_prob=True):
+        return [ self.prob_of_sequence(s, log_prob=log_prob) for s in sequence_lst ]
+
+class BLOCMarkovBatchScorer(object):
+
+    '''
+        Scores every (model, sequence) pair of many BLOCMarkovChain models (e.g., one per account) and many sequences: score(sequence_lst)[k, q] = s_prob_of_sequence(models[k], sequence_lst[q]).
+        The models' tables are stacked over the union of their states (shared state space), each sequence is reduced to its start state and transition counts,
+        and the scores of a block of models and a block of sequences are computed with matrix products (transition counts x log-probabilities).
+        Unseen-state smoothing (see BLOCMarkovScorer) depends on m, the count of states of a sequence absent from a model, so for pairs with m > 0 the numerators (log(C(s t) + 1)) are contracted separately
+        from the row normalizers (log(C(s *) + n + m) per transition from s). block_size bounds memory: block_size^2 * len(states) values per block.
+    '''
+
+    def __init__(self, models, block_size=256):
+
+        scorers = []
+        for m in models:
+            if( isinstance(m, BLOCMarkovScorer) ):
+                scorers.append(m)
+            elif( isinstance(m, dict) ):
+                scorers.append( BLOCMarkovScorer(m) )
+            else:
+                #BLOCMarkovChain
+                scorers.append( m.compile() )
+
+        self.block_size = block_size
+        self.states = sorted( set(s for sc in scorers for s in sc.states) )
+        self.state_lookup = StateLookup(self.states)
+
+        k = len(scorers)
+        v = len(self.states)
+        self.vocab_sizes = np.array( [ len(sc) for sc in scorers ], dtype=np.float64 )
+        self.vocab_mask = np.zeros( (k, v) )
+        self.log_start = np.zeros( (k, v) )
+        self.log_start_counts = np.zeros( (k, v) )
+        self.start_totals = np.zeros( k )
+        self.log_trans = np.zeros( (k, v, v) )
+        self.log_freqs = np.zeros( (k, v, v) )
+        self.row_sums = np.zeros( (k, v) )
+
+        for i, sc in enumerate(scorers):
+            if( len(sc) == 0 ):
+                continue
+
+            cols = self.state_lookup.get_indices(sc.states)[0]
+            self.vocab_mask[i, cols] = 1
+            self.log_start[i, cols] = sc.log_start
+            self.log_start_counts[i, cols] = np.log(sc.start_counts)
+            self.start_totals[i] = sc.start_total
+            self.log_trans[np.ix_([i], cols, cols)] = sc.log_trans
+            self.log_freqs[np.ix_([i], cols, cols)] = np.log(sc.freq_mat)
+            self.row_sums[i, cols] = sc.row_sums
+
+    def __len__(self):
+        return len(self.vocab_sizes)
+
+    def get_sequence_stats(self, sequence_lst):
+
+        '''
+            Returns the state indices (states outside the shared state space: -1) of each sequence, its states (presence matrix), and its count of states outside the shared state space
+        '''
+        v = len(self.states)
+        seq_indices = []
+        presence = np.zeros( (len(sequence_lst), v) )
+        extra_states = np.zeros( len(sequence_lst) )
+
+        for q, seq in enumerate(sequence_lst):
+            indices, new_states_count = self.state_lookup.get_indices(seq)
+            indices[indices >= v] = -1
+            seq_indices.append(indices)
+            presence[q, indices[indices != -1]] = 1
+            extra_states[q] = new_states_count
+
+        return seq_indices, presence, extra_states
+
+    def score_block(self, models, seq_indices, presence, extra_states):
+
+        v = len(self.states)
+        q_count = len(seq_indices)
+
+        #transition counts within the shared state space, and transitions from each state (any next state)
+        trans_counts = np.zeros( (q_count, v * v) )
+        out_counts = np.zeros( (q_count, v) )
+        extra_out_counts = np.zeros( q_count )
+        starts = np.zeros( q_count, dtype=np.int64 )
+        empty = np.zeros( q_count, dtype=bool )
+
+        for q, indices in enumerate(seq_indices):
+            if( len(indices) == 0 ):
+                empty[q] = True
+                continue
+
+            starts[q] = indices[0]
+            src = indices[:-1]
+            dst = indices[1:]
+            seen_src = src != -1
+            seen_pair = seen_src & (dst != -1)
+            np.add.at( trans_counts[q], src[seen_pair] * v + dst[seen_pair], 1 )
+            np.add.at( out_counts[q], src[seen_src], 1 )
+            extra_out_counts[q] = np.count_nonzero(~seen_src)
+
+        vocab_mask = self.vocab_mask[models]
+        vocab_sizes = self.vocab_sizes[models]
+        #unseen states of each (model, sequence) pair
+        unseen = presence.dot( 1 - vocab_mask.T ).T + extra_states
+        smoothed = unseen != 0
+
+        seen_start = starts != -1
+        start_col = np.where( seen_start, starts, 0 )
+
+        #no unseen states: precomputed log-probabilities
+        scores = self.log_start[models][:, start_col] + self.log_trans[models].reshape(len(models), -1).dot( trans_counts.T )
+
+        #unseen states: smoothed numerators and per-transition normalizers with n + m states
+        totals = vocab_sizes[:, None] + unseen
+        with np.errstate(divide='ignore', invalid='ignore'):
+            #totals is 0 only for empty models (NaN scores)
+            smoothed_scores = np.where( seen_start[None, :], self.log_start_counts[models][:, start_col], 0 ) - np.log( self.start_totals[models][:, None] + totals )
+            smoothed_scores += self.log_freqs[models].reshape(len(models), -1).dot( trans_counts.T )
+            smoothed_scores -= np.einsum( 'qa,kqa->kq', out_counts, np.log(self.row_sums[models][:, None, :] + totals[:, :, None]) )
+            smoothed_scores -= extra_out_counts[None, :] * np.log(totals)
+
+        scores = np.where( smoothed, smoothed_scores, scores )
+        scores[ :, empty ] = np.nan
+        scores[ vocab_sizes == 0, : ] = np.nan
+
+        return scores
+
+    def score(self, sequence_lst, log_prob=True):
+
+        '''
+            Returns the len(models) x len(sequence_lst) matrix of the (log) probabilities of the sequences, NaN for empty sequences or models
+        '''
+        seq_indices, presence, extra_states = self.get_sequence_stats(sequence_lst)
+        scores = np.zeros( (len(self), len(sequence_lst)) )
+
+        for i in range(0, len(self), self.block_size):
+            models = np.arange( i, min(i + self.block_size, len(self)) )
+            for j in range(0, len(sequence_lst), self.block_size):
+                seqs = slice( j, j + self.block_size )
+                scores[models, seqs] = self.score_block( models, seq_indices[seqs], presence[seqs], extra_states[seqs] )
+
+        return scores if log_prob is True else np.exp(scores)
@@ -0,0 +1,67 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger('bloc.bloc')
+
+class TokenBucket(object):
+
+    '''
+        Thread-safe token bucket shared by workers that call the same API endpoint.
+        window_requests requests are allowed per window_seconds (e.g., 900 requests per 15 minutes),
+        tokens refill continuously at window_requests/window_seconds per second, and at most burst requests go out back to back.
+    '''
+
+    def __init__(self, window_requests=900, window_seconds=900, burst=1):
+
+        self.rate = window_requests/window_seconds
+        self.capacity = max(1, burst)
+        self.tokens = self.capacity
+        self.last_refill = time.monotonic()
+        self.blocked_until = 0
+        self.lock = threading.Lock()
+
+    def refill(self, now):
+
+        self.tokens = min( self.capacity, self.tokens + (now - self.last_refill)*self.rate )
+        self.last_refill = now
+
+    def acquire(self):
+
+        '''
+            Block until a request may be sent
+        '''
+        while( True ):
+            with self.lock:
+                now = time.monotonic()
+                self.refill(now)
+
+                wait = self.blocked_until - now
+                if( wait <= 0 and self.tokens >= 1 ):
+                    self.tokens -= 1
+                    return
+
+                wait = max( wait, (1 - self.tokens)/self.rate )
+
+            time.sleep(wait)
+
+    def sync_window(self, remaining, reset_epoch):
+
+        '''
+            Honour the API's own quota (e.g., x-rate-limit-remaining and x-rate-limit-reset headers):
+            when the window is exhausted, all workers wait for reset_epoch (epoch seconds)
+        '''
+        try:
+            remaining = int(remaining)
+            reset_epoch = int(reset_epoch)
+        except:
+            return
+
+        if( remaining > 0 ):
+            return
+
+        with self.lock:
+            wait = max( 0, reset_epoch - time.time() )
+            self.blocked_until = max( self.blocked_until, time.monotonic() + wait )
+
+        logger.info( f'\tTokenBucket: rate limit window exhausted, pausing requests for {wait:.0f} seconds' )
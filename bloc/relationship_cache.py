@@ -0,0 +1,118 @@
+import json
+import logging
+import os
+import threading
+import time
+
+from bloc.util import genericErrorInfo
+
+logger = logging.getLogger('bloc.bloc')
+
+class RelationshipCache(object):
+
+    '''
+        Cache of friendship_lookup() results keyed by (source, target) screen names (case-insensitive).
+        * ttl: seconds an entry stays valid
+        * cache_file (optional): JSONL file of {"src", "tgt", "src_follows_tgt", "tgt_follows_src", "ts"} rows, loaded at startup (skipping expired rows) and appended to with new lookups
+        * compact_dead_rows: once the file has more than compact_dead_rows dead (expired or superseded) rows, it is rewritten with only the live entries
+    '''
+
+    def __init__(self, ttl=604800, cache_file='', compact_dead_rows=10000):
+
+        self.ttl = ttl
+        self.cache_file = cache_file.strip()
+        self.compact_dead_rows = compact_dead_rows
+        self.cache = {}
+        #rows of cache_file that are not live entries of self.cache
+        self.dead_rows = 0
+        self.lock = threading.Lock()
+
+        self.load_cache_file()
+        with self.lock:
+            self.compact_cache_file_if_needed()
+
+    @staticmethod
+    def get_key(source, target):
+        return ( source.strip().lower(), target.strip().lower() )
+
+    def get(self, source, target):
+
+        '''
+            Returns {'src_follows_tgt': bool, 'tgt_follows_src': bool} or None if not cached or expired
+        '''
+        ky = RelationshipCache.get_key(source, target)
+        with self.lock:
+            entry = self.cache.get(ky, None)
+
+        if( entry is None or time.time() - entry['ts'] > self.ttl ):
+            return None
+
+        return {'src_follows_tgt': entry['src_follows_tgt'], 'tgt_follows_src': entry['tgt_follows_src']}
+
+    def set(self, source, target, src_follows_tgt, tgt_follows_src, ts=None):
+
+        ts = time.time() if ts is None else ts
+        entry = {'src_follows_tgt': src_follows_tgt, 'tgt_follows_src': tgt_follows_src, 'ts': ts}
+        ky = RelationshipCache.get_key(source, target)
+
+        with self.lock:
+            if( ky in self.cache ):
+                self.dead_rows += 1
+            self.cache[ky] = entry
+            self.append_cache_file(ky, entry)
+            self.compact_cache_file_if_needed()
+
+    def load_cache_file(self):
+
+        if( self.cache_file == '' or os.path.exists(self.cache_file) is False ):
+            return
+
+        row_count = 0
+        min_ts = time.time() - self.ttl
+        try:
+            with open(self.cache_file) as infile:
+                for row in infile:
+                    row_count += 1
+                    row = json.loads(row)
+                    if( row['ts'] < min_ts ):
+                        continue
+                    #later rows are newer
+                    self.cache[ (row['src'], row['tgt']) ] = {'src_follows_tgt': row['src_follows_tgt'], 'tgt_follows_src': row['tgt_follows_src'], 'ts': row['ts']}
+        except:
+            genericErrorInfo( f'\n\terror: cache_file: {self.cache_file}' )
+
+        self.dead_rows = row_count - len(self.cache)
+
+    def compact_cache_file_if_needed(self):
+
+        '''
+            Rewrite cache_file with the live (unexpired) entries if it has more than compact_dead_rows dead rows, the caller holds self.lock
+        '''
+        if( self.cache_file == '' or self.dead_rows <= self.compact_dead_rows ):
+            return
+
+        min_ts = time.time() - self.ttl
+        self.cache = { ky: entry for ky, entry in self.cache.items() if entry['ts'] >= min_ts }
+        tmp_filename = self.cache_file + '.tmp'
+
+        try:
+            with open(tmp_filename, 'w') as outfile:
+                for ky, entry in self.cache.items():
+                    outfile.write( json.dumps({'src': ky[0], 'tgt': ky[1], **entry}) + '\n' )
+            #a failed write does not corrupt the previous cache file
+            os.replace(tmp_filename, self.cache_file)
+            logger.info( f'\tRelationshipCache: compacted {self.cache_file} to {len(self.cache)} entries ({self.dead_rows} dead rows)' )
+            self.dead_rows = 0
+        except:
+            genericErrorInfo( f'\n\terror: cache_file: {self.cache_file}' )
+
+    def append_cache_file(self, ky, entry):
+
+        if( self.cache_file == '' ):
+            return
+
+        try:
+            with open(self.cache_file, 'a') as outfile:
+                outfile.write( json.dumps({'src': ky[0], 'tgt': ky[1], **entry}) + '\n' )
+        except:
+            genericErrorInfo( f'\n\terror: cache_file: {self.cache_file}' )
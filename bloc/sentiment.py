@@ -0,0 +1,175 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+
+from abc import ABC
+from abc import abstractmethod
+from collections import OrderedDict
+from multiprocessing import Pool
+
+from bloc.util import genericErrorInfo
+
+logger = logging.getLogger('bloc.bloc')
+
+def textblob_polarity(text):
+
+    try:
+        from textblob import TextBlob
+        return TextBlob(text).sentiment.polarity
+    except:
+        genericErrorInfo()
+
+    return None
+
+class SentimentBackend(ABC):
+
+    '''
+        Interface for the scorer of the content_semantic_sentiment alphabet.
+        polarity(texts) returns a list of polarities in [-1, 1] (None for failures) aligned with texts.
+        close() releases resources (e.g., worker processes), backends are also context managers.
+    '''
+
+    @abstractmethod
+    def polarity(self, texts):
+        pass
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+class TextBlobSentiment(SentimentBackend):
+
+    '''
+        Batched TextBlob polarity:
+        * duplicate texts (e.g., retweets of the same tweet) are scored once
+        * scores are kept in a bounded LRU cache keyed by the SHA-1 of the text
+        * cache_file (optional): JSONL file of {"h": text hash, "s": polarity} rows, loaded at startup and appended to with new scores
+        * workers > 1: texts not in the cache are scored with a process pool if there are at least min_pool_texts of them,
+          the pool is started on first use and reused by later polarity() calls (e.g., other timelines) until close()
+    '''
+
+    def __init__(self, max_cache_size=100000, cache_file='', workers=1, min_pool_texts=500):
+
+        self.max_cache_size = max_cache_size
+        self.cache_file = cache_file.strip()
+        self.workers = workers
+        self.min_pool_texts = min_pool_texts
+        self.cache = OrderedDict()
+        self.pool = None
+        #add_bloc_sequences() may run in several threads (see gen_bloc_for_users() fetch_workers) that share a backend
+        self.lock = threading.RLock()
+
+        self.load_cache_file()
+
+    @staticmethod
+    def get_text_hash(text):
+        return hashlib.sha1( text.encode('utf-8') ).hexdigest()
+
+    def cache_get(self, ky):
+
+        with self.lock:
+            if( ky not in self.cache ):
+                return None
+
+            self.cache.move_to_end(ky)
+            return self.cache[ky]
+
+    def cache_set(self, ky, sent):
+
+        with self.lock:
+            self.cache[ky] = sent
+            self.cache.move_to_end(ky)
+
+            if( len(self.cache) > self.max_cache_size ):
+                self.cache.popitem(last=False)
+
+    def load_cache_file(self):
+
+        if( self.cache_file == '' or os.path.exists(self.cache_file) is False ):
+            return
+
+        try:
+            with open(self.cache_file) as infile:
+                for row in infile:
+                    row = json.loads(row)
+                    self.cache_set( row['h'], row['s'] )
+        except:
+            genericErrorInfo( f'\n\terror: cache_file: {self.cache_file}' )
+
+    def append_cache_file(self, new_scores):
+
+        if( self.cache_file == '' or len(new_scores) == 0 ):
+            return
+
+        try:
+            with self.lock, open(self.cache_file, 'a') as outfile:
+                for ky, sent in new_scores:
+                    outfile.write( json.dumps({'h': ky, 's': sent}) + '\n' )
+        except:
+            genericErrorInfo( f'\n\terror: cache_file: {self.cache_file}' )
+
+    def get_pool(self):
+
+        with self.lock:
+            if( self.pool is None ):
+                self.pool = Pool(processes=self.workers)
+
+            return self.pool
+
+    def close(self):
+
+        with self.lock:
+            if( self.pool is not None ):
+                self.pool.close()
+                self.pool.join()
+                self.pool = None
+
+    def score_texts(self, texts):
+
+        if( self.workers > 1 and len(texts) >= self.min_pool_texts ):
+            return self.get_pool().map( textblob_polarity, texts, chunksize=max(1, len(texts)//(self.workers*4)) )
+
+        return [ textblob_polarity(t) for t in texts ]
+
+    def polarity(self, texts):
+
+        scores = {}
+        pending = OrderedDict()
+        text_keys = [ self.get_text_hash(t) for t in texts ]
+
+        for ky, t in zip(text_keys, texts):
+            if( ky in scores or ky in pending ):
+                continue
+
+            sent = self.cache_get(ky)
+            if( sent is None ):
+                pending[ky] = t
+            else:
+                scores[ky] = sent
+
+        new_scores = []
+        for ky, sent in zip( pending.keys(), self.score_texts(list(pending.values())) ):
+            scores[ky] = sent
+            if( sent is not None ):
+                self.cache_set(ky, sent)
+                new_scores.append( (ky, sent) )
+
+        self.append_cache_file(new_scores)
+        return [ scores[ky] for ky in text_keys ]
+
+#module-level default shared by add_bloc_sequences() calls that do not pass sentiment_backend, so its cache persists across timelines
+_default_sentiment_backend = {}
+
+def get_default_sentiment_backend():
+
+    if( 'backend' not in _default_sentiment_backend ):
+        _default_sentiment_backend['backend'] = TextBlobSentiment()
+
+    return _default_sentiment_backend['backend']
@@ -1,18 +1,20 @@
-import sys
 import logging
-from itertools import combinations
+import numpy as np
+import os
+import sys
 
 from bloc.generator import get_timeline_request_dets
 from bloc.generator import get_word_type
+from bloc.tf_matrix import TFMatrix
 
 from bloc.util import color_bloc_action_str
-from bloc.util import conv_tf_matrix_to_json_compliant
 from bloc.util import cosine_sim
 from bloc.util import dumpJsonToFile
 from bloc.util import five_number_summary
 from bloc.util import get_bloc_doc_lst
 from bloc.util import get_bloc_variant_tf_matrix
 from bloc.util import get_color_txt
+from bloc.util import get_pairwise_cosine_sim
 
 from copy import deepcopy
 
@@ -90,10 +92,13 @@ def print_change_report(change_report, bloc_alphabets):
             single_user_change_prof(chng, alph)
     
 
-def run_subcommands(args, subcommand, bloc_collection):
+def run_subcommands(args, subcommand, bloc_collection, return_tf_matrix=False):
 
+    '''
+        return_tf_matrix: if True, return (report, TFMatrix of the top_ngrams or sim subcommand, None otherwise), e.g., to write the TF matrices with write_output()
+    '''
     if( bloc_collection is None ):
-        return {}
+        return ({}, None) if return_tf_matrix is True else {}
 
     report = []
     bloc_variant = None if args.ngram > 1 else {'type': 'folded_words', 'fold_start_count': args.fold_start_count, 'count_applies_to_all_char': False}
@@ -119,7 +124,8 @@ def run_subcommands(args, subcommand, bloc_collection):
         'tf_matrix_norm': args.tf_matrix_norm,                  #set to '' if tf_matrices['tf_matrix_normalized'] not needed
         'keep_tf_matrix': args.keep_tf_matrix,
         'set_top_ngrams': args.set_top_ngrams,                  #set to False if tf_matrices['top_ngrams']['per_doc'] not needed. If True, keep_tf_matrix must be True
-        'top_ngrams_add_all_docs': args.top_ngrams_add_all_docs #set to False if tf_matrices['top_ngrams']['all_docs'] not needed. If True, keep_tf_matrix must be True
+        'top_ngrams_add_all_docs': args.top_ngrams_add_all_docs,#set to False if tf_matrices['top_ngrams']['all_docs'] not needed. If True, keep_tf_matrix must be True
+        'top_ngrams_k': args.top_ngrams_k                       #if > 0, keep only the top k n-grams per user in tf_matrices['top_ngrams']['per_doc']
     }
 
     #generate collection of BLOC documents
@@ -128,7 +134,7 @@ def run_subcommands(args, subcommand, bloc_collection):
     if( subcommand == 'change' ):
         change_report = all_bloc_change_usr_self_cmp(bloc_collection, bloc_model, args.bloc_alphabets, args.change_mean, args.change_stddev, args.change_zscore_threshold)
         print_change_report(change_report, args.bloc_alphabets)
-        return change_report
+        return (change_report, None) if return_tf_matrix is True else change_report
     
     tf_matrices = get_bloc_variant_tf_matrix(
         bloc_doc_lst, 
@@ -139,24 +145,46 @@ def run_subcommands(args, subcommand, bloc_collection):
         token_pattern=bloc_model['token_pattern'], 
         bloc_variant=bloc_model['bloc_variant'], 
         set_top_ngrams=bloc_model['set_top_ngrams'], 
-        top_ngrams_add_all_docs=bloc_model['top_ngrams_add_all_docs']
+        top_ngrams_add_all_docs=bloc_model['top_ngrams_add_all_docs'],
+        top_ngrams_k=bloc_model['top_ngrams_k'],
+        compact_tf_matrix=(subcommand == 'sim')
     )
 
     if( subcommand == 'top_ngrams' ):
         report = print_top_ngrams(tf_matrices)
         report['users'] = [ u['screen_name'] for u in bloc_doc_lst ]
+    elif( subcommand == 'sim' and getattr(args, 'sim_index_file', '') != '' ):
+        report = ann_usr_cmp(tf_matrices, args.sim_index_file, k=args.sim_top_k if args.sim_top_k > 0 else 10, print_summary=not args.sim_no_summary, n_bits=getattr(args, 'sim_index_bits', 768), bands=getattr(args, 'sim_index_bands', 64))
     elif( subcommand == 'sim' ):
-        report = pairwise_usr_cmp(tf_matrices, print_summary=not args.sim_no_summary)
+        report = pairwise_usr_cmp(tf_matrices, print_summary=not args.sim_no_summary, top_k=getattr(args, 'sim_top_k', 0), block_size=getattr(args, 'sim_block_size', 1000))
+
+    if( return_tf_matrix is True ):
+        if( isinstance(tf_matrices, dict) ):
+            tf_matrices = TFMatrix.from_dict(tf_matrices) if len(tf_matrices) != 0 else None
+        return report, tf_matrices
     
     return report
 
 def feature_importance(vocab, fst_vect, sec_vect, k=10):
 
-    feat_importance = []
-    for i in range( len(vocab) ):
-        feat = vocab[i]
-        feat_importance.append({ 'feat': feat, 'score': fst_vect[i] * sec_vect[i] })
-    feat_importance = sorted( feat_importance, key=lambda x: x['score'], reverse=True )[:k]
+    import scipy.sparse as sp
+
+    #top k features by product of weights (ties broken by vocab position), features absent from either vector score 0
+    scores = sp.csr_matrix(fst_vect).multiply( sp.csr_matrix(sec_vect) ).tocsr()
+    scores.eliminate_zeros()
+    indices = scores.indices
+    data = scores.data
+    if( len(data) > k ):
+        kth = np.partition(data, len(data) - k)[len(data) - k]
+        indices = indices[data >= kth]
+        data = data[data >= kth]
+
+    top = [ (int(indices[o]), float(data[o])) for o in np.lexsort( (indices, -data) )[:k] ]
+    if( len(top) < k ):
+        nonzero = set( scores.indices.tolist() )
+        top += [ (i, 0.0) for i in range( min(len(vocab), len(nonzero) + k) ) if i not in nonzero ][:k - len(top)]
+
+    feat_importance = [ {'feat': vocab[i], 'score': score} for i, score in top ]
     
     counter = 1
     for f in feat_importance:
@@ -166,7 +194,12 @@ def feature_importance(vocab, fst_vect, sec_vect, k=10):
 
     return feat_importance
 
-def pairwise_usr_cmp(tf_mat, print_summary=True):
+def pairwise_usr_cmp(tf_mat, print_summary=True, top_k=0, pairs=None, block_size=1000):
+
+    '''
+        Cosine similarity of users' TF-IDF vectors (tf_mat: get_tf_matrix() payload or TFMatrix), see get_pairwise_cosine_sim() for pairs, top_k, and block_size
+    '''
+    import scipy.sparse as sp
 
     logger.info('\npairwise_usr_cmp():')    
 
@@ -174,33 +207,28 @@ def pairwise_usr_cmp(tf_mat, print_summary=True):
         logger.info('tf_idf_matrix not in tf_mat, returning')
         return []
     
-    report = []
-    avg_sim = []
-    
-    tf_mat = conv_tf_matrix_to_json_compliant(tf_mat)
-    indices = list(range(len(tf_mat['tf_idf_matrix'])))     
-    pairs = combinations(indices, 2)
-
-    for fst_u_indx, sec_u_indx in pairs:
-        fst_u = tf_mat['tf_idf_matrix'][fst_u_indx]
-        sec_u = tf_mat['tf_idf_matrix'][sec_u_indx]
-        
-        if( len(fst_u['tf_vector']) == 0 or len(sec_u['tf_vector']) == 0 ):
-            continue
-        sim = cosine_sim( [fst_u['tf_vector']], [sec_u['tf_vector']] )
+    if( isinstance(tf_mat, dict) ):
+        if( len(tf_mat['tf_idf_matrix']) == 0 ):
+            return []
         
-        avg_sim.append(sim)
-        report.append({
-            'sim': sim,
-            'user_pair_indx': (fst_u_indx, sec_u_indx),
-            'user_pair': (fst_u['screen_name'], sec_u['screen_name'])
-        })
+        vectors = [ u['tf_vector'] for u in tf_mat['tf_idf_matrix'] ]
+        mat = sp.vstack(vectors, format='csr') if sp.issparse(vectors[0]) else sp.csr_matrix( np.array(vectors, dtype=np.float64) )
+        screen_names = [ u['screen_name'] for u in tf_mat['tf_idf_matrix'] ]
+    else:
+        mat = tf_mat.get_matrix('tf_idf_matrix')
+        screen_names = tf_mat.get_meta('screen_name')
+
+    if( mat.shape[1] == 0 ):
+        return []
+
+    sims = get_pairwise_cosine_sim( mat, pairs=pairs, top_k=top_k, block_size=block_size )
+    report = [ {'sim': sim, 'user_pair_indx': (i, j), 'user_pair': (screen_names[i], screen_names[j])} for i, j, sim in sims['pairs'] ]
 
     if( print_summary is False ):
         return report
 
     report = sorted( report, key=lambda x: x['sim'], reverse=True )
-    avg_sim = 0 if avg_sim == [] else sum(avg_sim)/len(avg_sim)
+    avg_sim = 0 if sims['pair_count'] == 0 else sims['sim_sum']/sims['pair_count']
 
     logger.info('\nFeatures importance,')
     for i in range( len(report) ):
@@ -209,7 +237,7 @@ def pairwise_usr_cmp(tf_mat, print_summary=True):
         logger.info( '\t{} vs. {}, (score, feature):'.format(r['user_pair'][0], r['user_pair'][1]) )
         
         fst_u_indx, sec_u_indx = r['user_pair_indx']
-        r['feature_importance'] = feature_importance(tf_mat['vocab'], tf_mat['tf_idf_matrix'][fst_u_indx]['tf_vector'], tf_mat['tf_idf_matrix'][sec_u_indx]['tf_vector'])
+        r['feature_importance'] = feature_importance(tf_mat['vocab'] if isinstance(tf_mat, dict) else tf_mat.vocab, mat[fst_u_indx], mat[sec_u_indx])
         
         logger.info('')
 
@@ -222,6 +250,56 @@ def pairwise_usr_cmp(tf_mat, print_summary=True):
 
     return report
 
+def ann_usr_cmp(tf_mat, index_file, k=10, print_summary=True, n_bits=768, bands=64):
+
+    '''
+        Add users in tf_mat (get_tf_matrix() payload or TFMatrix) to the persistent BLOCSimIndex in index_file (created with n_bits and bands if absent, else its own),
+        and for each user report the top k most similar accounts in the index (including accounts added by previous runs)
+    '''
+    from bloc.ann_index import BLOCSimIndex
+
+    logger.info('\nann_usr_cmp():')
+    if( 'tf_idf_matrix' not in tf_mat ):
+        logger.info('tf_idf_matrix not in tf_mat, returning')
+        return []
+
+    index = BLOCSimIndex.load(index_file) if os.path.exists(index_file) else BLOCSimIndex(n_bits=n_bits, bands=bands)
+    if( index is None ):
+        logger.error( f'\tunsupported index: {index_file}, returning' )
+        return []
+
+    index.add_tf_matrix(tf_mat)
+    index.save(index_file)
+    logger.info( f'\tindex: {index_file}, {len(index)} accounts' )
+
+    screen_names = [ u['screen_name'] for u in tf_mat['tf_idf_matrix'] ] if isinstance(tf_mat, dict) else tf_mat.get_meta('screen_name')
+    user_indices = { u: i for i, u in enumerate(screen_names) }
+    report = []
+    seen_pairs = set()
+    for i, u in enumerate(screen_names):
+        for neighbour, sim in index.query_id(u, k=k):
+            
+            pair = frozenset([u, neighbour])
+            if( pair in seen_pairs ):
+                continue
+            
+            seen_pairs.add(pair)
+            report.append({
+                'sim': sim,
+                'user_pair_indx': (i, user_indices.get(neighbour, None)),
+                'user_pair': (u, neighbour)
+            })
+
+    if( print_summary is False ):
+        return report
+
+    report = sorted( report, key=lambda x: x['sim'], reverse=True )
+    logger.info('Cosine sim (approximate top {} per user),'.format(k))
+    for r in report:
+        logger.info('\t{:.4f}: {} vs. {}'.format(r['sim'], r['user_pair'][0], r['user_pair'][1]))
+
+    return report
+
 def all_bloc_change_usr_self_cmp(bloc_collection, bloc_model, bloc_alphabets, change_mean=None, change_stddev=None, change_zscore_threshold=-1.5):
     
     logger.info('\nall_bloc_change_usr_self_cmp():')
@@ -0,0 +1,231 @@
+import json
+import logging
+import numpy as np
+import os
+
+from bloc.util import conv_tf_matrix_to_json_compliant
+from bloc.util import dumpJsonToFile
+from bloc.util import genericErrorInfo
+from bloc.util import getDictFromFile
+from bloc.util import getDictFromJsonGZ
+from bloc.util import gzipTextFile
+
+logger = logging.getLogger('bloc.bloc')
+
+class TFMatrix(object):
+
+    '''
+        Compact alternative to the get_tf_matrix() payload (get_tf_matrix(..., compact_tf_matrix=True)):
+        * matrices: {'tf_matrix' | 'tf_matrix_normalized' | 'tf_idf_matrix': CSR matrix (one row per document)}, absent variants are not set
+        * vocab: numpy array of features (columns)
+        * ids: document ids (rows), meta: columnar document properties {property: [value per row]}, e.g., meta['screen_name'][i]
+        Instead of one dict (with copies of the document's properties) per row per variant.
+        to_dict() returns the get_tf_matrix() payload for code that expects it.
+        save()/load(): .npz (CSR arrays, JSON vocab and document properties) or JSON (to_json_dict(): sparse tf_vectors) files.
+    '''
+
+    variants = ['tf_matrix', 'tf_matrix_normalized', 'tf_idf_matrix']
+
+    def __init__(self, matrices, vocab, ids=None, meta=None, top_ngrams=None, token_pattern=''):
+
+        self.matrices = { v: m for v, m in matrices.items() if v in TFMatrix.variants and m is not None }
+        self.vocab = np.asarray(vocab)
+        self.top_ngrams = {'per_doc': [], 'all_docs': []} if top_ngrams is None else top_ngrams
+        self.token_pattern = token_pattern
+        self.set_docs( list(range(self.row_count())) if ids is None else ids, {} if meta is None else meta )
+
+    def row_count(self):
+
+        for m in self.matrices.values():
+            return m.shape[0]
+
+        return 0
+
+    def set_docs(self, ids, meta):
+
+        self.ids = list(ids)
+        self.meta = meta
+        self.id_index = { doc_id: i for i, doc_id in enumerate(self.ids) }
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, variant):
+        return variant in self.matrices
+
+    def get_matrix(self, variant='tf_idf_matrix'):
+        return self.matrices[variant]
+
+    def get_row_index(self, doc_id):
+        return self.id_index[doc_id]
+
+    def get_row(self, doc_id, variant='tf_idf_matrix'):
+        return self.matrices[variant][ self.id_index[doc_id] ]
+
+    def get_rows(self, doc_ids, variant='tf_idf_matrix'):
+        return self.matrices[variant][ [self.id_index[d] for d in doc_ids] ]
+
+    def get_doc(self, doc_id):
+
+        '''
+            Returns the properties of the document (without its vector)
+        '''
+        i = self.id_index[doc_id]
+        doc = { ky: val[i] for ky, val in self.meta.items() }
+        doc['id'] = doc_id
+
+        return doc
+
+    def get_meta(self, ky):
+        return self.meta.get(ky, [])
+
+    def to_dict(self):
+
+        '''
+            Returns the (dict-based) get_tf_matrix() payload
+        '''
+        payload = { v: [] for v in TFMatrix.variants }
+        payload['vocab'] = self.vocab
+        payload['top_ngrams'] = {'per_doc': [], 'all_docs': self.top_ngrams['all_docs']}
+        payload['token_pattern'] = self.token_pattern
+
+        docs = [ self.get_doc(doc_id) for doc_id in self.ids ]
+        for v, m in self.matrices.items():
+            payload[v] = [ {'id': docs[i]['id'], 'tf_vector': m[i], **docs[i]} for i in range(m.shape[0]) ]
+
+        for i in range( len(self.top_ngrams['per_doc']) ):
+            payload['top_ngrams']['per_doc'].append( {'id': docs[i]['id'], 'ngrams': self.top_ngrams['per_doc'][i], **docs[i]} )
+
+        return payload
+
+    def to_json_dict(self):
+
+        '''
+            Returns to_dict() with JSON-compliant sparse tf_vectors: {'indices': [column], 'values': [value]}
+        '''
+        return conv_tf_matrix_to_json_compliant( self.to_dict(), sparse=True )
+
+    @staticmethod
+    def from_dict(payload):
+
+        '''
+            Build TFMatrix from get_tf_matrix() payload (e.g., read from to_json_dict() JSON file), tf_vectors: sparse rows, {'indices', 'values'}, or dense lists
+        '''
+        vocab = list( payload.get('vocab', []) )
+        matrices = {}
+        docs = []
+        for v in TFMatrix.variants:
+
+            rows = payload.get(v, [])
+            if( len(rows) == 0 ):
+                continue
+
+            #rows are {'id', 'tf_vector', ...properties} or tf_vectors (get_tf_matrix() without document ids)
+            vectors = [ r['tf_vector'] for r in rows ] if isinstance(rows[0], dict) else rows
+            matrices[v] = get_csr_matrix( vectors, len(vocab) )
+            if( len(docs) == 0 and isinstance(rows[0], dict) ):
+                docs = rows
+
+        tf_matrix = TFMatrix( matrices, vocab, token_pattern=payload.get('token_pattern', '') )
+        if( len(docs) != 0 ):
+            pos_id_mapping = { i: { ky: val for ky, val in d.items() if ky != 'tf_vector' } for i, d in enumerate(docs) }
+            tf_matrix.set_docs( *get_columnar_doc_meta(pos_id_mapping, len(docs)) )
+
+        top_ngrams = payload.get('top_ngrams', {})
+        tf_matrix.top_ngrams['all_docs'] = top_ngrams.get('all_docs', [])
+        tf_matrix.top_ngrams['per_doc'] = [ n['ngrams'] if isinstance(n, dict) else n for n in top_ngrams.get('per_doc', []) ]
+
+        return tf_matrix
+
+    def save(self, filename, extra=None):
+
+        '''
+            Write to filename: .npz (binary CSR matrices, loaded without pickle), .json.gz or JSON (to_json_dict()).
+            extra: JSON-serializable properties (e.g., report) saved with the matrices
+        '''
+        try:
+            if( filename.endswith('.npz') ):
+
+                params = {'vocab': self.vocab.tolist(), 'ids': self.ids, 'meta': self.meta, 'top_ngrams': self.top_ngrams, 'token_pattern': self.token_pattern, 'variants': list(self.matrices), 'extra': extra}
+                arrays = {}
+                for v, m in self.matrices.items():
+                    m = m.tocsr()
+                    arrays.update({ f'{v}_data': m.data, f'{v}_indices': m.indices, f'{v}_indptr': m.indptr, f'{v}_shape': np.array(m.shape) })
+
+                os.makedirs( os.path.dirname(os.path.abspath(filename)), exist_ok=True )
+                with open(filename, 'wb') as outfile:
+                    np.savez_compressed( outfile, params=np.array(json.dumps(params, ensure_ascii=False)), **arrays )
+                return
+
+            payload = self.to_json_dict() if extra is None else {**extra, 'tf_matrix': self.to_json_dict()}
+            if( filename.endswith('.gz') ):
+                gzipTextFile( filename, json.dumps(payload, ensure_ascii=False) )
+            else:
+                dumpJsonToFile( filename, payload, indentFlag=False )
+        except:
+            genericErrorInfo( f'\n\terror: filename: {filename}' )
+
+    @staticmethod
+    def load(filename):
+
+        '''
+            Load TFMatrix written by save()
+        '''
+        import scipy.sparse as sp
+
+        if( filename.endswith('.npz') ):
+            with np.load(filename, allow_pickle=False) as payload:
+                params = json.loads( str(payload['params']) )
+                matrices = { v: sp.csr_matrix( (payload[f'{v}_data'], payload[f'{v}_indices'], payload[f'{v}_indptr']), shape=tuple(payload[f'{v}_shape']) ) for v in params['variants'] }
+
+            tf_matrix = TFMatrix( matrices, params['vocab'], top_ngrams=params['top_ngrams'], token_pattern=params['token_pattern'] )
+            tf_matrix.set_docs( params['ids'], params['meta'] )
+            return tf_matrix
+
+        payload = getDictFromJsonGZ(filename) if filename.endswith('.gz') else getDictFromFile(filename)
+        if( isinstance(payload.get('tf_matrix', None), dict) ):
+            #saved with extra
+            payload = payload['tf_matrix']
+
+        return TFMatrix.from_dict(payload)
+
+def get_csr_matrix(vectors, col_count):
+
+    '''
+        Stack vectors (sparse rows, {'indices', 'values'}, or dense lists) into a CSR matrix
+    '''
+    import scipy.sparse as sp
+
+    if( len(vectors) != 0 and isinstance(vectors[0], dict) ):
+        indptr = np.cumsum( [0] + [ len(v['indices']) for v in vectors ] )
+        indices = np.array( [ i for v in vectors for i in v['indices'] ], dtype=np.int32 )
+        data = np.array( [ d for v in vectors for d in v['values'] ] )
+        return sp.csr_matrix( (data, indices, indptr), shape=(len(vectors), col_count) )
+
+    if( len(vectors) != 0 and sp.issparse(vectors[0]) ):
+        return sp.vstack( vectors, format='csr' )
+
+    return sp.csr_matrix( np.array(vectors).reshape(len(vectors), col_count) )
+
+def get_columnar_doc_meta(pos_id_mapping, row_count):
+
+    '''
+        Convert get_doc_lst_pos_maps().pos_id_mapping ({row: {'id', ...properties}}) to (ids, {property: [value per row]})
+    '''
+    if( pos_id_mapping is None ):
+        return list(range(row_count)), {}
+
+    ids = []
+    meta = {}
+    for pos in range(row_count):
+
+        doc_dct = pos_id_mapping.get(pos, {})
+        ids.append( doc_dct.get('id', pos) )
+
+        for ky, val in doc_dct.items():
+            if( ky == 'id' ):
+                continue
+            meta.setdefault( ky, [None] * row_count )
+            meta[ky][pos] = val
+
+    return ids, meta
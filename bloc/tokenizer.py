@@ -0,0 +1,131 @@
+import logging
+import numpy as np
+import re
+
+from functools import lru_cache
+from itertools import chain
+from itertools import count
+
+logger = logging.getLogger('bloc.bloc')
+
+@lru_cache(maxsize=64)
+def get_bloc_token_spec(token_pattern):
+
+    '''
+        Symbol replacements for the BLOC token patterns (character classes of BLOC symbols) used with CountVectorizer, or None for other patterns:
+        * word: '[^D]+|[S]', e.g., '[^□⚀⚁⚂⚃⚄⚅. |()*]+|[□⚀⚁⚂⚃⚄⚅.]': runs of symbols not in D are words, each symbol in S (pauses) is a word, other symbols in D are delimiters
+        * char: '[^D]' or '([^D])', e.g., '[^ |()*]': every symbol not in D is a token
+    '''
+    match = re.fullmatch(r'\[\^([^\]\\^-]+)\]\+\|\[([^\]\\^-]+)\]', token_pattern)
+    if( match is not None ):
+
+        delimiters = set(match.group(1))
+        singles = set(match.group(2))
+        if( singles.issubset(delimiters) is False or ' ' not in delimiters ):
+            return None
+
+        replacements = [ (c, ' ') for c in sorted(delimiters - singles) ] + [ (c, f' {c} ') for c in sorted(singles) ]
+        return ( 'word', tuple(replacements) )
+
+    match = re.fullmatch(r'(\()?\[\^([^\]\\^-]+)\](\))?', token_pattern)
+    if( match is not None and (match.group(1) is None) == (match.group(3) is None) ):
+        return ( 'char', tuple( (c, '') for c in sorted(set(match.group(2))) ) )
+
+    return None
+
+def replace_symbols(text, replacements):
+
+    #a str.replace() per symbol is faster than str.translate() with non-ASCII tables
+    for old, new in replacements:
+        text = text.replace(old, new)
+    return text
+
+def bloc_count_vectorize(doc_lst, n, token_pattern, lowercase=False, min_df=1):
+
+    '''
+        Same term counts and vocab as CountVectorizer(token_pattern=token_pattern, ngram_range=(n, n), lowercase=lowercase, min_df=min_df).fit_transform(doc_lst)/get_feature_names_out(),
+        without regex or per-token Python code: symbols are replaced to get space-delimited tokens (str.replace()), tokens are mapped to ids in C (np.unique(), dict.setdefault()), and n-grams are counted as integer keys.
+        Returns (CSR matrix, vocab) or None if token_pattern is not a BLOC token pattern (see get_bloc_token_spec()). Raises ValueError like CountVectorizer if no terms remain.
+    '''
+    import scipy.sparse as sp
+
+    spec = get_bloc_token_spec(token_pattern)
+    if( spec is None or n < 1 ):
+        return None
+
+    token_type, replacements = spec
+    doc_lst = [ d.lower() for d in doc_lst ] if lowercase is True else doc_lst
+    doc_count = len(doc_lst)
+
+    if( token_type == 'char' ):
+        texts = [ replace_symbols(d, replacements) for d in doc_lst ]
+        lengths = np.fromiter( map(len, texts), dtype=np.int64, count=doc_count )
+        codes = np.frombuffer( ''.join(texts).encode('utf-32-le'), dtype='<u4' )
+        token_vocab, token_ids = np.unique(codes, return_inverse=True)
+        token_vocab = [ chr(c) for c in token_vocab ]
+    else:
+        texts = [ replace_symbols(d, replacements) for d in doc_lst ]
+        if( re.search(r'[^\S ]', ''.join(texts)) is not None ):
+            #whitespace other than ' ' is part of words
+            words = [ [w for w in t.split(' ') if w != ''] for t in texts ]
+        else:
+            words = [ t.split() for t in texts ]
+
+        lengths = np.fromiter( map(len, words), dtype=np.int64, count=doc_count )
+        #a word's id is the position of its first occurrence, then ids are made contiguous (in token_index order)
+        token_index = {}
+        token_ids = np.fromiter( map(token_index.setdefault, chain.from_iterable(words), count()), dtype=np.int64, count=int(lengths.sum()) )
+        first_pos = np.fromiter( token_index.values(), dtype=np.int64, count=len(token_index) )
+        rank = np.zeros( len(token_ids), dtype=np.int64 )
+        rank[first_pos] = np.arange( len(first_pos) )
+        token_ids = rank[token_ids]
+        token_vocab = list(token_index)
+
+    token_ids = token_ids.astype(np.int64).ravel()
+    base = max( 1, len(token_vocab) )
+    if( base ** n >= 2 ** 62 ):
+        return None
+
+    #n-gram i of a document starts at its token i, key = token ids in base len(token_vocab)
+    offsets = np.cumsum(lengths) - lengths
+    doc_indices = np.repeat( np.arange(doc_count), lengths )
+    starts = np.nonzero( np.arange(len(token_ids)) - offsets[doc_indices] <= lengths[doc_indices] - n )[0]
+    keys = np.zeros( len(starts), dtype=np.int64 )
+    for k in range(n):
+        keys = keys * base + token_ids[starts + k]
+
+    if( len(keys) == 0 ):
+        raise ValueError('empty vocabulary; perhaps the documents only contain stop words')
+
+    if( n == 1 ):
+        unique_keys = np.nonzero( np.bincount(keys, minlength=base) )[0]
+        cols = np.zeros( base, dtype=np.int64 )
+        cols[unique_keys] = np.arange( len(unique_keys) )
+        cols = cols[keys]
+    else:
+        unique_keys, cols = np.unique(keys, return_inverse=True)
+    ngram_ids = []
+    for k in range(n):
+        ngram_ids.insert( 0, (unique_keys % base).tolist() )
+        unique_keys = unique_keys // base
+
+    vocab = [ token_vocab[i] for i in ngram_ids[0] ] if n == 1 else [ ' '.join(token_vocab[i] for i in ngram) for ngram in zip(*ngram_ids) ]
+
+    #CountVectorizer's vocab is sorted
+    order = sorted( range(len(vocab)), key=vocab.__getitem__ )
+    new_cols = np.empty( len(vocab), dtype=np.int64 )
+    new_cols[order] = np.arange( len(vocab) )
+    vocab = [ vocab[o] for o in order ]
+
+    counts = sp.csr_matrix( (np.ones(len(keys), dtype=np.int64), (doc_indices[starts], new_cols[cols.ravel()])), shape=(doc_count, len(vocab)) )
+    counts.sum_duplicates()
+
+    min_doc_count = min_df if isinstance(min_df, (int, np.integer)) else min_df * doc_count
+    if( min_doc_count > 1 ):
+        keep = np.nonzero( np.bincount(counts.indices, minlength=len(vocab)) >= min_doc_count )[0]
+        if( len(keep) == 0 ):
+            raise ValueError('After pruning, no terms remain. Try a lower min_df or a higher max_df.')
+        counts = counts[:, keep]
+        vocab = [ vocab[k] for k in keep ]
+
+    return counts.tocsr(), np.array(vocab, dtype=object)
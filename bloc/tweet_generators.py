@@ -1,13 +1,60 @@
 import gzip
 
+from multiprocessing import Pool
+
 from bloc.generator import add_bloc_sequences
 from bloc.util import genericErrorInfo
 from bloc.util import get_bloc_params
 from bloc.util import get_default_symbols
 from bloc.util import getDictFromJson
 
+#per-process state for user_tweets_generator_0_parallel(), populated once per worker by init_bloc_worker()
+_worker_state = {}
+
+def get_user_tweets_generator_params(**kwargs):
+
+    gen_bloc_params, gen_bloc_args = get_bloc_params([], '', sort_action_words=True, keep_bloc_segments=kwargs.get('keep_bloc_segments', False), tweet_order=kwargs.get('tweet_order', 'sorted') )
+    return gen_bloc_params
+
+def gen_bloc_doc_frm_row(row, all_bloc_symbols, gen_bloc_params):
+
+    '''
+        Returns (doc, bloc_payload) for a single row (user_id_k\tJSON list of tweets) of a user_tweets_generator_0() file
+    '''
+    doc = ''
+    bloc_payload = {}
+
+    try:
+        row = row.decode().split('\t')
+        if( len(row) == 0 ):
+            return doc, bloc_payload
+
+        tweets = row[-1]
+        tweets = getDictFromJson(tweets)
+        bloc_payload = add_bloc_sequences(tweets, all_bloc_symbols=all_bloc_symbols, **gen_bloc_params)
+
+        if( len(tweets) != 0 and 'bloc' in bloc_payload ):
+            doc = [ bloc_payload['bloc'][dim] for dim in bloc_payload['bloc'] ]
+            doc = ' '.join(doc).strip()
+    except:
+        genericErrorInfo()
+
+    return doc, bloc_payload
+
+def get_pos_id_mapping_entry(index, doc, bloc_payload, keep_bloc_details, rm_doc_text):
+
+    entry = {'id': index}
+    for ky in keep_bloc_details:
+        if( ky in bloc_payload ):
+            entry[ky] = bloc_payload[ky]
+
+    if( rm_doc_text is False ):
+        entry['text'] = doc
+
+    return entry
+
 def user_tweets_generator_0(filenames, pos_id_mapping, gen_bloc_params, **kwargs):
-    
+
     '''
         Expects gzip compressed file.
         File format (user_id_k is optional):
@@ -21,39 +68,60 @@ def user_tweets_generator_0(filenames, pos_id_mapping, gen_bloc_params, **kwargs
     all_bloc_symbols = get_default_symbols()
     rm_doc_text = kwargs.get('rm_doc_text', True)
     keep_bloc_details = kwargs.get('keep_bloc_details', ['created_at_utc', 'screen_name', 'user_id'])
-    gen_bloc_params, gen_bloc_args = get_bloc_params([], '', sort_action_words=True, keep_bloc_segments=kwargs.get('keep_bloc_segments', False), tweet_order=kwargs.get('tweet_order', 'sorted') )
+    gen_bloc_params = get_user_tweets_generator_params(**kwargs)
 
     for f in filenames:
         with gzip.open(f, 'rb') as file:
             for row in file:
-                
-                doc = ''
+
                 index += 1
-                
-                try:
-                    row = row.decode().split('\t')
-                    if( len(row) == 0 ):
-                        continue
-                    
-                    tweets = row[-1]
-                    tweets = getDictFromJson(tweets)
-                    bloc_payload = add_bloc_sequences(tweets, all_bloc_symbols=all_bloc_symbols, **gen_bloc_params)
-
-                    if( len(tweets) != 0 and 'bloc' in bloc_payload ):
-                        doc = [ bloc_payload['bloc'][dim] for dim in bloc_payload['bloc'] ]
-                        doc = ' '.join(doc).strip()
-                except:
-                    genericErrorInfo()
+                doc, bloc_payload = gen_bloc_doc_frm_row(row, all_bloc_symbols, gen_bloc_params)
 
                 if( isinstance(pos_id_mapping, dict) ):
-                    
-                    pos_id_mapping[index] = {'id': index}
+                    pos_id_mapping[index] = get_pos_id_mapping_entry(index, doc, bloc_payload, keep_bloc_details, rm_doc_text)
+
+                yield doc
+
+def init_bloc_worker(gen_bloc_params, keep_bloc_details):
+
+    #load symbols once per worker instead of once per row
+    _worker_state['all_bloc_symbols'] = get_default_symbols()
+    _worker_state['gen_bloc_params'] = gen_bloc_params
+    _worker_state['keep_bloc_details'] = keep_bloc_details
+
+def bloc_worker_proc_row(row):
+
+    doc, bloc_payload = gen_bloc_doc_frm_row(row, _worker_state['all_bloc_symbols'], _worker_state['gen_bloc_params'])
+    #return only the details needed for pos_id_mapping so full payloads are not sent back to the parent
+    details = { ky: bloc_payload[ky] for ky in _worker_state['keep_bloc_details'] if ky in bloc_payload }
+
+    return doc, details
+
+def user_tweets_generator_0_rows(filenames):
+
+    for f in filenames:
+        with gzip.open(f, 'rb') as file:
+            for row in file:
+                yield row
+
+def user_tweets_generator_0_parallel(filenames, pos_id_mapping, gen_bloc_params, workers=None, chunksize=64, **kwargs):
+
+    '''
+        Multi-process variant of user_tweets_generator_0() with the same file format and output.
+        Rows are sharded across a pool of workers (workers=None means os.cpu_count()) in chunks of chunksize rows.
+        Documents are yielded in file order, so pos_id_mapping indices match those of user_tweets_generator_0().
+    '''
+
+    index = -1
+    rm_doc_text = kwargs.get('rm_doc_text', True)
+    keep_bloc_details = kwargs.get('keep_bloc_details', ['created_at_utc', 'screen_name', 'user_id'])
+    gen_bloc_params = get_user_tweets_generator_params(**kwargs)
 
-                    for ky in keep_bloc_details:
-                        if( ky in bloc_payload ):
-                            pos_id_mapping[index][ky] = bloc_payload[ky]
+    with Pool(processes=workers, initializer=init_bloc_worker, initargs=(gen_bloc_params, keep_bloc_details)) as pool:
+        for doc, details in pool.imap( bloc_worker_proc_row, user_tweets_generator_0_rows(filenames), chunksize=chunksize ):
 
-                    if( rm_doc_text is False ):
-                        pos_id_mapping[index]['text'] = doc
+            index += 1
+            if( isinstance(pos_id_mapping, dict) ):
+                pos_id_mapping[index] = get_pos_id_mapping_entry(index, doc, details, keep_bloc_details, rm_doc_text)
 
-                yield doc
\ No newline at end of file
+            yield doc
@@ -0,0 +1,151 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+from datetime import datetime
+
+from bloc.util import genericErrorInfo
+
+logger = logging.getLogger('bloc.bloc')
+
+class TweetStore(object):
+
+    '''
+        Tweet-level timeline cache (SQLite) shared by all requests irrespective of max_pages, following_lookup, or dates.
+        * tweets: one zlib-compressed JSON row per (user_key, tweet id), indexed by id and created_at, so time windows are read without decompressing the full history
+        * spans: ranges of a user's timeline known to be fetched contiguously:
+            kind = 'head': newest tweets at fetched_at, paginated backwards to min_id (complete = 1 if the end of the timeline was reached)
+            kind = 'window': all tweets between min_epoch and max_epoch (a --timeline-startdate/--timeline-scroll-by-hours request)
+        user_key is the lowercased screen_name or the user_id used for the request.
+        Tweets fetched with following_lookup carry friendship details, so spans record following_lookup, and requests with following_lookup only use such spans.
+        Tweets also record following_lookup, so a fetch without following_lookup does not overwrite the friendship details of tweets stored by one with following_lookup (spans remain valid).
+    '''
+
+    def __init__(self, db_filename):
+
+        self.db_filename = db_filename
+        self.lock = threading.Lock()
+
+        os.makedirs( os.path.dirname(os.path.abspath(db_filename)), exist_ok=True )
+        #check_same_thread=False: a store is shared by the fetch workers of gen_bloc_for_users(), access is serialized by self.lock
+        self.con = sqlite3.connect(db_filename, check_same_thread=False)
+
+        with self.lock, self.con:
+            self.con.execute('CREATE TABLE IF NOT EXISTS tweets (user_key TEXT, tweet_id INTEGER, created_at INTEGER, tweet BLOB, following_lookup INTEGER NOT NULL DEFAULT 1, PRIMARY KEY (user_key, tweet_id))')
+            if( 'following_lookup' not in [ col[1] for col in self.con.execute('PRAGMA table_info(tweets)') ] ):
+                #stores created before tweets recorded following_lookup: assume tweets have friendship details, since following_lookup spans may cover them
+                self.con.execute('ALTER TABLE tweets ADD COLUMN following_lookup INTEGER NOT NULL DEFAULT 1')
+            self.con.execute('CREATE INDEX IF NOT EXISTS tweets_created_at ON tweets (user_key, created_at)')
+            self.con.execute('CREATE TABLE IF NOT EXISTS spans (user_key TEXT, kind TEXT, following_lookup INTEGER, min_id INTEGER, max_id INTEGER, min_epoch INTEGER, max_epoch INTEGER, complete INTEGER, fetched_at INTEGER)')
+            self.con.execute('CREATE INDEX IF NOT EXISTS spans_user_key ON spans (user_key)')
+
+    @staticmethod
+    def get_created_at_epoch(twt):
+        return int( datetime.strptime(twt['created_at'], '%a %b %d %H:%M:%S %z %Y').timestamp() )
+
+    def put_tweets(self, user_key, tweets, following_lookup=False):
+
+        '''
+            Insert or update tweets, except stored tweets with friendship details (following_lookup) are not replaced by tweets without
+        '''
+        rows = []
+        for twt in tweets:
+            try:
+                rows.append( (user_key, int(twt['id']), TweetStore.get_created_at_epoch(twt), zlib.compress( json.dumps(twt, ensure_ascii=False).encode('utf-8') ), int(following_lookup)) )
+            except:
+                genericErrorInfo()
+
+        with self.lock, self.con:
+            self.con.executemany(
+                'INSERT INTO tweets (user_key, tweet_id, created_at, tweet, following_lookup) VALUES (?, ?, ?, ?, ?) '
+                'ON CONFLICT (user_key, tweet_id) DO UPDATE SET created_at = excluded.created_at, tweet = excluded.tweet, following_lookup = excluded.following_lookup '
+                'WHERE excluded.following_lookup >= tweets.following_lookup',
+                rows
+            )
+
+    def get_tweets(self, user_key, min_id=None, max_id=None, min_epoch=None, max_epoch=None, limit=None):
+
+        '''
+            Returns tweets in reverse chronological order (same order as the Twitter timeline APIs)
+        '''
+        query = 'SELECT tweet FROM tweets WHERE user_key = ?'
+        args = [user_key]
+
+        for col, op, val in [('tweet_id', '>=', min_id), ('tweet_id', '<=', max_id), ('created_at', '>=', min_epoch), ('created_at', '<=', max_epoch)]:
+            if( val is not None ):
+                query += f' AND {col} {op} ?'
+                args.append(val)
+
+        query += ' ORDER BY tweet_id DESC'
+        if( limit is not None ):
+            query += ' LIMIT ?'
+            args.append(limit)
+
+        with self.lock:
+            rows = self.con.execute(query, args).fetchall()
+
+        return [ json.loads( zlib.decompress(r[0]).decode('utf-8') ) for r in rows ]
+
+    def get_head_span(self, user_key, following_lookup):
+
+        with self.lock:
+            row = self.con.execute('SELECT rowid, min_id, max_id, min_epoch, max_epoch, complete, fetched_at FROM spans WHERE user_key = ? AND kind = ? AND following_lookup >= ? ORDER BY max_id DESC LIMIT 1', (user_key, 'head', int(following_lookup))).fetchone()
+
+        if( row is None ):
+            return {}
+
+        return dict( zip(['rowid', 'min_id', 'max_id', 'min_epoch', 'max_epoch', 'complete', 'fetched_at'], row) )
+
+    def set_head_span(self, user_key, following_lookup, min_id, max_id, min_epoch, complete, replace_rowid=None, fetched_at=None):
+
+        #the head span covers up to when its newest tweets were fetched
+        fetched_at = int(time.time()) if fetched_at is None else fetched_at
+        with self.lock, self.con:
+            if( replace_rowid is not None ):
+                self.con.execute('DELETE FROM spans WHERE rowid = ?', (replace_rowid,))
+
+            self.con.execute('INSERT INTO spans VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', (user_key, 'head', int(following_lookup), min_id, max_id, min_epoch, fetched_at, int(complete), fetched_at))
+
+    def add_window_span(self, user_key, following_lookup, min_epoch, max_epoch):
+
+        now = int(time.time())
+        with self.lock, self.con:
+            self.con.execute('INSERT INTO spans VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)', (user_key, 'window', int(following_lookup), None, None, min_epoch, max_epoch, 1, now))
+
+    def is_window_covered(self, user_key, following_lookup, min_epoch, max_epoch):
+
+        '''
+            True if a single span contains [min_epoch, max_epoch]. A head span covers from its oldest tweet to when it was fetched, or from the start of time if complete.
+        '''
+        with self.lock:
+            row = self.con.execute('SELECT 1 FROM spans WHERE user_key = ? AND following_lookup >= ? AND (min_epoch <= ? OR (kind = ? AND complete = 1)) AND max_epoch >= ? LIMIT 1', (user_key, int(following_lookup), min_epoch, 'head', max_epoch)).fetchone()
+
+        return row is not None
+
+    def close(self):
+        with self.lock:
+            self.con.close()
+
+def get_tweet_id_epoch_range(tweets):
+
+    ids = [ int(t['id']) for t in tweets ]
+    epochs = [ TweetStore.get_created_at_epoch(t) for t in tweets ]
+
+    return min(ids), max(ids), min(epochs), max(epochs)
+
+def get_request_window(timeline_startdate, timeline_scroll_by_hours, max_pages):
+
+    '''
+        Returns the (min_epoch, max_epoch) covered by a --timeline-startdate/--timeline-scroll-by-hours request, or () if the request is not for a time window
+    '''
+    if( timeline_startdate == '' or isinstance(timeline_scroll_by_hours, int) is False or timeline_scroll_by_hours == 0 ):
+        return ()
+
+    start = int( datetime.strptime(timeline_startdate + 'Z', '%Y-%m-%d %H:%M:%S%z').timestamp() )
+    end = start + timeline_scroll_by_hours * max_pages * 3600
+
+    return ( min(start, end), max(start, end) )
@@ -3,22 +3,20 @@ import gzip
 import json
 import logging
 import os
-import osometweet
 import re
 import sys
 import time
 import numpy as np
-import scipy.sparse as sp
 import statistics
 
 from argparse import Namespace
-from datetime import datetime
-
-from sklearn.feature_extraction.text import CountVectorizer
-from sklearn.feature_extraction.text import TfidfTransformer
-from sklearn.metrics.pairwise import cosine_similarity
-from sklearn.preprocessing import normalize
+from datetime import datetime, timezone
+from functools import lru_cache
+from itertools import groupby
+from zoneinfo import ZoneInfo
+from zoneinfo import ZoneInfoNotFoundError
 
+#heavy dependencies (osometweet, scipy, sklearn) are imported in the functions that use them to keep bloc's startup time short
 logger = logging.getLogger('bloc.bloc')
 
 def procLogHandler(handler, loggerDets):
@@ -105,11 +103,66 @@ def genericErrorInfo(slug=''):
 
     return errMsg
 
+#timezone - start
+_utc_offset_cache = {}
+
 #http://stackoverflow.com/questions/4770297/python-convert-utc-datetime-string-to-local-datetime
-def datetimeFromUtcToLocal(utc_datetime):
-    now_timestamp = time.time()
-    offset = datetime.fromtimestamp(now_timestamp) - datetime.utcfromtimestamp(now_timestamp)
-    return utc_datetime + offset
+def get_run_utc_offset():
+
+    #offset between the machine's local time and UTC, computed once per run so all tweets in a run share the same offset
+    if( 'run' not in _utc_offset_cache ):
+        now_timestamp = time.time()
+        _utc_offset_cache['run'] = datetime.fromtimestamp(now_timestamp) - datetime.fromtimestamp(now_timestamp, timezone.utc).replace(tzinfo=None)
+
+    return _utc_offset_cache['run']
+
+def is_timezone_good(tz_name):
+
+    '''
+        True if tz_name is a valid datetimeFromUtcToLocal() tz_name, so a misspelled IANA name is reported before timelines are fetched
+    '''
+    if( tz_name is None or tz_name == '' or tz_name.lower() in ['utc', 'local'] ):
+        return True
+
+    try:
+        ZoneInfo(tz_name)
+    except (ValueError, ZoneInfoNotFoundError):
+        return False
+
+    return True
+
+@lru_cache(maxsize=8192)
+def get_zone_utc_offset(tz_name, epoch_window):
+
+    '''
+        Offset between tz_name and UTC for the 15-minute window epoch_window (epoch seconds//900).
+        DST transitions fall on window boundaries, so caching per window avoids a timezone lookup per tweet.
+        tz_name: 'local' (machine's local timezone) or an IANA timezone name (e.g., America/New_York)
+    '''
+    epoch = epoch_window * 900
+    if( tz_name == 'local' ):
+        return datetime.fromtimestamp(epoch) - datetime.fromtimestamp(epoch, timezone.utc).replace(tzinfo=None)
+
+    return datetime.fromtimestamp(epoch, ZoneInfo(tz_name)).utcoffset()
+
+def datetimeFromUtcToLocal(utc_datetime, tz_name=''):
+
+    '''
+        tz_name:
+            '' (default): use the machine's UTC offset at the start of the run for all datetimes
+            'utc': no conversion
+            'local': use the machine's local timezone, the offset follows DST at utc_datetime
+            IANA timezone name (e.g., America/New_York): the offset follows DST at utc_datetime
+    '''
+    if( tz_name is None or tz_name == '' ):
+        return utc_datetime + get_run_utc_offset()
+
+    if( tz_name.lower() == 'utc' ):
+        return utc_datetime
+
+    epoch = int( utc_datetime.replace(tzinfo=timezone.utc).timestamp() )
+    return utc_datetime + get_zone_utc_offset(tz_name, epoch//900)
+#timezone - end
 
 #tweet_datetime: 2020-08-10T23:59:59
 def gen_post_snowflake_twitter_id(tweet_datetime):
@@ -420,12 +473,14 @@ def get_bloc_params(user_ids, bearer_token, token_pattern='word', no_screen_name
         'bearer_token': bearer_token, 
         'blank_mark': 60, 'minute_mark': 5, 'segmentation_type': 'week_number', 'days_segment_count': -1, 
         'bloc_alphabets': bloc_alphabets, 'bloc_symbols_file': None, 
-        'cache_path': '', 'cache_read': False, 'cache_write': False, 
+        'cache_path': '', 'cache_read': False, 'cache_write': False, 'cache_max_age': None,
         'change_mean': 0.61, 
         'change_stddev': 0.3, 
         'change_zscore_threshold': -1.5,
+        'fetch_workers': 1,
         'fold_start_count': 4,
         'following_lookup': False, 
+        'friendship_cache_file': '', 'friendship_cache_ttl': 604800, 'friendship_workers': 4,
         'keep_bloc_segments': False, 
         'keep_tf_matrix': False,
         'keep_tweets': False, 
@@ -434,15 +489,16 @@ def get_bloc_params(user_ids, bearer_token, token_pattern='word', no_screen_name
         'ngram': 1 if token_pattern == 'word' else 2,
         'no_screen_name': no_screen_name, 'no_sleep': no_sleep, 
         'output': None, 
+        'rate_limit_window_requests': 900, 'rate_limit_window_seconds': 900, 'rate_limit_burst': 1,
         'screen_names_or_ids': user_ids, 
         'set_top_ngrams': False,
-        'sim_no_summary': True,
+        'sim_block_size': 1000, 'sim_index_bands': 64, 'sim_index_bits': 768, 'sim_index_file': '', 'sim_no_summary': True, 'sim_top_k': 0,
         'sort_action_words': False,#
         'subcommand': '', 
         'tf_matrix_norm': '',
-        'timeline_startdate': '', 'timeline_scroll_by_hours': None, 'time_function': 'f2', 
+        'timeline_startdate': '', 'timeline_scroll_by_hours': None, 'time_function': 'f2', 'timezone': '',
         'token_pattern': token_pattern,
-        'top_ngrams_add_all_docs': False,
+        'top_ngrams_add_all_docs': False, 'top_ngrams_k': 0,
         'tweet_order': 'reverse'
     }
 
@@ -453,10 +509,14 @@ def get_bloc_params(user_ids, bearer_token, token_pattern='word', no_screen_name
 
 def gen_bloc_variant_tf_mat( tf_matrix, bloc_variant ):
 
+    import scipy.sparse as sp
+
     if( 'tf_matrix' not in tf_matrix or 'vocab' not in tf_matrix or 'type' not in bloc_variant ):
         return {}
 
-    if( len(tf_matrix['tf_matrix']) == 0 ):
+    #tf_matrix['tf_matrix']: get_tf_matrix() list of per-document dicts or TFMatrix CSR matrix
+    is_csr = sp.issparse( tf_matrix['tf_matrix'] )
+    if( (tf_matrix['tf_matrix'].shape[0] if is_csr else len(tf_matrix['tf_matrix'])) == 0 ):
         return {}
 
     expected_types = ['folded_words']
@@ -474,46 +534,22 @@ def gen_bloc_variant_tf_mat( tf_matrix, bloc_variant ):
     logger.debug( '\tcount_applies_to_all_char: {}'.format(bloc_variant['count_applies_to_all_char']) )
     logger.debug( '\told vocab: {} entries'.format(len(tf_matrix['vocab'])) )
 
-    tf_mat = tf_matrix['tf_matrix'][0]['tf_vector']
-    for i in range( 1, len(tf_matrix['tf_matrix']) ):
-        tf_mat = sp.vstack( (tf_mat, tf_matrix['tf_matrix'][i]['tf_vector']), format='csr' )
-
+    tf_mat = tf_matrix['tf_matrix'].tocsr() if is_csr else sp.vstack( [ d['tf_vector'] for d in tf_matrix['tf_matrix'] ], format='csr' )
     new_vocab = gen_folded_vocab( tf_matrix, bloc_variant )
 
     logger.debug('')
     logger.debug( f'new_vocab: {len(new_vocab)} entries' )
-    
-    feature_indx = 0
-    new_tf_mat = None
-    new_vocab_lst = []
-    #this function merges columns of features across all users
-    for v, col_indices in new_vocab.items():
-        
-        logger.debug( '\tfeature_indx: {} {} col_indices: {}'.format(feature_indx, v, col_indices) )
-        feature_indx += 1
-        new_vocab_lst.append(v)
-        
-        if( len(col_indices) == 1 ):
-            
-            indx = col_indices[0]
-            if( new_tf_mat is None ):
-                new_tf_mat = tf_mat[:,indx]
-            else:
-                new_tf_mat = sp.hstack( (new_tf_mat, tf_mat[:,indx]), format='csr' )
-        else:
-            
-            #sum all columns (from col_indices) in tf_mat to merge features
-            indx = col_indices[0]
-            col_sum = tf_mat[:,indx]
-            col_indices.pop(0)
 
-            for indx in col_indices:
-                col_sum = np.sum( [col_sum, tf_mat[:,indx]], axis=0 )
+    #this function merges columns of features across all users: new_tf_mat = tf_mat x fold_mat, where fold_mat[i, j] = 1 if old vocab i folds to new vocab j
+    new_vocab_lst = list( new_vocab.keys() )
+    row_indices = []
+    col_indices = []
+    for j, v in enumerate(new_vocab_lst):
+        row_indices += new_vocab[v]
+        col_indices += [j] * len(new_vocab[v])
 
-            if( new_tf_mat is None ):
-                new_tf_mat = col_sum
-            else:
-                new_tf_mat = sp.hstack( (new_tf_mat, col_sum), format='csr' )
+    fold_mat = sp.csr_matrix( (np.ones(len(row_indices), dtype=tf_mat.dtype), (row_indices, col_indices)), shape=(tf_mat.shape[1], len(new_vocab_lst)) )
+    new_tf_mat = tf_mat.dot(fold_mat).tocsr()
 
     logger.debug('')
     logger.debug( '\tnew_tf_mat shape: {}'.format(new_tf_mat.shape) )
@@ -683,6 +719,9 @@ def get_bloc_variant_tf_matrix(doc_lst, ngram, tf_mat=None, vocab=None, token_pa
             **kwargs
         )
 
+    elif( kwargs.get('compact_tf_matrix', False) is True ):
+        tf_matrix = get_compact_bloc_variant_tf_matrix( doc_lst, ngram, tf_mat=tf_mat, vocab=vocab, token_pattern=token_pattern, **kwargs )
+
     else:
         tf_matrix = get_tf_matrix( 
             doc_lst, 
@@ -715,8 +754,59 @@ def get_bloc_variant_tf_matrix(doc_lst, ngram, tf_mat=None, vocab=None, token_pa
     
     return tf_matrix
 
-def conv_tf_matrix_to_json_compliant(tf_mat):
-    
+def get_compact_bloc_variant_tf_matrix(doc_lst, ngram, tf_mat=None, vocab=None, token_pattern='[^□⚀⚁⚂⚃⚄⚅. |()*]+|[□⚀⚁⚂⚃⚄⚅.]', **kwargs):
+
+    #TFMatrix counterpart of get_bloc_variant_tf_matrix() with bloc_variant: fold the CSR tf_matrix, then derive its normalized/TF-IDF matrices
+    tf_matrix = get_tf_matrix( 
+        doc_lst, 
+        ngram,
+        tf_mat=tf_mat,
+        vocab=vocab,
+        token_pattern=token_pattern,
+        lowercase=False,
+        keep_tf_matrix=True,
+        tf_matrix_norm='',
+        tf_idf_norm='',
+        pos_id_mapping=kwargs.get('pos_id_mapping', None),
+        compact_tf_matrix=True
+    )
+
+    if( isinstance(tf_matrix, dict) or 'tf_matrix' not in tf_matrix ):
+        return {}
+
+    bloc_variant_tf_matrix = gen_bloc_variant_tf_mat( {'tf_matrix': tf_matrix.get_matrix('tf_matrix'), 'vocab': tf_matrix.vocab}, kwargs.pop('bloc_variant') )
+    if( len(bloc_variant_tf_matrix) == 0 ):
+        return {}
+
+    keep_tf_matrix = kwargs.pop('keep_tf_matrix', False)
+    kwargs.pop('pos_id_mapping', None)
+    kwargs.pop('lowercase', None)
+    variant_tf_matrix = get_tf_matrix(
+        doc_lst=['dummy'],
+        n=0,
+        tf_mat=bloc_variant_tf_matrix['tf_matrix'],
+        vocab=bloc_variant_tf_matrix['vocab'],
+        token_pattern=token_pattern,
+        tf_matrix_norm=kwargs.pop('tf_matrix_norm', ''),
+        tf_idf_norm=kwargs.pop('tf_idf_norm', 'l2'),
+        keep_tf_matrix=True,
+        **kwargs
+    )
+
+    if( isinstance(variant_tf_matrix, dict) ):
+        return {}
+
+    variant_tf_matrix.set_docs( tf_matrix.ids, tf_matrix.meta )
+    if( keep_tf_matrix is False ):
+        variant_tf_matrix.matrices.pop('tf_matrix', None)
+
+    return variant_tf_matrix
+
+def conv_tf_matrix_to_json_compliant(tf_mat, sparse=False):
+
+    '''
+        Convert tf_vectors of get_tf_matrix() payload to JSON-compliant dense lists (vocab length) or if sparse is True, {'indices': [column], 'values': [value]} of nonzero values
+    '''
     if( 'vocab' in tf_mat ):
         tf_mat['vocab'] = list(tf_mat['vocab'])
 
@@ -725,20 +815,121 @@ def conv_tf_matrix_to_json_compliant(tf_mat):
             continue
         
         for i in range( len(tf_mat[opt]) ):
-            tf_mat[opt][i]['tf_vector'] = [ float(a) for a in tf_mat[opt][i]['tf_vector'].toarray()[0] ]
+            if( sparse is True ):
+                vect = tf_mat[opt][i]['tf_vector'].tocsr()
+                vect.sort_indices()
+                tf_mat[opt][i]['tf_vector'] = {'indices': vect.indices.tolist(), 'values': vect.data.tolist()}
+            else:
+                tf_mat[opt][i]['tf_vector'] = [ float(a) for a in tf_mat[opt][i]['tf_vector'].toarray()[0] ]
 
     return tf_mat
 
 def cosine_sim(fst_vect, sec_vect):
     
+    from sklearn.metrics.pairwise import cosine_similarity
     sim = cosine_similarity( fst_vect, sec_vect )[0][0]
     sim = 1 if sim > 1 else sim
     sim = -1 if sim < -1 else sim
     
     return sim
 
+def get_pairwise_cosine_sim(mat, pairs=None, top_k=0, block_size=1000):
+
+    '''
+        Cosine similarity of the rows of mat (sparse or dense) computed with sparse products over blocks of block_size rows, so the full similarity matrix is never held in memory.
+        * pairs: list of (i, j) rows to compare, default: all pairs i < j in itertools.combinations() order
+        * top_k: if > 0, keep only the top_k most similar pairs (ties broken by (i, j)), sorted by descending similarity
+        Returns {'pairs': [(i, j, sim), ...], 'sim_sum': sum of similarity of all compared pairs, 'pair_count': number of compared pairs}
+    '''
+    import scipy.sparse as sp
+    from sklearn.preprocessing import normalize
+
+    mat = normalize( sp.csr_matrix(mat, dtype=np.float64), norm='l2', axis=1 )
+    row_count = mat.shape[0]
+    block_size = max(1, block_size)
+    payload = {'pairs': [], 'sim_sum': 0.0, 'pair_count': 0}
+    if( pairs is None and row_count < 2 ):
+        return payload
+    kept = {'i': [], 'j': [], 'sim': []}
+
+    def merge_pairs(k=None):
+
+        for ky in kept:
+            kept[ky] = [ np.concatenate(kept[ky]) ] if len(kept[ky]) != 0 else [ np.zeros(0) ]
+        
+        order = np.lexsort( (kept['j'][0], kept['i'][0], -kept['sim'][0]) )[:k]
+        for ky in kept:
+            kept[ky] = [ kept[ky][0][order] ]
+
+    def add_pairs(i, j, sim):
+
+        kept['i'].append(i)
+        kept['j'].append(j)
+        kept['sim'].append( np.clip(sim, -1, 1) )
+        
+        if( top_k > 0 ):
+            merge_pairs(top_k)
+
+    if( pairs is not None ):
+        
+        pairs = np.asarray(pairs, dtype=np.int64).reshape(-1, 2)
+        for start in range(0, len(pairs), block_size):
+            
+            i = pairs[start:start+block_size, 0]
+            j = pairs[start:start+block_size, 1]
+            sim = np.asarray( mat[i].multiply(mat[j]).sum(axis=1) ).ravel()
+            
+            payload['sim_sum'] += float( np.clip(sim, -1, 1).sum() )
+            payload['pair_count'] += len(sim)
+            add_pairs(i, j, sim)
+    
+    else:
+
+        for start in range(0, row_count, block_size):
+            
+            end = min(start + block_size, row_count)
+            block = mat[start:end].dot(mat.T)
+            payload['sim_sum'] += float( sp.triu(block, k=start+1).sum() )
+            payload['pair_count'] += sum( row_count - i - 1 for i in range(start, end) )
+            
+            if( top_k > 0 ):
+                #pairs with zero similarity are not in the sparse product, see below
+                block = sp.triu(block, k=start+1).tocoo()
+                add_pairs( block.row.astype(np.int64) + start, block.col.astype(np.int64), block.data )
+            else:
+                i, j = np.triu_indices( end - start, k=start+1, m=row_count )
+                add_pairs( i + start, j, block.toarray()[i, j] )
+
+        if( top_k > 0 and len(kept['sim'][0]) < top_k ):
+            #fewer than top_k pairs are similar, fill with dissimilar pairs
+            seen = set( zip(kept['i'][0].tolist(), kept['j'][0].tolist()) )
+            fill = []
+            for i in range(row_count):
+                for j in range(i+1, row_count):
+                    if( len(seen) + len(fill) == top_k ):
+                        break
+                    if( (i, j) not in seen ):
+                        fill.append( (i, j) )
+            
+            if( len(fill) != 0 ):
+                fill = np.array(fill, dtype=np.int64)
+                add_pairs( fill[:, 0], fill[:, 1], np.zeros(len(fill)) )
+
+    if( top_k > 0 ):
+        merge_pairs()
+    
+    for ky in kept:
+        kept[ky] = np.concatenate(kept[ky]) if len(kept[ky]) != 0 else np.zeros(0)
+
+    payload['pairs'] = [ (int(i), int(j), float(sim)) for i, j, sim in zip(kept['i'], kept['j'], kept['sim']) ]
+    return payload
+
 def get_tf_matrix(doc_lst, n, tf_mat=None, vocab=None, token_pattern=r'(?u)\b[a-zA-Z\'\’-]+[a-zA-Z]+\b|\d+[.,]?\d*', **kwargs):
 
+    from sklearn.feature_extraction.text import CountVectorizer
+    from sklearn.feature_extraction.text import TfidfTransformer
+    from sklearn.preprocessing import normalize
+
     kwargs.setdefault('rm_doc_text', True)
     pos_id_mapping = kwargs.get('pos_id_mapping', None)
 
@@ -757,9 +948,12 @@ def get_tf_matrix(doc_lst, n, tf_mat=None, vocab=None, token_pattern=r'(?u)\b[a-
     kwargs.setdefault('lowercase', True)
     kwargs.setdefault('min_df', 1)
     kwargs.setdefault('set_top_ngrams', False)
+    kwargs.setdefault('top_ngrams_k', 0)#if > 0, keep only the top k n-grams per document in top_ngrams['per_doc']
     kwargs.setdefault('tf_matrix_norm', '')#can use l1
     kwargs.setdefault('tf_idf_norm', 'l2')
     kwargs.setdefault('count_vectorizer_kwargs', {})
+    kwargs.setdefault('compact_tf_matrix', False)#True: return TFMatrix (CSR matrices + columnar document properties) instead of per-document dicts
+    kwargs.setdefault('bloc_tokenizer', True)#True: count BLOC token patterns with bloc_count_vectorize() instead of CountVectorizer (same counts and vocab)
 
     #if payload changes, update map_tf_mat_to_doc_ids()
     #also update conv_tf_matrix_to_json_compliant()
@@ -790,8 +984,14 @@ def get_tf_matrix(doc_lst, n, tf_mat=None, vocab=None, token_pattern=r'(?u)\b[a-
             payload['tf_matrix'] = tf_mat
             payload['vocab'] = vocab
         else:
-            payload['tf_matrix'] = count_vectorizer.fit_transform(doc_lst)
-            payload['vocab'] = count_vectorizer.get_feature_names_out()
+            counts = None
+            if( kwargs['bloc_tokenizer'] is True and isinstance(doc_lst, list) and kwargs.get('stop_words', None) is None and kwargs.get('tokenizer', None) is None and len(kwargs['count_vectorizer_kwargs']) == 0 ):
+                from bloc.tokenizer import bloc_count_vectorize
+                counts = bloc_count_vectorize( doc_lst, n, token_pattern, lowercase=kwargs['lowercase'], min_df=kwargs['min_df'] )
+
+            if( counts is None ):
+                counts = ( count_vectorizer.fit_transform(doc_lst), count_vectorizer.get_feature_names_out() )
+            payload['tf_matrix'], payload['vocab'] = counts
 
         if( kwargs['tf_matrix_norm'] != '' ):
             payload['tf_matrix_normalized'] = normalize(payload['tf_matrix'], norm=kwargs['tf_matrix_norm'], axis=1)
@@ -804,6 +1004,8 @@ def get_tf_matrix(doc_lst, n, tf_mat=None, vocab=None, token_pattern=r'(?u)\b[a-
         if( kwargs['keep_tf_matrix'] is False ):
             payload['tf_matrix'] = []
 
+        if( kwargs['compact_tf_matrix'] is True ):
+            return get_compact_tf_matrix( payload, pos_id_mapping, set_top_ngrams=kwargs['set_top_ngrams'], top_ngrams_add_all_docs=kwargs['top_ngrams_add_all_docs'], top_ngrams_k=kwargs['top_ngrams_k'] )
         
         for opt in ['tf_matrix', 'tf_matrix_normalized', 'tf_idf_matrix']:
             if( opt not in payload ):
@@ -814,46 +1016,77 @@ def get_tf_matrix(doc_lst, n, tf_mat=None, vocab=None, token_pattern=r'(?u)\b[a-
         return {}
     
     if( kwargs['set_top_ngrams'] is True ):
-        calc_top_ngrams( payload, top_ngrams_add_all_docs=kwargs['top_ngrams_add_all_docs'] )
+        calc_top_ngrams( payload, top_ngrams_add_all_docs=kwargs['top_ngrams_add_all_docs'], k=kwargs['top_ngrams_k'] )
 
     if( pos_id_mapping is not None ):
         payload = map_tf_mat_to_doc_ids(payload, pos_id_mapping)
 
     return payload
 
-def calc_top_ngrams(payload, top_ngrams_add_all_docs=False):
+def get_compact_tf_matrix(payload, pos_id_mapping, set_top_ngrams=False, top_ngrams_add_all_docs=False, top_ngrams_k=0):
 
-    all_docs_tf = {}
-    all_docs_total_tf = 0
-    corpus_size = len(payload['tf_matrix'])
-    for i in range( corpus_size ):
-        
-        row = payload['tf_matrix'][i].toarray()[0]
-        total_tf = sum(row)
-        if( total_tf == 0 ):
-            total_tf = -1
+    from bloc.tf_matrix import TFMatrix
+    from bloc.tf_matrix import get_columnar_doc_meta
 
-        single_doc_tf = [ {'term': v, 'term_freq': int(row[j]), 'term_rate': row[j]/total_tf} for (j, v) in enumerate(payload['vocab']) if row[j] != 0 ]
-        single_doc_tf = sorted( single_doc_tf, key=lambda i: i['term_freq'], reverse=True )
-        
-        payload['top_ngrams']['per_doc'].append( single_doc_tf )
+    matrices = { opt: payload[opt] for opt in ['tf_matrix', 'tf_matrix_normalized', 'tf_idf_matrix'] if not isinstance(payload[opt], list) }
+    tf_matrix = TFMatrix( matrices, payload['vocab'], top_ngrams=payload['top_ngrams'], token_pattern=payload['token_pattern'] )
+    tf_matrix.set_docs( *get_columnar_doc_meta(pos_id_mapping, tf_matrix.row_count()) )
 
+    if( set_top_ngrams is True and 'tf_matrix' in tf_matrix ):
+        calc_top_ngrams( {'tf_matrix': matrices['tf_matrix'], 'vocab': payload['vocab'], 'top_ngrams': tf_matrix.top_ngrams}, top_ngrams_add_all_docs=top_ngrams_add_all_docs, k=top_ngrams_k )
 
-        if( top_ngrams_add_all_docs is True ):
-            for tf_dct in single_doc_tf:
-                all_docs_tf.setdefault( tf_dct['term'], {'tf': 0, 'df': 0} )
-                all_docs_tf[ tf_dct['term'] ]['tf'] += int(tf_dct['term_freq'])
-                all_docs_tf[ tf_dct['term'] ]['df'] += 1
-                all_docs_total_tf += int(tf_dct['term_freq'])
+    return tf_matrix
+
+def calc_top_ngrams(payload, top_ngrams_add_all_docs=False, k=0):
+
+    '''
+        Set payload['top_ngrams']['per_doc'] (per document, terms by descending term frequency) and payload['top_ngrams']['all_docs'] (terms by descending document frequency)
+        from payload['tf_matrix'] (CSR matrix or list of rows) with one pass over its nonzero entries. k: if > 0, keep only the top k terms per document (ties broken by vocab order)
+    '''
+    import scipy.sparse as sp
+
+    corpus_size = len(payload['tf_matrix']) if isinstance(payload['tf_matrix'], list) else payload['tf_matrix'].shape[0]
+    if( corpus_size == 0 ):
+        return
+
+    tf_mat = sp.vstack(payload['tf_matrix'], format='csr') if isinstance(payload['tf_matrix'], list) else sp.csr_matrix(payload['tf_matrix'])
+    tf_mat = tf_mat.copy()
+    tf_mat.eliminate_zeros()
+    vocab = payload['vocab']
+
+    #order of the nonzero entries: by document, then descending term frequency, then vocab order
+    rows = np.repeat( np.arange(corpus_size), np.diff(tf_mat.indptr) )
+    order = np.lexsort( (tf_mat.indices, -tf_mat.data, rows) )
+    rows = rows[order]
+    cols = tf_mat.indices[order]
+    tfs = tf_mat.data[order]
+
+    total_tfs = np.asarray( tf_mat.sum(axis=1) ).ravel()
+    keep = slice(None)
+    if( k > 0 ):
+        #position of each entry within its document's terms
+        keep = np.arange( len(order) ) - tf_mat.indptr[rows] < k
+
+    keep_rows = rows[keep]
+    keep_indptr = np.concatenate( [[0], np.cumsum( np.bincount(keep_rows, minlength=corpus_size) )] )
+    keep_terms = [ {'term': vocab[c], 'term_freq': int(tf), 'term_rate': r} for c, tf, r in zip( cols[keep].tolist(), tfs[keep].tolist(), (tfs[keep] / total_tfs[keep_rows]).tolist() ) ]
+
+    for i in range( corpus_size ):
+        payload['top_ngrams']['per_doc'].append( keep_terms[keep_indptr[i]:keep_indptr[i+1]] )
 
-    
     if( top_ngrams_add_all_docs is True ):
 
+        col_count = tf_mat.shape[1]
+        term_freqs = np.bincount( tf_mat.indices, weights=tf_mat.data.astype(np.int64), minlength=col_count ).astype(np.int64)
+        doc_freqs = np.bincount( tf_mat.indices, minlength=col_count )
+        all_docs_total_tf = int( term_freqs.sum() )
         if( all_docs_total_tf == 0 ):
             all_docs_total_tf = -1
 
-        payload['top_ngrams']['all_docs'] = sorted( all_docs_tf.items(), key=lambda x: x[1]['df'], reverse=True )
-        payload['top_ngrams']['all_docs'] = [ {'term': t[0], 'term_freq': t[1]['tf'], 'term_rate': t[1]['tf']/all_docs_total_tf, 'doc_freq': t[1]['df'], 'doc_rate': t[1]['df']/corpus_size} for t in payload['top_ngrams']['all_docs'] ]
+        #terms by descending document frequency, ties by the order in which they are first encountered in per-document top n-grams
+        uniq_cols, first_pos = np.unique( cols, return_index=True )
+        all_docs_order = uniq_cols[ np.lexsort( (first_pos, -doc_freqs[uniq_cols]) ) ]
+        payload['top_ngrams']['all_docs'] = [ {'term': vocab[c], 'term_freq': int(term_freqs[c]), 'term_rate': int(term_freqs[c])/all_docs_total_tf, 'doc_freq': int(doc_freqs[c]), 'doc_rate': int(doc_freqs[c])/corpus_size} for c in all_docs_order.tolist() ]
 
 def segment_paren_word(word, sort_paren=True):
     word = word.strip()
@@ -861,7 +1094,8 @@ def segment_paren_word(word, sort_paren=True):
         return []
 
     paren_words = ['']
-    for w in word:
+    #split at parens, so text between parens is appended at once instead of per character
+    for w in re.split(r'([()])', word):
 
         if( w == '(' ):
             paren_words.append('')
@@ -876,6 +1110,8 @@ def segment_paren_word(word, sort_paren=True):
     paren_words = [w for w in paren_words if w != '']
     return paren_words
 
+_letter_run_pattern = re.compile(r'((.)\2*)', re.DOTALL)
+
 def gen_bloc_folded_letters(word, fold_start_count=100, sort_paren=True):
 
     if( word == '' ):
@@ -890,8 +1126,8 @@ def gen_bloc_folded_letters(word, fold_start_count=100, sort_paren=True):
         AB:  A-1,B-1     [(A, 1), (B, 1)]
     '''
     if( word.find('(') == -1 ):
-        #e.g., word: AAAAABBBBBBABABABAB
-        word = [ w for w in word ]
+        #e.g., word: AAAAABBBBBBABABABAB, runs are matched in C
+        return [ (c, len(run)) for run, c in _letter_run_pattern.findall(word) ]
     else:
         '''
         e.g., word: (AAAAABBBBBB)(AB)(AB)(AB)(AB) -> (AAA+BBB+)(AB)(AB)(AB)+, fold_start_count = 4
@@ -906,69 +1142,83 @@ def gen_bloc_folded_letters(word, fold_start_count=100, sort_paren=True):
             else:
                 new_word.append( fold_word(w, fold_start_count) )
         word = new_word
-        
-    c_count = {}
-    prev_c = word[0]
-    word = word + ['*']
-    folded_word = []
-    
-    for i in range( len(word) ):
-        
-        c = word[i]
 
-        if( prev_c != c ):
-            freq = c_count[prev_c]['freq']
-            folded_word.append( (prev_c, freq) )
-            c_count = {}
+    #run-length encoding of paren segments, e.g., [(AB), (AB), A]: [((AB), 2), (A, 1)]
+    return [ (c, len(list(run))) for c, run in groupby(word) ]
 
-        c_count.setdefault(c, {'freq': 0, 'pos': i})
-        c_count[c]['freq'] += 1
-        prev_c = c
+#word -> folded word tables for fold_word() parameters (see add_fold_table()), e.g., fold table shipped with a fitted model
+_fold_tables = {}
 
-    return folded_word
+def get_fold_params(fold_start_count, sort_paren=True, count_applies_to_all_char=False, fold_exclude_chars=''):
+    return ( fold_start_count, sort_paren, count_applies_to_all_char, fold_exclude_chars )
+
+def get_bloc_variant_fold_params(bloc_variant):
+    return get_fold_params( bloc_variant.get('fold_start_count', 4), count_applies_to_all_char=bloc_variant.get('count_applies_to_all_char', False), fold_exclude_chars=bloc_variant.get('fold_exclude_chars', '') )
 
 def fold_word(word, fold_start_count, sort_paren=True, count_applies_to_all_char=False, fold_exclude_chars=''):
 
+    '''
+        Fold runs (of at least fold_start_count) of a BLOC word, e.g., fold_word('TTTTTp⚁p', 4): 'TTT+p⚁p'
+        Folded words are cached: first in the fold tables added with add_fold_table(), then in a bounded LRU cache keyed by (word, fold parameters)
+    '''
     if( fold_start_count < 1 ):
         return word
 
     if( isinstance(word, str) ):
-        word = gen_bloc_folded_letters(word, fold_start_count=fold_start_count, sort_paren=sort_paren)
+        fold_params = get_fold_params( fold_start_count, sort_paren, count_applies_to_all_char, fold_exclude_chars )
+        folded_word = _fold_tables[fold_params].get(word, None) if fold_params in _fold_tables else None
+        return fold_str_word(word, *fold_params) if folded_word is None else folded_word
 
-    new_word = ''
-    exceed_cf_count = 0
-    create_vocab_new_entry = True
+    return fold_letters(word, fold_start_count, count_applies_to_all_char=count_applies_to_all_char, fold_exclude_chars=fold_exclude_chars)
 
-    if( count_applies_to_all_char is True ):
+@lru_cache(maxsize=65536)
+def fold_str_word(word, fold_start_count, sort_paren=True, count_applies_to_all_char=False, fold_exclude_chars=''):
+    return fold_letters( gen_bloc_folded_letters(word, fold_start_count=fold_start_count, sort_paren=sort_paren), fold_start_count, count_applies_to_all_char=count_applies_to_all_char, fold_exclude_chars=fold_exclude_chars )
 
-        for c, cf in word:
-            if( cf >= fold_start_count and c not in fold_exclude_chars ):
-                
-                plus_count = fold_start_count - 1 if fold_start_count > 1 else 1
-                
-                new_word += f'{c*plus_count}+'
-                exceed_cf_count += 1
-            else:
-                new_word += f'{c*cf}'
+def fold_letters(word, fold_start_count, count_applies_to_all_char=False, fold_exclude_chars=''):
 
-        if( exceed_cf_count == len(word) ):
-            create_vocab_new_entry = False
-        else:
-            new_word  = ''.join([ c[0] for c in word ])
-    else:
+    '''
+        Fold the output of gen_bloc_folded_letters(), i.e., [(letter, run length)]
+    '''
+    plus_count = fold_start_count - 1 if fold_start_count > 1 else 1
+    keep = [ c in fold_exclude_chars or cf < fold_start_count for c, cf in word ]
+    new_word = ''.join([ c*cf if k else f'{c*plus_count}+' for (c, cf), k in zip(word, keep) ])
 
-        for c, cf in word:
-            if( cf >= fold_start_count and c not in fold_exclude_chars ):
-                
-                create_vocab_new_entry = False
-                plus_count = fold_start_count - 1 if fold_start_count > 1 else 1
-                
-                new_word += f'{c*plus_count}+'
-            else:
-                new_word += f'{c*cf}'
+    if( count_applies_to_all_char is True and any(keep) ):
+        new_word = ''.join([ c[0] for c in word ])
 
     return new_word
 
+def get_fold_table(words, bloc_variant):
+
+    '''
+        Returns {word: folded word} for bloc_variant (e.g., {'type': 'folded_words', 'fold_start_count': 4, 'count_applies_to_all_char': False})
+    '''
+    fold_params = get_bloc_variant_fold_params(bloc_variant)
+    return { w: fold_word(w, fold_params[0], count_applies_to_all_char=fold_params[2], fold_exclude_chars=fold_params[3]) for w in words }
+
+def add_fold_table(fold_table, bloc_variant):
+
+    '''
+        Make fold_word() look up precomputed folded words (e.g., from get_fold_table() in another process) for bloc_variant
+    '''
+    _fold_tables.setdefault( get_bloc_variant_fold_params(bloc_variant), {} ).update(fold_table)
+
+def save_fold_table(filename, fold_table, bloc_variant):
+    gzipTextFile( filename, json.dumps({'bloc_variant': bloc_variant, 'fold_table': fold_table}, ensure_ascii=False) )
+
+def load_fold_table(filename):
+
+    '''
+        Load a fold table saved with save_fold_table() and add it to fold_word()'s fold tables
+    '''
+    payload = getDictFromJsonGZ(filename)
+    if( 'fold_table' not in payload or 'bloc_variant' not in payload ):
+        return {}
+
+    add_fold_table( payload['fold_table'], payload['bloc_variant'] )
+    return payload['fold_table']
+
 
 def bloc_sf_content_map(bloc_str, typ):
 
@@ -1037,6 +1287,8 @@ def get_social_fingerprint_frm_bloc( bloc_str, dimension='action' ):
 #twitter v2 - start
 def twitter_v2_user_lookup_ids(osome_twt_obj, screen_names):
 
+    import osometweet
+
     logger.info( '\ntwitter_v2_user_lookup_ids():' )
 
     max_users_for_req = len(screen_names)
@@ -0,0 +1,188 @@
+import json
+import logging
+import numpy as np
+
+from bloc.tf_matrix import TFMatrix
+from bloc.tf_matrix import get_columnar_doc_meta
+from bloc.tokenizer import bloc_count_vectorize
+from bloc.util import add_fold_table
+from bloc.util import fold_word
+from bloc.util import getDictFromJsonGZ
+from bloc.util import get_doc_lst_pos_maps
+from bloc.util import gzipTextFile
+
+logger = logging.getLogger('bloc.bloc')
+
+class BLOCVectorizerModel(object):
+
+    '''
+        BLOC TF/TF-IDF vectorizer fitted once (vocab, folded-vocab mapping, IDF weights) and saved to a file,
+        so new documents are vectorized with transform() without refitting (e.g., to score a single account).
+        fit_transform(doc_lst) returns the same TFMatrix as get_bloc_variant_tf_matrix(doc_lst, ..., compact_tf_matrix=True) with the same parameters.
+        * doc_lst: list of BLOC strings or list of {'text': BLOC string, 'id', ...properties} (see get_tf_matrix())
+        * bloc_variant: e.g., {'type': 'folded_words', 'fold_start_count': 4, 'count_applies_to_all_char': False}, words (including words unseen during fit) are counted as their folded words
+    '''
+
+    version = 1
+
+    def __init__(self, ngram=1, token_pattern='[^□⚀⚁⚂⚃⚄⚅. |()*]+|[□⚀⚁⚂⚃⚄⚅.]', bloc_variant=None, tf_matrix_norm='', tf_idf_norm='l2', min_df=1, lowercase=False):
+
+        self.ngram = ngram
+        self.token_pattern = token_pattern
+        self.bloc_variant = bloc_variant
+        self.tf_matrix_norm = tf_matrix_norm
+        self.tf_idf_norm = tf_idf_norm
+        self.min_df = min_df
+        self.lowercase = lowercase
+
+        self.vocab = []
+        self.vocab_index = {}
+        self.idf = np.zeros(0)
+        #raw word -> folded word
+        self.fold_table = {}
+
+    def is_fitted(self):
+        return len(self.vocab) != 0
+
+    def get_count_vectorizer(self, min_df=1):
+
+        from sklearn.feature_extraction.text import CountVectorizer
+        return CountVectorizer( token_pattern=self.token_pattern, ngram_range=(self.ngram, self.ngram), lowercase=self.lowercase, min_df=min_df )
+
+    def fold_vocab(self, raw_vocab, fit=False):
+
+        '''
+            Returns the folded words of raw_vocab. Only words seen during fit are added to self.fold_table (saved with the model),
+            other words are folded with fold_word() (bounded cache), and count() drops those whose folded words are not in self.vocab
+        '''
+        if( self.bloc_variant is None ):
+            return list(raw_vocab)
+
+        folded = []
+        for v in raw_vocab:
+            folded_word = self.fold_table.get(v, None)
+            if( folded_word is None ):
+                folded_word = fold_word( v, self.bloc_variant.get('fold_start_count', 4), count_applies_to_all_char=self.bloc_variant.get('count_applies_to_all_char', False), fold_exclude_chars=self.bloc_variant.get('fold_exclude_chars', '') )
+                if( fit is True ):
+                    self.fold_table[v] = folded_word
+            folded.append(folded_word)
+
+        return folded
+
+    @staticmethod
+    def get_docs(doc_lst):
+
+        if( len(doc_lst) != 0 and isinstance(doc_lst[0], dict) ):
+            return get_doc_lst_pos_maps(doc_lst)
+
+        return doc_lst, None
+
+    def count(self, docs, fit=False):
+
+        '''
+            Returns the term-count CSR matrix of docs over self.vocab (fit=True sets self.vocab)
+        '''
+        import scipy.sparse as sp
+
+        min_df = self.min_df if fit is True else 1
+        try:
+            counts = bloc_count_vectorize( list(docs), self.ngram, self.token_pattern, lowercase=self.lowercase, min_df=min_df )
+            if( counts is None ):
+                count_vectorizer = self.get_count_vectorizer(min_df=min_df)
+                counts = ( count_vectorizer.fit_transform(docs), count_vectorizer.get_feature_names_out() )
+        except ValueError:
+            #no tokens in docs
+            if( fit is True ):
+                raise
+            return sp.csr_matrix( (len(docs), len(self.vocab)), dtype=np.int64 )
+
+        raw_counts, raw_vocab = counts
+        folded_vocab = self.fold_vocab(raw_vocab, fit=fit)
+        if( fit is True ):
+            self.vocab = list( dict.fromkeys(folded_vocab) )
+            self.vocab_index = { v: i for i, v in enumerate(self.vocab) }
+
+        #project raw words to (folded) vocab, raw words absent from vocab are dropped
+        cols = np.array( [ self.vocab_index.get(v, -1) for v in folded_vocab ], dtype=np.int64 )
+        rows = np.nonzero(cols != -1)[0]
+        fold_mat = sp.csr_matrix( (np.ones(len(rows), dtype=raw_counts.dtype), (rows, cols[rows])), shape=(len(folded_vocab), len(self.vocab)) )
+
+        return raw_counts.dot(fold_mat).tocsr()
+
+    def get_tf_matrix(self, counts, pos_id_mapping):
+
+        from sklearn.preprocessing import normalize
+
+        matrices = {'tf_matrix': counts}
+        if( self.tf_matrix_norm != '' ):
+            matrices['tf_matrix_normalized'] = normalize(counts, norm=self.tf_matrix_norm, axis=1)
+
+        if( self.tf_idf_norm != '' ):
+            tf_idf = counts.multiply( self.idf ).tocsr()
+            matrices['tf_idf_matrix'] = normalize(tf_idf, norm=self.tf_idf_norm, axis=1)
+
+        tf_matrix = TFMatrix( matrices, self.vocab, token_pattern=self.token_pattern )
+        tf_matrix.set_docs( *get_columnar_doc_meta(pos_id_mapping, counts.shape[0]) )
+
+        return tf_matrix
+
+    def fit(self, doc_lst):
+        self.fit_transform(doc_lst)
+        return self
+
+    def fit_transform(self, doc_lst):
+
+        from sklearn.feature_extraction.text import TfidfTransformer
+
+        docs, pos_id_mapping = BLOCVectorizerModel.get_docs(doc_lst)
+        self.fold_table = {}
+        counts = self.count(docs, fit=True)
+        self.idf = TfidfTransformer().fit(counts).idf_
+
+        return self.get_tf_matrix(counts, pos_id_mapping)
+
+    def transform(self, doc_lst):
+
+        if( self.is_fitted() is False ):
+            raise ValueError('BLOCVectorizerModel is not fitted')
+
+        docs, pos_id_mapping = BLOCVectorizerModel.get_docs(doc_lst)
+        return self.get_tf_matrix( self.count(docs), pos_id_mapping )
+
+    def to_dict(self):
+        return {
+            'model_type': 'BLOCVectorizerModel',
+            'version': BLOCVectorizerModel.version,
+            'ngram': self.ngram,
+            'token_pattern': self.token_pattern,
+            'bloc_variant': self.bloc_variant,
+            'tf_matrix_norm': self.tf_matrix_norm,
+            'tf_idf_norm': self.tf_idf_norm,
+            'min_df': self.min_df,
+            'lowercase': self.lowercase,
+            'vocab': self.vocab,
+            'idf': [ float(i) for i in self.idf ],
+            'fold_table': self.fold_table
+        }
+
+    def save(self, filename):
+        gzipTextFile( filename, json.dumps(self.to_dict(), ensure_ascii=False) )
+
+    @staticmethod
+    def load(filename):
+
+        payload = getDictFromJsonGZ(filename)
+        if( payload.get('model_type', '') != 'BLOCVectorizerModel' or payload.get('version', 0) > BLOCVectorizerModel.version ):
+            logger.warning( f'\tBLOCVectorizerModel.load(): unsupported model file: {filename}' )
+            return None
+
+        model = BLOCVectorizerModel( **{ ky: payload[ky] for ky in ['ngram', 'token_pattern', 'bloc_variant', 'tf_matrix_norm', 'tf_idf_norm', 'min_df', 'lowercase'] } )
+        model.vocab = payload['vocab']
+        model.vocab_index = { v: i for i, v in enumerate(model.vocab) }
+        model.idf = np.array( payload['idf'] )
+        model.fold_table = payload['fold_table']
+        if( model.bloc_variant is not None ):
+            #other callers of fold_word() (e.g., get_bloc_variant_tf_matrix()) with the model's bloc_variant reuse its fold table
+            add_fold_table(model.fold_table, model.bloc_variant)
+
+        return model
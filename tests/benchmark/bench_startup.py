@@ -0,0 +1,76 @@
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+'''
+    Startup benchmark: reports the import time of each bloc module (and the heavy third-party modules it pulls in)
+    in a fresh interpreter, plus the wall time of bin/bloc --version.
+    Usage (from repo root): python tests/benchmark/bench_startup.py [--runs 5] [--top 10]
+'''
+
+bloc_modules = ['bloc.util', 'bloc.v2_support', 'bloc.sentiment', 'bloc.generator', 'bloc.MarkovChain', 'bloc.analyzer', 'bloc.subcommands', 'bloc.tweet_generators', 'bloc.classifiers']
+repo_path = os.path.abspath( os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..') )
+
+def get_import_times(module):
+
+    '''
+        Returns {module_name: cumulative_import_microseconds} from python -X importtime
+    '''
+    env = dict(os.environ, PYTHONPATH=repo_path)
+    res = subprocess.run( [sys.executable, '-X', 'importtime', '-c', f'import {module}'], capture_output=True, text=True, env=env )
+
+    import_times = {}
+    for line in res.stderr.splitlines():
+        if( line.startswith('import time:') is False or line.find('cumulative') != -1 ):
+            continue
+
+        _, cumulative, name = line[len('import time:'):].split('|')
+        import_times[ name.strip() ] = int(cumulative)
+
+    return import_times
+
+def time_cmd(cmd, runs):
+
+    env = dict(os.environ, PYTHONPATH=repo_path)
+    durations = []
+    for i in range(runs):
+        start = time.perf_counter()
+        subprocess.run( cmd, capture_output=True, env=env )
+        durations.append( time.perf_counter() - start )
+
+    return min(durations)
+
+def main():
+
+    parser = argparse.ArgumentParser(description='Report import time per bloc module')
+    parser.add_argument('--runs', type=int, default=5, help='Number of fresh interpreters per module, the fastest run is reported.')
+    parser.add_argument('--top', type=int, default=5, help='Number of slowest modules imported by each bloc module to report.')
+    args = parser.parse_args()
+
+    #modules imported by the interpreter at startup are not attributable to bloc
+    startup_modules = set( get_import_times('sys').keys() )
+
+    print( f'{"module":<24} {"import (ms)":>12}' )
+    for mod in bloc_modules:
+
+        best = {}
+        for i in range(args.runs):
+            for name, cumulative in get_import_times(mod).items():
+                best[name] = min( best.get(name, cumulative), cumulative )
+
+        if( mod not in best ):
+            print( f'{mod:<24} {"failed":>12}' )
+            continue
+
+        print( f'{mod:<24} {best[mod]/1000:>12.1f}' )
+        deps = sorted( [ (cumulative, name) for name, cumulative in best.items() if name.find('.') == -1 and name != 'bloc' and name not in startup_modules ], reverse=True )
+        for cumulative, name in deps[:args.top]:
+            print( f'    {name:<20} {cumulative/1000:>12.1f}' )
+
+    bloc_cli = os.path.join(repo_path, 'bin', 'bloc')
+    print( f'\nbin/bloc --version (s): {time_cmd([sys.executable, bloc_cli, "--version"], args.runs):.3f}' )
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+import numpy as np
+import os
+import tempfile
+import scipy.sparse as sp
+import unittest
+
+from bloc.ann_index import BLOCSimIndex
+from bloc.util import get_bloc_variant_tf_matrix
+
+class TestANNIndex(unittest.TestCase):
+
+    doc_lst = [
+        {'id': 0, 'screen_name': 'bot_0', 'text': 'T⚁T⚁T⚁T | T⚁T⚁T | T⚁T⚁T⚁T⚁T'},
+        {'id': 1, 'screen_name': 'bot_1', 'text': 'T⚁T⚁T | T⚁T⚁T⚁T | T⚁T⚁T'},
+        {'id': 2, 'screen_name': 'human_0', 'text': 'p⚀rr□π | ⚂p⚀r | Tp⚀r□r'},
+        {'id': 3, 'screen_name': 'human_1', 'text': 'p⚀r□π | ⚂pp⚀r | Tp⚀rr'},
+        {'id': 4, 'screen_name': 'other', 'text': 'ππ⚃ππ | ⚃π'}
+    ]
+
+    def test_incremental_index(self):
+
+        tf_mat = get_bloc_variant_tf_matrix(TestANNIndex.doc_lst[:3], 2, token_pattern='[^ |()*]', compact_tf_matrix=True)
+        index = BLOCSimIndex(n_bits=64, bands=32)
+        index.add_tf_matrix(tf_mat)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            index_file = os.path.join(tmp_dir, 'bloc_index.npz')
+            index.save(index_file)
+            index = BLOCSimIndex.load(index_file)
+            self.assertFalse( index.modified )
+
+            #files without band keys (e.g., packed signatures) are not loaded
+            unsupported_file = os.path.join(tmp_dir, 'signatures_index.npz')
+            np.savez( unsupported_file, params=np.array('{"n_bits": 64, "bands": 32, "seed": 0, "ids": [], "terms": []}'), signatures=np.zeros((0, 8), dtype=np.uint8) )
+            self.assertIsNone( BLOCSimIndex.load(unsupported_file) )
+
+        #accounts from a later run (different vocab) are added to the same index
+        tf_mat = get_bloc_variant_tf_matrix(TestANNIndex.doc_lst[3:], 2, token_pattern='[^ |()*]', compact_tf_matrix=True)
+        index.add_tf_matrix(tf_mat)
+        self.assertEqual( len(index), 5 )
+
+        self.assertEqual( index.query_id('bot_0', k=1)[0][0], 'bot_1' )
+        self.assertEqual( index.query_id('human_1', k=1)[0][0], 'human_0' )
+        self.assertAlmostEqual( index.query_id('bot_0', k=1)[0][1], index.query_id('bot_1', k=1)[0][1] )
+
+        #re-adding an account replaces its vector
+        index.add_tf_matrix(tf_mat)
+        self.assertEqual( len(index), 5 )
+        self.assertNotIn( 'bot_0', [ n for n, sim in index.query_id('human_1', k=4) if sim > 0.5 ] )
+
+    def test_candidate_pruning(self):
+
+        #accounts that share one of 30 behaviours (term distributions) on top of common terms
+        rng = np.random.default_rng(0)
+        vocab = [ f'term_{i}' for i in range(300) ]
+        common = 1/np.arange(1, len(vocab) + 1)
+        common /= common.sum()
+        behaviours = rng.dirichlet( np.full(len(vocab), 0.05), size=30 )
+        counts = np.array( [ rng.multinomial(200, 0.5*common + 0.5*behaviours[i % 30]) for i in range(600) ], dtype=np.float64 )
+        counts *= np.log( len(counts)/(1 + np.count_nonzero(counts, axis=0)) ) + 1
+
+        index = BLOCSimIndex()
+        index.add( list(range(len(counts))), vocab, sp.csr_matrix(counts) )
+
+        vects = counts/np.linalg.norm(counts, axis=1)[:, None]
+        sims = vects.dot(vects.T)
+        np.fill_diagonal(sims, -1)
+
+        candidate_counts = []
+        recall = []
+        for i in range(0, len(counts), 5):
+            candidate_counts.append( len(index.get_candidates(index.band_keys[i])) )
+            expected = set( np.argsort(-sims[i])[:5].tolist() )
+            recall.append( len(expected & set( n for n, sim in index.query_id(i, k=5) ))/5 )
+
+        self.assertLess( np.mean(candidate_counts), 0.2 * len(counts) )
+        self.assertGreater( np.mean(recall), 0.9 )
+
+if __name__ == '__main__':
+    unittest.main()
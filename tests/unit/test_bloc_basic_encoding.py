@@ -1,8 +1,15 @@
 import unittest
 
 from bloc.generator import add_bloc_sequences
+from bloc.generator import gen_bloc_sequences
+from bloc.generator import get_delta_glyph
+from bloc.generator import get_delta_glyphs
+from bloc.sentiment import SentimentBackend
+from bloc.sentiment import TextBlobSentiment
+from bloc.util import datetimeFromUtcToLocal
 from bloc.util import get_default_symbols
 from bloc.util import getDictFromJsonGZ
+from bloc.util import is_timezone_good
 
 class TestBLOC(unittest.TestCase):
     
@@ -29,7 +36,115 @@ class TestBLOC(unittest.TestCase):
                 ref_bloc = u['bloc'][alph]
                 print(ref_bloc)
                 self.assertEqual( cur_bloc, ref_bloc, f'cur_bloc ≠ ref_bloc' )
-            
+
+    def test_vectorized_delta_glyphs(self):
+
+        time_symbols = get_default_symbols()['bloc_alphabets']['time']
+        delta_seconds = [-5, 0, 59, 60, 299, 300, 3599, 3600, 86399, 86400, 604799, 604800, 2627999, 2628000, 31539999, 31540000, 99999999]
+
+        for blank_mark, minute_mark in [(60, 5), (600, 5), (1, 1)]:
+            ref_glyphs = [ get_delta_glyph(time_symbols, d, blank_mark=blank_mark, minute_mark=minute_mark) for d in delta_seconds ]
+            cur_glyphs = get_delta_glyphs(time_symbols, delta_seconds, blank_mark=blank_mark, minute_mark=minute_mark).tolist()
+            self.assertEqual( cur_glyphs, ref_glyphs )
+
+    def test_timezone(self):
+
+        from datetime import datetime
+
+        winter = datetime(2022, 1, 15, 12, 0, 0)
+        summer = datetime(2022, 7, 15, 12, 0, 0)
+
+        self.assertEqual( datetimeFromUtcToLocal(winter, 'utc'), winter )
+        self.assertEqual( datetimeFromUtcToLocal(winter, 'America/New_York'), datetime(2022, 1, 15, 7, 0, 0) )
+        self.assertEqual( datetimeFromUtcToLocal(summer, 'America/New_York'), datetime(2022, 7, 15, 8, 0, 0) )
+        self.assertEqual( datetimeFromUtcToLocal(winter) - winter, datetimeFromUtcToLocal(summer) - summer )
+
+        tweets = getDictFromJsonGZ('./sample-tweets/sample_raw_tweets_1.json.gz')
+        add_bloc_sequences( tweets, all_bloc_symbols=get_default_symbols(), timezone='utc' )
+        for t in tweets:
+            self.assertEqual( t['bloc']['local_time'], datetime.strptime(t['created_at'], '%a %b %d %H:%M:%S %z %Y').strftime('%Y-%m-%d %H:%M:%S') )
+
+        #misspelled IANA names are rejected before any tweet is encoded
+        for tz_name in ['', 'utc', 'UTC', 'local', 'America/New_York']:
+            self.assertTrue( is_timezone_good(tz_name) )
+        for tz_name in ['America/NewYork', '../etc/passwd']:
+            self.assertFalse( is_timezone_good(tz_name) )
+
+        tweets = getDictFromJsonGZ('./sample-tweets/sample_raw_tweets_1.json.gz')
+        self.assertEqual( add_bloc_sequences(tweets, all_bloc_symbols=get_default_symbols(), timezone='America/NewYork'), {} )
+
+    def test_batched_sentiment(self):
+
+        import os
+        import tempfile
+        from textblob import TextBlob
+
+        texts = ['I love this', 'I hate this', 'I love this', 'a table']
+        with tempfile.TemporaryDirectory() as tmp_dir:
+
+            cache_file = os.path.join(tmp_dir, 'sent.jsonl')
+            backend = TextBlobSentiment(cache_file=cache_file)
+            self.assertEqual( backend.polarity(texts), [TextBlob(t).sentiment.polarity for t in texts] )
+            self.assertEqual( len(backend.cache), 3 )
+
+            #new backend is warmed by the cache file
+            self.assertEqual( len(TextBlobSentiment(cache_file=cache_file).cache), 3 )
+
+        self.assertEqual( len(TextBlobSentiment(max_cache_size=2).polarity(texts)), 4 )
+
+        #the process pool is started once and reused across polarity() calls (e.g., timelines) until close()
+        with TextBlobSentiment(max_cache_size=0, workers=2, min_pool_texts=1) as backend:
+            self.assertEqual( backend.polarity(texts), [TextBlob(t).sentiment.polarity for t in texts] )
+            pool = backend.pool
+            backend.polarity(texts[:2])
+            self.assertIs( backend.pool, pool )
+        self.assertIsNone( backend.pool )
+
+        #backends without polarity() fail when created, not while encoding a timeline
+        class IncompleteSentiment(SentimentBackend):
+            pass
+        self.assertRaises( TypeError, IncompleteSentiment )
+
+    def test_incremental_encoding(self):
+
+        import copy
+        import json
+
+        all_bloc_symbols = get_default_symbols()
+        bloc_alphabets = ['action', 'content_syntactic', 'change', 'content_semantic_entity', 'action_content_syntactic']
+        tweets = getDictFromJsonGZ('./sample-tweets/sample_raw_tweets_1.json.gz')
+        tweets = sorted( tweets, key=lambda t: int(t['id']) )
+
+        for segmentation_type in ['week_number', 'segment_on_pauses']:
+
+            full = add_bloc_sequences( copy.deepcopy(tweets), all_bloc_symbols=all_bloc_symbols, bloc_alphabets=bloc_alphabets, segmentation_type=segmentation_type, segment_on_pauses=3600 )
+
+            #overlapping batches of new tweets, with the state saved as JSON between batches
+            bloc_state = None
+            for i in range(0, len(tweets), 40):
+                cur = add_bloc_sequences( copy.deepcopy(tweets[i:i+50]), all_bloc_symbols=all_bloc_symbols, bloc_alphabets=bloc_alphabets, segmentation_type=segmentation_type, segment_on_pauses=3600, keep_bloc_state=True, bloc_state=bloc_state )
+                bloc_state = json.loads( json.dumps(cur['bloc_state']) )
+
+            self.assertEqual( cur['bloc'], full['bloc'] )
+            self.assertEqual( cur['more_details'], full['more_details'] )
+            self.assertEqual( cur['bloc_segments']['segment_count'], full['bloc_segments']['segment_count'] )
+
+    def test_streaming_encoding(self):
+
+        import copy
+
+        all_bloc_symbols = get_default_symbols()
+        bloc_alphabets = ['action', 'content_syntactic', 'change']
+        tweets = getDictFromJsonGZ('./sample-tweets/sample_raw_tweets_1.json.gz')
+        tweets = sorted( tweets, key=lambda t: int(t['id']) )
+
+        full = add_bloc_sequences( copy.deepcopy(tweets), all_bloc_symbols=all_bloc_symbols, bloc_alphabets=bloc_alphabets, keep_tweets=True, keep_bloc_segments=True )
+        events = list( gen_bloc_sequences( (copy.deepcopy(t) for t in tweets), chunk_size=32, all_bloc_symbols=all_bloc_symbols, bloc_alphabets=bloc_alphabets ) )
+
+        self.assertEqual( [e['bloc_sequences'] for e in events if e['type'] == 'tweet'], [t['bloc']['bloc_sequences_short'] for t in full['tweets']] )
+        self.assertEqual( {e['segment_id']: e['bloc'] for e in events if e['type'] == 'segment'}, full['bloc_segments']['segments'] )
+        self.assertEqual( events[-1]['type'], 'end' )
+        self.assertEqual( events[-1]['more_details'], full['more_details'] )
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
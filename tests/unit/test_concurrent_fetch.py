@@ -0,0 +1,154 @@
+import copy
+import json
+import os
+import requests
+import tempfile
+import threading
+import time
+import unittest
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from bloc.generator import gen_bloc_for_users
+from bloc.generator import get_timeline_tweets
+from bloc.rate_limiter import TokenBucket
+from bloc.relationship_cache import RelationshipCache
+from bloc.util import getDictFromJsonGZ
+
+class MockTimelineHandler(BaseHTTPRequestHandler):
+
+    tweets = getDictFromJsonGZ('./sample-tweets/sample_raw_tweets_1.json.gz')[:20]
+    requests = []
+
+    def do_GET(self):
+
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+        screen_name = params.get('screen_name', params.get('source_screen_name', ['']))[0]
+        MockTimelineHandler.requests.append( (url.path, screen_name, time.monotonic()) )
+
+        if( url.path.endswith('/friendships/show.json') ):
+            #source follows targets whose screen_name starts with "friend"
+            following = params['target_screen_name'][0].startswith('friend')
+            body = json.dumps({'relationship': {'source': {'following': following, 'followed_by': False}}}).encode()
+        else:
+            tweets = copy.deepcopy(MockTimelineHandler.tweets)
+            for i, t in enumerate(tweets):
+                #v1.1 tweet ids are ints
+                t['id'] = int(t['id'])
+                t['user']['screen_name'] = screen_name
+                if( i % 2 == 0 ):
+                    t['in_reply_to_status_id'] = t['id'] - 1
+                    t['in_reply_to_screen_name'] = ['friend_0', 'other_0', 'friend_1'][i % 3]
+
+            body = json.dumps(tweets).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('x-rate-limit-remaining', '100')
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class TestConcurrentFetch(unittest.TestCase):
+
+    def test_token_bucket(self):
+
+        bucket = TokenBucket(window_requests=20, window_seconds=1, burst=1)
+        start = time.monotonic()
+        for i in range(5):
+            bucket.acquire()
+
+        #first request is immediate, the next 4 are spaced by 1/20 seconds
+        self.assertGreaterEqual( time.monotonic() - start, 0.19 )
+
+    def test_concurrent_matches_serial(self):
+
+        server = ThreadingHTTPServer( ('127.0.0.1', 0), MockTimelineHandler )
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        screen_names = ['user_a', 'user_b', 'user_c', 'user_d']
+        params = {
+            'bloc_alphabets': ['action', 'content_syntactic'],
+            'twitter_v1_api_base': f'http://127.0.0.1:{server.server_address[1]}/1.1',
+            'no_sleep': True,
+            'subcommand': 'change'
+        }
+
+        try:
+            serial = gen_bloc_for_users(screen_names, '', 'ck', 'cs', 'at', 'ats', **params)
+            MockTimelineHandler.requests = []
+            concurrent = gen_bloc_for_users(screen_names, '', 'ck', 'cs', 'at', 'ats', fetch_workers=4, rate_limit_window_requests=20, rate_limit_window_seconds=1, **params)
+        finally:
+            server.shutdown()
+
+        self.assertEqual( [u['screen_name'] for u in concurrent['all_users_bloc']], screen_names )
+        self.assertEqual( [u['bloc'] for u in serial['all_users_bloc']], [u['bloc'] for u in concurrent['all_users_bloc']] )
+
+        #shared limiter: requests across workers are at least 1/20 seconds apart
+        req_times = sorted( r[2] for r in MockTimelineHandler.requests if r[0].endswith('/user_timeline.json') )
+        self.assertEqual( len(req_times), len(screen_names) )
+        self.assertGreaterEqual( req_times[-1] - req_times[0], 0.14 )
+
+    def test_cached_friendship_lookup(self):
+
+        server = ThreadingHTTPServer( ('127.0.0.1', 0), MockTimelineHandler )
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        api_base = f'http://127.0.0.1:{server.server_address[1]}/1.1'
+        session = requests.Session()
+        relationship_cache = RelationshipCache(ttl=3600)
+        friendship_rate_limiter = TokenBucket(window_requests=100, window_seconds=1)
+
+        try:
+            MockTimelineHandler.requests = []
+            tweets = get_timeline_tweets(session, 'user_a', following_lookup=True, no_sleep=True, api_base=api_base, relationship_cache=relationship_cache, friendship_rate_limiter=friendship_rate_limiter)
+            lookups = [ r for r in MockTimelineHandler.requests if r[0].endswith('/friendships/show.json') ]
+
+            MockTimelineHandler.requests = []
+            get_timeline_tweets(session, 'user_a', following_lookup=True, no_sleep=True, api_base=api_base, relationship_cache=relationship_cache, friendship_rate_limiter=friendship_rate_limiter)
+            repeat_lookups = [ r for r in MockTimelineHandler.requests if r[0].endswith('/friendships/show.json') ]
+        finally:
+            server.shutdown()
+
+        #3 distinct targets across 10 replies, second request is served from the cache
+        self.assertEqual( len(lookups), 3 )
+        self.assertEqual( len(repeat_lookups), 0 )
+
+        for t in tweets:
+            if( t.get('in_reply_to_screen_name', None) is None ):
+                self.assertIsNone( t['bloc']['src_follows_tgt'] )
+            else:
+                self.assertEqual( t['bloc']['src_follows_tgt'], t['in_reply_to_screen_name'].startswith('friend') )
+
+    def test_relationship_cache_file(self):
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            cache_file = os.path.join(tmp_dir, 'friendships.jsonl')
+            now = time.time()
+
+            relationship_cache = RelationshipCache(ttl=3600, cache_file=cache_file, compact_dead_rows=3)
+            relationship_cache.set('user_a', 'old', True, False, ts=now - 7200)
+            relationship_cache.set('user_a', 'friend_0', False, False, ts=now - 60)
+            relationship_cache.set('user_a', 'friend_0', True, True)
+
+            #expired rows are skipped at load time, superseded rows are replaced by later rows
+            relationship_cache = RelationshipCache(ttl=3600, cache_file=cache_file, compact_dead_rows=3)
+            self.assertEqual( len(relationship_cache.cache), 1 )
+            self.assertEqual( relationship_cache.dead_rows, 2 )
+            self.assertEqual( relationship_cache.get('USER_A', 'friend_0'), {'src_follows_tgt': True, 'tgt_follows_src': True} )
+
+            #more than compact_dead_rows dead rows: the file is rewritten with only the live entries
+            relationship_cache.set('user_a', 'friend_0', True, False)
+            relationship_cache.set('user_a', 'friend_0', False, True)
+            self.assertEqual( relationship_cache.dead_rows, 0 )
+            with open(cache_file) as infile:
+                rows = [ json.loads(r) for r in infile ]
+
+            self.assertEqual( [ (r['src'], r['tgt'], r['src_follows_tgt'], r['tgt_follows_src']) for r in rows ], [('user_a', 'friend_0', False, True)] )
+            self.assertFalse( os.path.exists(cache_file + '.tmp') )
+
+if __name__ == '__main__':
+    unittest.main()
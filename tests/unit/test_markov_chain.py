@@ -0,0 +1,159 @@
+import numpy as np
+import os
+import tempfile
+import unittest
+
+from bloc.higher_order_markov import BLOCHigherOrderMarkovChain
+from bloc.MarkovChain import BLOCMarkovChain
+from bloc.markov_bundle import BLOCMarkovModelBundle
+from bloc.markov_scorer import BLOCMarkovBatchScorer
+from bloc.util import getDictFromJsonGZ
+
+class TestBLOCMarkovChain(unittest.TestCase):
+
+    sequence_lst = [
+        'r⚂r⚁r⚁r',
+        '⚂r',
+        'p⚂r',
+        '⚀r',
+        '⚁r',
+        '⚂r⚂r⚁r⚁r⚀r⚁r',
+        '⚂r⚁r⚁r⚁r⚁r⚁r⚁p⚁r⚁r',
+        '⚂r⚁r⚁p⚀r⚁r⚁r⚁r⚁r⚁p⚂p',
+        '⚂r⚂r⚁ρρTρρ⚁r⚁r⚀p⚁p⚁r⚁rr',
+        '⚂r⚂r⚁r⚁r⚂p',
+    ]
+
+    unknown_seq = 'ρρTρρ⚁r⚁r⚀p⚁p⚁r⚁rr'
+    model_file = './sample_markov_chain_model/ubs_mk_model.json.gz'
+
+    def test_compiled_scorer(self):
+
+        mc = BLOCMarkovChain( model=getDictFromJsonGZ(TestBLOCMarkovChain.model_file) )
+        scorer = mc.compile()
+
+        self.assertAlmostEqual( BLOCMarkovChain.s_prob_of_sequence(mc.training_model, TestBLOCMarkovChain.unknown_seq), -24.1470168887, places=8 )
+        self.assertAlmostEqual( BLOCMarkovChain.s_prob_of_sequence(scorer, TestBLOCMarkovChain.unknown_seq), -24.1470168887, places=8 )
+
+        #unseen states are smoothed without updating the model
+        self.assertAlmostEqual( scorer.prob_of_sequence(TestBLOCMarkovChain.unknown_seq + 'X'), -28.8323767245, places=8 )
+        self.assertAlmostEqual( scorer.prob_of_sequence(list(TestBLOCMarkovChain.unknown_seq + 'X')), -28.8323767245, places=8 )
+        self.assertAlmostEqual( scorer.prob_of_sequence('XYrX'), BLOCMarkovChain.s_prob_of_sequence(mc.training_model, 'YXrY'), places=10 )
+        self.assertEqual( len(scorer), 7 )
+
+        #prob_of_sequence() updates the model with unseen states
+        self.assertAlmostEqual( mc.prob_of_sequence(TestBLOCMarkovChain.unknown_seq), -24.1470168887, places=8 )
+        self.assertAlmostEqual( mc.prob_of_sequence(TestBLOCMarkovChain.unknown_seq + 'X'), -30.4347273806, places=8 )
+        self.assertAlmostEqual( mc.prob_of_sequence(TestBLOCMarkovChain.unknown_seq), -26.5845797789, places=8 )
+        self.assertEqual( len(mc.compile()), 8 )
+
+    def test_count_transitions(self):
+
+        expected = getDictFromJsonGZ(TestBLOCMarkovChain.model_file)
+        mc = BLOCMarkovChain( training_sequence_lst=TestBLOCMarkovChain.sequence_lst )
+        self.assertEqual( mc.training_model['vocab'], expected['vocab'] )
+        self.assertEqual( mc.training_model['start_dist'], expected['start_dist'] )
+        self.assertTrue( np.array_equal(mc.training_model['markov_freq_matrix'], expected['markov_freq_matrix']) )
+
+        seqs = ['T⚁T⚁(pp) | rr', '', 'Tp⚁r*r', '⚂']
+        expected = BLOCMarkovChain.get_markov_freq_matrix( BLOCMarkovChain.get_ngram_freq(seqs) )
+        training_model = BLOCMarkovChain.count_transitions(seqs)
+        self.assertEqual( training_model['vocab'], expected['vocab'] )
+        self.assertEqual( training_model['start_dist'], expected['start_dist'] )
+        self.assertTrue( np.array_equal(training_model['markov_freq_matrix'], expected['markov_freq_matrix']) )
+
+        #incremental training (even after the model was smoothed for unseen states) gives the same model
+        mc = BLOCMarkovChain( training_sequence_lst=TestBLOCMarkovChain.sequence_lst[:4] )
+        mc.prob_of_sequence('XrY')
+        mc.partial_fit( TestBLOCMarkovChain.sequence_lst[4:] )
+        self.assertEqual( mc.training_model['vocab'], mc.compile().states )
+        self.assertAlmostEqual( mc.prob_of_sequence(TestBLOCMarkovChain.unknown_seq), -24.1470168887, places=8 )
+
+    def test_batch_scorer(self):
+
+        models = [
+            BLOCMarkovChain( training_sequence_lst=TestBLOCMarkovChain.sequence_lst ),
+            BLOCMarkovChain( training_sequence_lst=['T⚁T⚁T⚁T', 'T⚁T⚂T'] ),
+            BLOCMarkovChain( training_sequence_lst=['pπ⚀rr', 'π⚃π'] )
+        ]
+        seqs = [TestBLOCMarkovChain.unknown_seq, TestBLOCMarkovChain.unknown_seq + 'X', 'T⚁T⚁T', 'ππ⚃Tr', 'X', '']
+
+        scores = BLOCMarkovBatchScorer(models, block_size=2).score(seqs)
+        self.assertEqual( scores.shape, (3, 6) )
+        self.assertAlmostEqual( scores[0, 0], -24.1470168887, places=8 )
+        self.assertAlmostEqual( scores[0, 1], -28.8323767245, places=8 )
+        self.assertTrue( np.all(np.isnan(scores[:, -1])) )
+
+        for k, mc in enumerate(models):
+            for q, seq in enumerate(seqs[:-1]):
+                self.assertAlmostEqual( scores[k, q], BLOCMarkovChain.s_prob_of_sequence(mc.training_model, seq), places=10 )
+
+    def test_model_bundle(self):
+
+        models = {
+            'user_0': BLOCMarkovChain( training_sequence_lst=TestBLOCMarkovChain.sequence_lst ),
+            'user_1': BLOCMarkovChain( training_sequence_lst=[' T⚁T⚁T⚁T', 'T⚁T⚂T'] ),
+            'user_2': BLOCMarkovChain( training_sequence_lst=['|'] )
+        }
+        #smoothed models are saved un-smoothed
+        models['user_0'].prob_of_sequence('XY')
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            bundle_file = os.path.join(tmp_dir, 'markov_models.npz')
+            BLOCMarkovChain.save_models(bundle_file, models)
+            bundle = BLOCMarkovModelBundle.load(bundle_file)
+
+            self.assertEqual( len(bundle), 3 )
+            self.assertIsInstance( bundle.arrays['freq_counts'], np.memmap )
+            self.assertAlmostEqual( bundle.get_model(bundle.get_index('user_0')).prob_of_sequence(TestBLOCMarkovChain.unknown_seq), -24.1470168887, places=8 )
+
+            training_model = bundle.get_training_model( bundle.get_index('user_1') )
+            self.assertEqual( training_model['start_dist'], {' ': 1, 'T': 1, '⚁': 0, '⚂': 0} )
+            self.assertEqual( training_model['markov_freq_matrix'].tolist(), [[0, 4, 1], [4, 0, 0], [1, 0, 0]] )
+
+            scores = bundle.get_batch_scorer().score(['T⚁T', TestBLOCMarkovChain.unknown_seq])
+            self.assertAlmostEqual( scores[0, 1], -24.1470168887, places=8 )
+            self.assertTrue( np.all(np.isnan(scores[2])) )
+
+            #single model, binary and gzip JSON
+            for model_file in ['markov_model.npz', 'markov_model.json.gz']:
+                models['user_1'].model_label = 'user_1'
+                models['user_1'].save( os.path.join(tmp_dir, model_file) )
+                mc = BLOCMarkovChain.load( os.path.join(tmp_dir, model_file) )
+                self.assertEqual( mc.model_label, 'user_1' )
+                self.assertEqual( mc.training_model['vocab'], ['T', '⚁', '⚂'] )
+                self.assertAlmostEqual( mc.prob_of_sequence('T⚁T'), BLOCMarkovChain.s_prob_of_sequence(models['user_1'].training_model, 'T⚁T'), places=10 )
+
+            del bundle
+
+    def test_higher_order_chain(self):
+
+        #first order is the same as BLOCMarkovChain
+        mc = BLOCHigherOrderMarkovChain( TestBLOCMarkovChain.sequence_lst, order=1 )
+        self.assertAlmostEqual( mc.prob_of_sequence(TestBLOCMarkovChain.unknown_seq), -24.1470168887, places=8 )
+        self.assertAlmostEqual( mc.prob_of_sequence(TestBLOCMarkovChain.unknown_seq + 'X'), -28.8323767245, places=8 )
+
+        seqs = ['T⚁T⚁T⚁T⚁T', 'T⚁T⚁T⚂T⚁T⚁T', 'p⚁T⚁T⚁T']
+        test_seqs = ['T⚁T⚁T⚁', 'T⚁⚁TT⚁', 'T⚁T⚁X', '']
+        for variable_order in [False, True]:
+
+            mc = BLOCHigherOrderMarkovChain( seqs, order=3, variable_order=variable_order )
+            self.assertEqual( [ len(t['ctx_keys']) - 1 for t in mc.tables ], [4, 5, 6] )
+
+            probs = mc.prob_of_sequences(test_seqs)
+            self.assertTrue( np.isnan(probs[-1]) )
+            self.assertIsNone( mc.prob_of_sequence('') )
+            self.assertAlmostEqual( probs[0], mc.prob_of_sequence(test_seqs[0]), places=10 )
+            #the loop pattern is more likely than the same symbols out of order
+            self.assertGreater( probs[0], probs[1] )
+
+            #probabilities of all sequences of a given length sum to 1
+            all_seqs = [ a + b + c for a in mc.states for b in mc.states for c in mc.states ]
+            self.assertAlmostEqual( np.exp(mc.prob_of_sequences(all_seqs)).sum(), 1, places=10 )
+
+        #variable order captures the T⚁ loop better than first order
+        loop_seq = 'T⚁T⚁T⚁T⚁T⚁T⚁'
+        self.assertGreater( BLOCHigherOrderMarkovChain(seqs, order=3, variable_order=True).prob_of_sequence(loop_seq), BLOCHigherOrderMarkovChain(seqs, order=1, variable_order=True).prob_of_sequence(loop_seq) )
+
+if __name__ == '__main__':
+    unittest.main()
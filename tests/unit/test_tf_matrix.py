@@ -0,0 +1,221 @@
+import os
+import tempfile
+import unittest
+
+from copy import deepcopy
+from itertools import combinations
+
+from bloc.hashing_vectorizer import BLOCHashingVectorizer
+from bloc.subcommands import pairwise_usr_cmp
+from bloc.tf_matrix import TFMatrix
+from bloc.tokenizer import bloc_count_vectorize
+from bloc.util import _fold_tables
+from bloc.util import cosine_sim
+from bloc.util import fold_word
+from bloc.util import get_bloc_variant_tf_matrix
+from bloc.util import get_fold_table
+from bloc.util import load_fold_table
+from bloc.util import save_fold_table
+from bloc.vectorizer import BLOCVectorizerModel
+
+class TestTFMatrix(unittest.TestCase):
+
+    doc_lst = [
+        {'id': 'u0', 'text': 'TTTTT | ⚁pp | (TT)(Tπ) | pT⚂TT'},
+        {'id': 'u1', 'text': 'TTTT | pppp | ⚁TTT | (Tπ)'},
+        {'id': 'u2', 'text': 'ppppp | TTTTTT | pT'}
+    ]
+
+    def test_folded_words(self):
+
+        bloc_variant = {'type': 'folded_words', 'fold_start_count': 4, 'count_applies_to_all_char': False}
+        words = get_bloc_variant_tf_matrix(TestTFMatrix.doc_lst, 1, keep_tf_matrix=True, tf_idf_norm='')
+        folded = get_bloc_variant_tf_matrix(TestTFMatrix.doc_lst, 1, keep_tf_matrix=True, tf_idf_norm='', bloc_variant=dict(bloc_variant))
+
+        #every folded column is the sum of the columns of the words that fold to it
+        for i in range( len(TestTFMatrix.doc_lst) ):
+
+            expected = {}
+            row = words['tf_matrix'][i]['tf_vector'].toarray()[0]
+            for j, v in enumerate(words['vocab']):
+                if( row[j] != 0 ):
+                    v = fold_word(v, 4, count_applies_to_all_char=False)
+                    expected[v] = expected.get(v, 0) + int(row[j])
+
+            row = folded['tf_matrix'][i]['tf_vector'].toarray()[0]
+            self.assertEqual( folded['tf_matrix'][i]['id'], f'u{i}' )
+            self.assertEqual( { v: int(row[j]) for j, v in enumerate(folded['vocab']) if row[j] != 0 }, expected )
+
+        self.assertIn( 'TTT+', folded['vocab'] )
+        self.assertLess( len(folded['vocab']), len(words['vocab']) )
+
+    def test_compact_tf_matrix(self):
+
+        bloc_variant = {'type': 'folded_words', 'fold_start_count': 4, 'count_applies_to_all_char': False}
+        doc_lst = [ dict(d, screen_name=f"user_{d['id']}") for d in TestTFMatrix.doc_lst ]
+
+        for variant in [None, bloc_variant]:
+            tf_mat = get_bloc_variant_tf_matrix(doc_lst, 1, keep_tf_matrix=True, tf_matrix_norm='l1', bloc_variant=variant)
+            compact = get_bloc_variant_tf_matrix(doc_lst, 1, keep_tf_matrix=True, tf_matrix_norm='l1', bloc_variant=variant, compact_tf_matrix=True)
+
+            self.assertEqual( list(compact.vocab), list(tf_mat['vocab']) )
+            self.assertEqual( compact.get_matrix('tf_idf_matrix').shape, (3, len(tf_mat['vocab'])) )
+            self.assertEqual( compact.get_doc('u1'), {'id': 'u1', 'screen_name': 'user_u1'} )
+
+            #dict-based payload is still available
+            legacy = compact.to_dict()
+            for m in ['tf_matrix', 'tf_matrix_normalized', 'tf_idf_matrix']:
+                self.assertEqual( [d['screen_name'] for d in legacy[m]], [d['screen_name'] for d in tf_mat[m]] )
+                self.assertEqual( [d['tf_vector'].toarray().tolist() for d in legacy[m]], [d['tf_vector'].toarray().tolist() for d in tf_mat[m]] )
+                self.assertEqual( compact.get_row('u2', m).toarray().tolist(), tf_mat[m][2]['tf_vector'].toarray().tolist() )
+
+    def test_pairwise_sim(self):
+
+        doc_lst = [ dict(d, screen_name=f"user_{d['id']}") for d in TestTFMatrix.doc_lst ]
+        doc_lst.append( {'id': 'u3', 'text': 'TTTT | pT', 'screen_name': 'user_u3'} )
+        tf_mat = get_bloc_variant_tf_matrix(doc_lst, 2, token_pattern='[^ |()*]', compact_tf_matrix=True)
+        vectors = tf_mat.get_matrix('tf_idf_matrix')
+
+        report = pairwise_usr_cmp(tf_mat, print_summary=False, block_size=3)
+        self.assertEqual( [r['user_pair_indx'] for r in report], list(combinations(range(4), 2)) )
+        for r in report:
+            i, j = r['user_pair_indx']
+            self.assertAlmostEqual( r['sim'], cosine_sim(vectors[i], vectors[j]) )
+        
+        top = pairwise_usr_cmp(tf_mat, print_summary=False, top_k=2, block_size=2)
+        self.assertEqual( top, sorted(report, key=lambda r: r['sim'], reverse=True)[:2] )
+
+    def test_vectorizer_model(self):
+
+        import os
+        import tempfile
+
+        bloc_variant = {'type': 'folded_words', 'fold_start_count': 4, 'count_applies_to_all_char': False}
+        expected = get_bloc_variant_tf_matrix(TestTFMatrix.doc_lst, 1, keep_tf_matrix=True, bloc_variant=dict(bloc_variant), compact_tf_matrix=True)
+        model = BLOCVectorizerModel(ngram=1, bloc_variant=dict(bloc_variant))
+        tf_mat = model.fit_transform(TestTFMatrix.doc_lst)
+
+        self.assertEqual( list(tf_mat.vocab), list(expected.vocab) )
+        self.assertEqual( tf_mat.get_matrix('tf_idf_matrix').toarray().tolist(), expected.get_matrix('tf_idf_matrix').toarray().tolist() )
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            model_file = os.path.join(tmp_dir, 'vectorizer.json.gz')
+            model.save(model_file)
+            model = BLOCVectorizerModel.load(model_file)
+
+        #transform without refitting: same vectors, unseen words count as their folded words, unseen folded words are dropped
+        self.assertEqual( model.transform(TestTFMatrix.doc_lst).get_matrix('tf_idf_matrix').toarray().tolist(), expected.get_matrix('tf_idf_matrix').toarray().tolist() )
+        fold_table = dict(model.fold_table)
+        single = model.transform([{'id': 'new', 'text': 'TTTTTTTTT | ⚁pp | ⚃⚃'}])
+        #words unseen during fit are not memoized in the model's fold table
+        self.assertEqual( model.fold_table, fold_table )
+        self.assertEqual( single.ids, ['new'] )
+        self.assertEqual( { v: int(c) for v, c in zip(model.vocab, single.get_matrix('tf_matrix').toarray()[0]) if c != 0 }, {'TTT+': 1, 'pp': 1, '⚁': 1} )
+
+    def test_bloc_tokenizer(self):
+
+        from sklearn.feature_extraction.text import CountVectorizer
+
+        docs = [ d['text'] for d in TestTFMatrix.doc_lst ] + ['⚀Tp.π□r | ⚃ ⚄⚅(pp)']
+        for token_pattern in ['[^□⚀⚁⚂⚃⚄⚅. |()*]+|[□⚀⚁⚂⚃⚄⚅.]', '[^□⚀⚁⚂⚃⚄⚅ |*]+|[□⚀⚁⚂⚃⚄⚅]', '[^ |()*]', '([^ |()*])']:
+            for n in range(1, 4):
+
+                count_vectorizer = CountVectorizer(token_pattern=token_pattern, ngram_range=(n, n), lowercase=False)
+                expected = count_vectorizer.fit_transform(docs)
+                counts, vocab = bloc_count_vectorize(docs, n, token_pattern)
+
+                self.assertEqual( list(vocab), list(count_vectorizer.get_feature_names_out()) )
+                self.assertEqual( (counts != expected).nnz, 0 )
+
+        self.assertIsNone( bloc_count_vectorize(docs, 1, r'(?u)\b\w\w+\b') )
+
+    def test_fold_table(self):
+
+        bloc_variant = {'type': 'folded_words', 'fold_start_count': 4, 'count_applies_to_all_char': False}
+        self.assertEqual( fold_word('TTTTTp⚁p', 4), 'TTT+p⚁p' )
+        self.assertEqual( fold_word('(TT)(TT)(TT)(TT)(Tπ)', 4), '(TT)(TT)(TT)+(Tπ)' )
+        self.assertEqual( fold_word('pppp⚁T', 4, count_applies_to_all_char=True), 'p⚁T' )
+        self.assertEqual( fold_word('pppp', 4, count_applies_to_all_char=True), 'ppp+' )
+
+        fold_table = get_fold_table(['TTTTT', 'pp'], bloc_variant)
+        self.assertEqual( fold_table, {'TTTTT': 'TTT+', 'pp': 'pp'} )
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            fold_table_file = os.path.join(tmp_dir, 'fold_table.json.gz')
+            save_fold_table(fold_table_file, {'ppppp': 'precomputed'}, bloc_variant)
+            self.assertEqual( load_fold_table(fold_table_file), {'ppppp': 'precomputed'} )
+
+        #loaded fold tables take precedence for the same fold parameters only
+        self.assertEqual( fold_word('ppppp', 4), 'precomputed' )
+        self.assertEqual( fold_word('ppppp', 3), 'pp+' )
+        _fold_tables.clear()
+        self.assertEqual( fold_word('ppppp', 4), 'ppp+' )
+
+    def test_top_ngrams(self):
+
+        tf_mat = get_bloc_variant_tf_matrix(TestTFMatrix.doc_lst, 1, keep_tf_matrix=True, set_top_ngrams=True, top_ngrams_add_all_docs=True)
+        top_k = get_bloc_variant_tf_matrix(TestTFMatrix.doc_lst, 1, keep_tf_matrix=True, set_top_ngrams=True, top_ngrams_add_all_docs=True, top_ngrams_k=2)
+
+        for i in range( len(TestTFMatrix.doc_lst) ):
+            ngrams = tf_mat['top_ngrams']['per_doc'][i]['ngrams']
+            row = tf_mat['tf_matrix'][i]['tf_vector'].toarray()[0]
+
+            #all terms by descending frequency (ties in vocab order)
+            expected = sorted( [ (-int(row[j]), j) for j in range(len(row)) if row[j] != 0 ] )
+            self.assertEqual( [ (n['term'], n['term_freq']) for n in ngrams ], [ (tf_mat['vocab'][j], -tf) for tf, j in expected ] )
+            self.assertAlmostEqual( sum(n['term_rate'] for n in ngrams), 1 )
+            self.assertEqual( top_k['top_ngrams']['per_doc'][i]['ngrams'], ngrams[:2] )
+
+        all_docs = tf_mat['top_ngrams']['all_docs']
+        self.assertEqual( all_docs, top_k['top_ngrams']['all_docs'] )
+        self.assertEqual( len(all_docs), len(tf_mat['vocab']) )
+        self.assertEqual( [ n['doc_freq'] for n in all_docs ], sorted([ n['doc_freq'] for n in all_docs ], reverse=True) )
+        self.assertEqual( all_docs[0], {'term': 'Tπ', 'term_freq': 2, 'term_rate': 2/16, 'doc_freq': 2, 'doc_rate': 2/3} )
+
+    def test_tf_matrix_export(self):
+
+        tf_mat = get_bloc_variant_tf_matrix(TestTFMatrix.doc_lst, 2, token_pattern='[^ |()*]', keep_tf_matrix=True, set_top_ngrams=True, compact_tf_matrix=True)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            for filename in ['tf_matrix.npz', 'tf_matrix.json', 'tf_matrix.json.gz']:
+
+                filename = os.path.join(tmp_dir, filename)
+                tf_mat.save( filename, extra={'self': 'test'} )
+                loaded = TFMatrix.load(filename)
+
+                self.assertEqual( loaded.ids, tf_mat.ids )
+                self.assertEqual( list(loaded.vocab), list(tf_mat.vocab) )
+                self.assertEqual( loaded.top_ngrams, tf_mat.top_ngrams )
+                for v in ['tf_matrix', 'tf_idf_matrix']:
+                    self.assertEqual( (loaded.get_matrix(v) != tf_mat.get_matrix(v)).nnz, 0 )
+
+        #sparse JSON vectors
+        payload = tf_mat.to_json_dict()
+        row = tf_mat.get_matrix('tf_matrix')[1]
+        self.assertEqual( payload['tf_matrix'][1]['tf_vector'], {'indices': sorted(row.indices.tolist()), 'values': [ int(row[0, i]) for i in sorted(row.indices) ]} )
+
+        #get_tf_matrix() payload (sparse rows)
+        legacy = TFMatrix.from_dict( get_bloc_variant_tf_matrix(TestTFMatrix.doc_lst, 2, token_pattern='[^ |()*]', keep_tf_matrix=True) )
+        self.assertEqual( legacy.ids, tf_mat.ids )
+        self.assertEqual( (legacy.get_matrix() != tf_mat.get_matrix()).nnz, 0 )
+
+    def test_hashing_vectorizer(self):
+
+        bloc_variant = {'type': 'folded_words', 'fold_start_count': 4, 'count_applies_to_all_char': False}
+        expected = get_bloc_variant_tf_matrix(deepcopy(TestTFMatrix.doc_lst), 1, bloc_variant=dict(bloc_variant), keep_tf_matrix=True, compact_tf_matrix=True)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            BLOCHashingVectorizer(bloc_variant=bloc_variant).fit_shards( iter(deepcopy(TestTFMatrix.doc_lst)), tmp_dir, chunk_size=2 )
+            vectorizer = BLOCHashingVectorizer.load(tmp_dir)
+            shards = list( vectorizer.iter_shards() )
+
+        self.assertEqual( [ len(s) for s in shards ], [2, 1] )
+        for shard in shards:
+            for i, doc_id in enumerate(shard.ids):
+                for v in ['tf_matrix', 'tf_idf_matrix']:
+                    row = shard.get_matrix(v)[i]
+                    exp_row = expected.get_row(doc_id, v)
+                    self.assertEqual( sorted(vectorizer.vocab[row.indices]), sorted(expected.vocab[exp_row.indices]) )
+                    self.assertAlmostEqual( row.sum(), exp_row.sum() )
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,28 @@
+import unittest
+
+from bloc.tweet_generators import user_tweets_generator_0
+from bloc.tweet_generators import user_tweets_generator_0_parallel
+
+class TestTweetGenerators(unittest.TestCase):
+
+    timeline_file = './sample-tweets/sample_timeline.jsonl.gz'
+
+    def test_parallel_matches_serial(self):
+
+        serial_pos_id_mapping = {}
+        parallel_pos_id_mapping = {}
+
+        serial_docs = list( user_tweets_generator_0([TestTweetGenerators.timeline_file]*2, serial_pos_id_mapping, {}, rm_doc_text=False) )
+        parallel_docs = list( user_tweets_generator_0_parallel([TestTweetGenerators.timeline_file]*2, parallel_pos_id_mapping, {}, workers=2, chunksize=1, rm_doc_text=False) )
+
+        self.assertEqual( len(serial_docs), 4 )
+        self.assertEqual( serial_docs, parallel_docs )
+
+        for pos_id_mapping in [serial_pos_id_mapping, parallel_pos_id_mapping]:
+            for dct in pos_id_mapping.values():
+                dct.pop('created_at_utc', None)
+
+        self.assertEqual( serial_pos_id_mapping, parallel_pos_id_mapping )
+
+if __name__ == '__main__':
+    unittest.main()
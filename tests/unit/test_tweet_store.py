@@ -0,0 +1,102 @@
+import copy
+import os
+import tempfile
+import unittest
+
+from bloc.generator import get_store_timeline_tweets
+from bloc.tweet_store import TweetStore
+from bloc.tweet_store import get_tweet_id_epoch_range
+from bloc.util import getDictFromJsonGZ
+
+class TestTweetStore(unittest.TestCase):
+
+    timeline = getDictFromJsonGZ('./sample-tweets/sample_raw_tweets_1.json.gz')
+    for t in timeline:
+        t['id'] = int(t['id'])
+    timeline = sorted(timeline, key=lambda t: t['id'], reverse=True)
+
+    def setUp(self):
+
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.store = TweetStore( os.path.join(self.tmp_dir.name, 'timeline_tweets.sqlite') )
+        self.live_timeline = TestTweetStore.timeline[5:]
+        self.fetches = []
+        self.following_lookup = False
+
+    def tearDown(self):
+        self.store.close()
+        self.tmp_dir.cleanup()
+
+    def fetch_tweets(self, pages, since_id=None, max_id=None):
+
+        self.fetches.append( (pages, since_id, max_id) )
+        tweets = [ copy.deepcopy(t) for t in self.live_timeline if (since_id is None or t['id'] > since_id) and (max_id is None or t['id'] <= max_id) ]
+        for t in tweets:
+            #friendship details of following_lookup fetches
+            t['bloc'] = {'src_follows_tgt': self.following_lookup or None, 'tgt_follows_src': self.following_lookup or None}
+
+        return tweets[:pages*20]
+
+    def get_ids(self, tweets):
+        return [ t['id'] for t in tweets ]
+
+    def get_tweets(self, max_pages, cache_max_age=None, timeline_window=(), cache_read=True):
+        return get_store_timeline_tweets(self.store, 'user_a', self.fetch_tweets, max_pages=max_pages, page_size=20, following_lookup=self.following_lookup, timeline_window=timeline_window, cache_read=cache_read, cache_max_age=cache_max_age)
+
+    def test_incremental_reuse(self):
+
+        tweets, cache_hit = self.get_tweets(1)
+        self.assertFalse( cache_hit )
+        self.assertEqual( self.get_ids(tweets), self.get_ids(self.live_timeline[:20]) )
+
+        #different max_pages reuses cached tweets and fetches only the older page
+        tweets, cache_hit = self.get_tweets(2)
+        self.assertEqual( self.get_ids(tweets), self.get_ids(self.live_timeline[:40]) )
+        self.assertEqual( self.fetches[-1], (1, None, self.live_timeline[19]['id'] - 1) )
+
+        tweets, cache_hit = self.get_tweets(1)
+        self.assertTrue( cache_hit )
+        self.assertEqual( len(self.fetches), 2 )
+
+        #new tweets are fetched with since_id when the cache is stale
+        self.live_timeline = TestTweetStore.timeline
+        tweets, cache_hit = self.get_tweets(2, cache_max_age=-1)
+        self.assertEqual( self.get_ids(tweets), self.get_ids(self.live_timeline[:40]) )
+        self.assertEqual( self.fetches[-1], (2, TestTweetStore.timeline[5]['id'], None) )
+
+        #time window inside the cached span is read without fetching
+        min_id, max_id, min_epoch, max_epoch = get_tweet_id_epoch_range( self.live_timeline[10:30] )
+        tweets, cache_hit = self.get_tweets(1, timeline_window=(min_epoch, max_epoch))
+        self.assertTrue( cache_hit )
+        self.assertEqual( self.get_ids(tweets), self.get_ids(self.live_timeline[10:30]) )
+
+    def test_following_lookup_not_overwritten(self):
+
+        min_id, max_id, min_epoch, max_epoch = get_tweet_id_epoch_range( self.live_timeline[:15] )
+        for timeline_window in [(), (min_epoch, max_epoch)]:
+
+            self.following_lookup = True
+            self.get_tweets(1, timeline_window=timeline_window)
+
+            #the same tweets fetched without following_lookup (cache-write-only run) do not replace the friendship details
+            self.following_lookup = False
+            tweets, cache_hit = self.get_tweets(1, timeline_window=timeline_window, cache_read=False)
+            self.assertEqual( tweets[0]['bloc']['src_follows_tgt'], None )
+
+            self.following_lookup = True
+            fetch_count = len(self.fetches)
+            tweets, cache_hit = self.get_tweets(1, timeline_window=timeline_window)
+            self.assertTrue( cache_hit )
+            self.assertEqual( len(self.fetches), fetch_count )
+            self.assertTrue( all(t['bloc']['src_follows_tgt'] is True for t in tweets) )
+
+        #tweets without friendship details are updated by following_lookup fetches
+        self.following_lookup = False
+        self.live_timeline = TestTweetStore.timeline
+        self.get_tweets(1, cache_read=False)
+        self.following_lookup = True
+        self.get_tweets(1, cache_read=False)
+        self.assertTrue( all(t['bloc']['src_follows_tgt'] is True for t in self.store.get_tweets('user_a', max_id=self.live_timeline[0]['id'], limit=20)) )
+
+if __name__ == '__main__':
+    unittest.main()